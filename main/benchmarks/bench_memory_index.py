@@ -0,0 +1,73 @@
+"""记忆向量索引基准测试：10k / 100k 条记忆下的查询延迟
+
+用法（在 main 目录下）：python benchmarks/bench_memory_index.py
+"""
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from memory_index import HashingEmbedder, VectorIndex  # noqa: E402
+
+SIZES = (10_000, 100_000)
+QUERIES = 200
+DIM = 256
+
+
+def random_unit_vectors(rng, n, dim):
+    vectors = rng.standard_normal((n, dim)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors
+
+
+def bench_embed():
+    """哈希向量化的单条耗时"""
+    embedder = HashingEmbedder(dim=DIM)
+    text = "今天和从雨一起去看了樱花，晚上还吃了拉面，感觉非常开心。" * 2
+    start = time.perf_counter()
+    for _ in range(1000):
+        embedder.embed(text)
+    elapsed = (time.perf_counter() - start) / 1000
+    print(f"哈希向量化: {elapsed * 1e6:.1f} µs/条 ({len(text)} 字)")
+
+
+def bench_index(size, kind, tmp_dir):
+    rng = np.random.default_rng(size)
+    index = VectorIndex(os.path.join(tmp_dir, f"{kind}_{size}"), dim=DIM, kind=kind)
+
+    data = random_unit_vectors(rng, size, DIM)
+    start = time.perf_counter()
+    for i, vector in enumerate(data, 1):
+        index.add(i, vector)
+    index.flush()
+    build = time.perf_counter() - start
+
+    queries = random_unit_vectors(rng, QUERIES, DIM)
+    index.search(queries[0], 5)  # IVF 首次查询时训练
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        index.search(query, 5)
+        latencies.append(time.perf_counter() - start)
+
+    latencies = np.array(latencies) * 1000
+    print(
+        f"{kind:>4} n={size:>7}: 写入 {build:.2f}s, "
+        f"查询 p50 {np.percentile(latencies, 50):.2f} ms, p95 {np.percentile(latencies, 95):.2f} ms"
+    )
+
+
+def main():
+    bench_embed()
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for size in SIZES:
+            for kind in ("flat", "ivf"):
+                bench_index(size, kind, tmp_dir)
+
+
+if __name__ == "__main__":
+    main()
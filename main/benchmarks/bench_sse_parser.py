@@ -0,0 +1,103 @@
+"""流式响应解析基准测试：ChatStreamParser 与旧的逐行解析的单块开销
+
+用法（在 main 目录下）：python benchmarks/bench_sse_parser.py
+"""
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sse_parser import ChatStreamParser, SSEParser  # noqa: E402
+
+CHUNKS = 20_000
+REPEAT = 5
+
+
+def build_stream():
+    """模拟服务端的SSE字节流，并按随机大小切分成网络读取块"""
+    lines = []
+    for i in range(CHUNKS):
+        chunk = {
+            "id": "chatcmpl-bench",
+            "object": "chat.completion.chunk",
+            "created": 0,
+            "model": "deepseek-ai/DeepSeek-V3",
+            "choices": [{"index": 0, "delta": {"content": "本座"[i % 2]}, "finish_reason": None}]
+        }
+        lines.append(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n")
+    lines.append("data: [DONE]\n\n")
+    data = "".join(lines).encode("utf-8")
+
+    rng = random.Random(0)
+    reads = []
+    pos = 0
+    while pos < len(data):
+        size = rng.randint(64, 1024)
+        reads.append(data[pos:pos + size])
+        pos += size
+    return reads
+
+
+def old_parser(reads):
+    """基线：旧版的 iter_lines + 去掉 'data: ' + json.loads"""
+    pending = b""
+    contents = []
+    for raw in reads:
+        pending += raw
+        lines = pending.split(b"\n")
+        pending = lines.pop()
+        for line in lines:
+            if line:
+                decoded_line = line.decode('utf-8')
+                if decoded_line.startswith('data: '):
+                    try:
+                        chunk = json.loads(decoded_line[6:])
+                        if chunk.get("object") == "chat.completion.chunk":
+                            if 'content' in chunk['choices'][0]['delta']:
+                                contents.append(chunk['choices'][0]['delta']['content'])
+                    except json.JSONDecodeError:
+                        pass
+    return contents
+
+
+def new_parser(reads):
+    parser = ChatStreamParser()
+    contents = []
+    for raw in reads:
+        contents.extend(parser.feed(raw))
+        if parser.done:
+            break
+    return contents
+
+
+def framing_only(reads):
+    """只做SSE分帧，不解析JSON，用于衡量解析器自身的开销"""
+    parser = SSEParser()
+    events = []
+    for raw in reads:
+        events.extend(parser.feed(raw))
+    return events[:-1]  # 去掉 [DONE]
+
+
+def bench(name, func, reads):
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        contents = func(reads)
+        best = min(best, time.perf_counter() - start)
+    assert len(contents) == CHUNKS
+    print(f"{name}: {best * 1e6 / CHUNKS:.2f} µs/块 (共 {CHUNKS} 块, {len(reads)} 次读取)")
+
+
+def main():
+    reads = build_stream()
+    bench("旧版逐行解析", old_parser, reads)
+    bench("ChatStreamParser", new_parser, reads)
+    bench("SSEParser 仅分帧", framing_only, reads)
+
+
+if __name__ == "__main__":
+    main()
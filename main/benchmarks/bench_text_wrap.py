@@ -0,0 +1,103 @@
+"""气泡换行基准测试：旧的逐字整行测量 与 字符宽度缓存 + 线性换行 在1000字中文文本上的对比
+
+用法（在 main 目录下）：python benchmarks/bench_text_wrap.py
+有图形界面时使用真实的 Tk 字体测量；没有显示器时用按字符累加宽度的模拟测量（只能比较调用次数的量级）。
+"""
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from text_wrap import GlyphWidthCache, wrap_lines  # noqa: E402
+
+TEXT_LENGTH = 1000
+MAX_WIDTH = 230
+REPEAT = 5
+
+
+class SimulatedFont:
+    """模拟 tkFont.Font.measure：耗时与文本长度成正比"""
+
+    def measure(self, text):
+        return sum(8 if ord(char) < 128 else 16 for char in text)
+
+
+def load_font():
+    try:
+        import tkinter as tk
+        from tkinter import font as tkFont
+        root = tk.Tk()
+        root.withdraw()
+        return tkFont.Font(root=root, family="Microsoft YaHei", size=12), "Tk"
+    except Exception:
+        return SimulatedFont(), "模拟"
+
+
+def build_text():
+    rng = random.Random(0)
+    chars = "本座今天心情很好你在做什么呢要不要陪我聊聊天气不错我们出去走走吧"
+    punctuation = "，。！？"
+    text = []
+    for i in range(TEXT_LENGTH):
+        text.append(rng.choice(punctuation) if i % 12 == 11 else rng.choice(chars))
+    return "".join(text)
+
+
+def old_wrap(text, font):
+    """基线：旧版 Bubble.wrap_text，每个字符都测量一次当前整行，之后再逐行测量行宽"""
+    lines = []
+    current_line = ""
+    for char in text:
+        test_line = current_line + char
+        line_width = font.measure(test_line)
+        if line_width > MAX_WIDTH or char == '\n':
+            lines.append(current_line)
+            current_line = char if char != '\n' else ""
+        else:
+            current_line = test_line
+    if current_line:
+        lines.append(current_line)
+    widths = [font.measure(line) for line in lines]
+    return lines, widths
+
+
+def new_wrap(text, font):
+    # 每次新建缓存，计入首次测量字符宽度的开销
+    glyphs = GlyphWidthCache(font.measure)
+    lines = wrap_lines(text, MAX_WIDTH, glyphs)
+    return [line.text for line in lines], [line.width for line in lines]
+
+
+class CountingFont:
+    def __init__(self, font):
+        self.font = font
+        self.calls = 0
+
+    def measure(self, text):
+        self.calls += 1
+        return self.font.measure(text)
+
+
+def bench(name, func, text, font):
+    counter = CountingFont(font)
+    lines, _ = func(text, counter)
+    best = float("inf")
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func(text, font)
+        best = min(best, time.perf_counter() - start)
+    print(f"{name}: {best * 1000:.2f} ms, measure 调用 {counter.calls} 次, {len(lines)} 行")
+
+
+def main():
+    font, kind = load_font()
+    text = build_text()
+    print(f"字体测量: {kind}, 文本 {len(text)} 字, 最大行宽 {MAX_WIDTH}px")
+    bench("旧版逐字整行测量", old_wrap, text, font)
+    bench("字符宽度缓存 + 线性换行", new_wrap, text, font)
+
+
+if __name__ == "__main__":
+    main()
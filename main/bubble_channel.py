@@ -0,0 +1,90 @@
+import threading
+import time
+
+
+class BubbleChannel:
+    """流式回复的气泡更新通道
+
+    只发送增量文本，并按 fps 合并：同一帧内到达的多个片段合成一条消息。
+    帧间隔内没有新片段时由定时器补发剩余部分，回复结束时总会发送完整的最终文本。
+
+    消息格式：
+        {'delta': 文本, 'new': True}   新回复的第一段，接收端清空旧文本
+        {'delta': 文本}                追加到当前文本
+        {'text': 全文, 'final': True}  最终文本，接收端直接替换
+    """
+
+    def __init__(self, bubble_queue, fps=30.0):
+        self.bubble_queue = bubble_queue
+        self.interval = 1.0 / fps if fps > 0 else 0.0
+        self.lock = threading.Lock()
+        self.pending = []
+        self.is_new = True
+        self.last_flush = 0.0
+        self.timer = None
+
+        # 统计：本轮发送的消息数和字符数
+        self.messages_sent = 0
+        self.chars_sent = 0
+
+    def begin(self):
+        """开始一轮新的回复"""
+        with self.lock:
+            self._cancel_timer()
+            self.pending = []
+            self.is_new = True
+            self.messages_sent = 0
+            self.chars_sent = 0
+
+    def append(self, delta):
+        """追加一个流式片段，到达帧间隔时发送"""
+        if not delta:
+            return
+        with self.lock:
+            self.pending.append(delta)
+            wait = self.last_flush + self.interval - time.time()
+            if wait <= 0:
+                self._flush()
+            elif self.timer is None:
+                # 帧内剩余的片段由定时器补发
+                self.timer = threading.Timer(wait, self._flush_from_timer)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def _flush_from_timer(self):
+        with self.lock:
+            self.timer = None
+            self._flush()
+
+    def _flush(self):
+        """发送累积的增量（调用时需持有锁）"""
+        if not self.pending:
+            return
+        message = {'delta': "".join(self.pending)}
+        if self.is_new:
+            message['new'] = True
+            self.is_new = False
+        self.pending = []
+        self.last_flush = time.time()
+        self._put(message, len(message['delta']))
+
+    def send_final(self, text):
+        """发送最终文本，丢弃尚未发送的增量"""
+        with self.lock:
+            self._cancel_timer()
+            self.pending = []
+            self.is_new = True
+            self._put({'text': text, 'final': True}, len(text))
+
+    def _cancel_timer(self):
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+
+    def _put(self, message, chars):
+        try:
+            self.bubble_queue.put(message)
+            self.messages_sent += 1
+            self.chars_sent += chars
+        except Exception as e:
+            print(f"发送气泡更新失败: {str(e)}")
@@ -0,0 +1,72 @@
+from collections import OrderedDict
+
+from PIL import Image, ImageDraw, ImageTk
+
+
+class BubbleImageCache:
+    """气泡背景和跳动指示器的 PhotoImage 缓存
+
+    背景按 (宽度档位, 高度, 颜色, 圆角, 透明度) 缓存，最近最少使用的先淘汰；
+    宽度向上取整到 width_step 的倍数，流式输出时气泡逐字变宽也能复用同一张图。
+    指示器按尺寸缓存，创建后一直保留（通常只有一种尺寸）。
+    必须在 Tk 线程中使用（PhotoImage 需要已创建的 Tk 根窗口）。
+    """
+
+    def __init__(self, max_entries=16, width_step=16, max_width=None):
+        self.max_entries = max(1, max_entries)
+        self.width_step = max(1, width_step)
+        self.max_width = max_width
+        self.images = OrderedDict()
+        self.indicators = {}  # 尺寸 -> 指示器 PhotoImage
+
+        # 统计：命中和新绘制的次数
+        self.hits = 0
+        self.misses = 0
+
+    def quantize_width(self, width):
+        """把宽度向上取整到档位，不超过最大宽度"""
+        step = self.width_step
+        width = int(-(-width // step) * step)
+        if self.max_width is not None:
+            width = min(width, int(self.max_width))
+        return width
+
+    def get_background(self, width, height, color, radius, alpha):
+        """获取指定尺寸的圆角矩形背景，width 应已经过 quantize_width"""
+        key = (int(width), int(height), color, radius, alpha)
+        photo = self.images.get(key)
+        if photo is not None:
+            self.images.move_to_end(key)
+            self.hits += 1
+            return photo
+
+        self.misses += 1
+        photo = ImageTk.PhotoImage(self._draw_background(*key))
+        self.images[key] = photo
+        if len(self.images) > self.max_entries:
+            self.images.popitem(last=False)
+        return photo
+
+    @staticmethod
+    def _draw_background(width, height, color, radius, alpha):
+        # 创建一个半透明的图像作为气泡背景
+        fill = tuple(color) + (alpha,)
+        bubble_img = Image.new('RGBA', (width, height), fill)
+        draw = ImageDraw.Draw(bubble_img)
+
+        # 绘制圆角矩形
+        draw.rounded_rectangle([(0, 0), (width, height)], radius=radius, fill=fill)
+        return bubble_img
+
+    def get_indicator(self, size=10):
+        """跳动指示器（小三角形），每种尺寸只绘制一次"""
+        photo = self.indicators.get(size)
+        if photo is None:
+            indicator_img = Image.new('RGBA', (size, size), (0, 0, 0, 0))
+            draw = ImageDraw.Draw(indicator_img)
+            draw.polygon([(0, size), (size, size), (size // 2, 0)], fill=(255, 100, 100, 200))
+            photo = self.indicators[size] = ImageTk.PhotoImage(indicator_img)
+        return photo
+
+    def clear(self):
+        self.images.clear()
@@ -0,0 +1,172 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class OperationCancelled(Exception):
+    """操作被取消（例如用户在视觉分析过程中输入了新消息）"""
+
+
+class CancelToken:
+    """取消令牌：由一方调用 cancel()，执行方检查 cancelled 或注册回调"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.lock = threading.Lock()
+        self.callbacks = []
+        self.reason = None
+
+    @property
+    def cancelled(self):
+        return self.event.is_set()
+
+    def cancel(self, reason="已取消"):
+        """取消并调用所有回调，重复调用无效果"""
+        with self.lock:
+            if self.event.is_set():
+                return False
+            self.reason = reason
+            self.event.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"取消回调出错: {str(e)}")
+        return True
+
+    def on_cancel(self, callback):
+        """注册取消时的回调（已取消时立即调用），返回用于注销的函数"""
+        with self.lock:
+            if not self.event.is_set():
+                self.callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def _remove(self, callback):
+        with self.lock:
+            try:
+                self.callbacks.remove(callback)
+            except ValueError:
+                pass
+
+    def raise_if_cancelled(self):
+        if self.event.is_set():
+            raise OperationCancelled(self.reason)
+
+    def wait(self, timeout=None):
+        """等待取消，被取消时返回 True"""
+        return self.event.wait(timeout)
+
+
+class StageStats:
+    """单个阶段的统计"""
+
+    __slots__ = ("runs", "aborts", "failures", "total_time", "last_time")
+
+    def __init__(self):
+        self.runs = 0         # 正常完成次数
+        self.aborts = 0       # 被取消次数
+        self.failures = 0     # 出错次数
+        self.total_time = 0.0
+        self.last_time = 0.0
+
+    @property
+    def average_time(self):
+        return self.total_time / self.runs if self.runs else 0.0
+
+
+class CancellablePipeline:
+    """可取消的分阶段流水线
+
+    每次运行前调用 begin() 得到新的取消令牌，各阶段用 run_stage() 交给工作线程执行，
+    调用方线程只等待“阶段完成”或“令牌被取消”中先发生的一个，取消时立即返回。
+    阶段函数的第一个参数是令牌，耗时的计算可以自行检查；网络请求通过 on_cancel 回调中止。
+    """
+
+    def __init__(self, name, workers=2):
+        self.name = name
+        # 被取消的阶段可能还在工作线程里收尾，多留一个线程，不阻塞下一次运行
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+        self.lock = threading.Lock()
+        self.token = None
+        self.stats = {}
+        self.runs = 0
+        self.aborted_runs = 0
+
+    def begin(self):
+        """开始新的一次运行，返回本次的取消令牌"""
+        with self.lock:
+            self.token = CancelToken()
+            self.runs += 1
+            return self.token
+
+    def cancel(self, reason="已取消"):
+        """取消当前运行，没有正在进行的运行时返回 False"""
+        with self.lock:
+            token = self.token
+        if token is None or not token.cancel(reason):
+            return False
+        with self.lock:
+            self.aborted_runs += 1
+        return True
+
+    def finish(self, token):
+        """本次运行结束"""
+        with self.lock:
+            if self.token is token:
+                self.token = None
+
+    def _stage_stats(self, stage):
+        stats = self.stats.get(stage)
+        if stats is None:
+            stats = self.stats[stage] = StageStats()
+        return stats
+
+    def run_stage(self, token, stage, func, *args):
+        """在工作线程中执行 func(token, *args)，返回结果；被取消时抛出 OperationCancelled"""
+        token.raise_if_cancelled()
+
+        done = threading.Event()
+        start = time.perf_counter()
+        future = self.executor.submit(func, token, *args)
+        future.add_done_callback(lambda f: done.set())
+        remove = token.on_cancel(done.set)
+        try:
+            done.wait()
+        finally:
+            remove()
+        elapsed = time.perf_counter() - start
+
+        with self.lock:
+            stats = self._stage_stats(stage)
+            if token.cancelled:
+                stats.aborts += 1
+            elif future.exception() is not None:
+                stats.failures += 1
+            else:
+                stats.runs += 1
+                stats.total_time += elapsed
+                stats.last_time = elapsed
+
+        if token.cancelled:
+            # 工作线程里的阶段被中止后结果直接丢弃
+            raise OperationCancelled(f"{stage}: {token.reason}")
+        return future.result()
+
+    def report(self):
+        """各阶段耗时和取消次数"""
+        with self.lock:
+            parts = []
+            for stage, stats in self.stats.items():
+                parts.append(
+                    f"{stage} 最近 {stats.last_time * 1000:.0f} ms / 平均 {stats.average_time * 1000:.0f} ms"
+                    f"（完成 {stats.runs}，取消 {stats.aborts}，失败 {stats.failures}）"
+                )
+            return (f"{self.name}: 运行 {self.runs} 次，取消 {self.aborted_runs} 次；"
+                    + "；".join(parts))
+
+    def shutdown(self):
+        self.cancel("关闭")
+        self.executor.shutdown(wait=False)
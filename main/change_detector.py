@@ -0,0 +1,107 @@
+import configparser
+import time
+
+import numpy as np
+from PIL import Image
+
+
+class FrameSignature:
+    """一帧画面的特征：灰度缩略图和差异哈希"""
+
+    __slots__ = ("gray", "dhash")
+
+    def __init__(self, gray, dhash):
+        self.gray = gray    # (rows*block, cols*block) 的 float32 灰度图
+        self.dhash = dhash  # 64 位差异哈希
+
+
+class ChangeResult:
+    """与上次分析的画面相比的变化程度"""
+
+    def __init__(self, signature, changed, hash_distance, changed_fraction, block_map):
+        self.signature = signature
+        self.changed = changed
+        self.hash_distance = hash_distance        # 哈希的汉明距离（0~64）
+        self.changed_fraction = changed_fraction  # 发生变化的块的比例
+        self.block_map = block_map                # (rows, cols) 布尔数组，True 表示该块有变化
+
+    def describe(self):
+        return f"哈希距离 {self.hash_distance}, 变化区域 {self.changed_fraction * 100:.1f}%"
+
+
+class ScreenChangeDetector:
+    """屏幕变化检测：感知哈希 + 分块灰度差异
+
+    只和上一次真正送去分析的画面比较，画面缓慢变化时差异会逐渐累积，最终触发分析。
+    哈希距离或变化块比例任一超过阈值即视为有变化；超过 max_age 秒也会强制重新分析。
+    """
+
+    HASH_SIZE = 8  # 8x8 = 64 位哈希
+
+    def __init__(self, hash_threshold=6, block_threshold=0.03, block_delta=12.0,
+                 grid=(16, 16), block_size=8, max_age=1800.0):
+        self.hash_threshold = hash_threshold
+        self.block_threshold = block_threshold
+        self.block_delta = block_delta
+        self.rows, self.cols = grid
+        self.block_size = block_size
+        self.max_age = max_age
+
+        self.last = None
+        self.last_time = 0.0
+
+    @classmethod
+    def from_config(cls, parser: configparser.ConfigParser):
+        """根据config.ini的[Visual]部分创建，未启用时返回 None"""
+        if not parser.getboolean('Visual', 'change_detection', fallback=True):
+            return None
+        return cls(
+            hash_threshold=parser.getint('Visual', 'change_hash_threshold', fallback=6),
+            block_threshold=parser.getfloat('Visual', 'change_block_threshold', fallback=0.03),
+            block_delta=parser.getfloat('Visual', 'change_block_delta', fallback=12.0),
+            max_age=parser.getfloat('Visual', 'change_max_age', fallback=1800.0)
+        )
+
+    def signature(self, image):
+        """计算画面特征"""
+        gray = image.convert('L')
+        size = (self.cols * self.block_size, self.rows * self.block_size)
+        thumb = np.asarray(gray.resize(size, Image.BOX), dtype=np.float32)
+
+        # 差异哈希：每行相邻像素比较亮度
+        small = np.asarray(gray.resize((self.HASH_SIZE + 1, self.HASH_SIZE), Image.BOX), dtype=np.int16)
+        bits = (small[:, 1:] > small[:, :-1]).flatten()
+        dhash = int(np.packbits(bits).view('>u8')[0])
+        return FrameSignature(thumb, dhash)
+
+    def compare(self, image):
+        """与上次分析的画面比较，返回 ChangeResult"""
+        signature = self.signature(image)
+        if self.last is None:
+            block_map = np.ones((self.rows, self.cols), dtype=bool)
+            return ChangeResult(signature, True, 64, 1.0, block_map)
+
+        hash_distance = bin(signature.dhash ^ self.last.dhash).count('1')
+
+        # 分块平均绝对差
+        diff = np.abs(signature.gray - self.last.gray)
+        blocks = diff.reshape(self.rows, self.block_size, self.cols, self.block_size).mean(axis=(1, 3))
+        block_map = blocks > self.block_delta
+        changed_fraction = float(block_map.mean())
+
+        expired = self.max_age > 0 and time.time() - self.last_time > self.max_age
+        changed = (
+            expired
+            or hash_distance >= self.hash_threshold
+            or changed_fraction >= self.block_threshold
+        )
+        return ChangeResult(signature, changed, hash_distance, changed_fraction, block_map)
+
+    def commit(self, signature):
+        """记录已送去分析的画面，作为之后比较的基准"""
+        self.last = signature
+        self.last_time = time.time()
+
+    def reset(self):
+        self.last = None
+        self.last_time = 0.0
@@ -2,26 +2,36 @@ import os
 import random
 import tkinter as tk
 from tkinter import font as tkFont
-from PIL import Image, ImageTk, ImageDraw, ImageFont
 import configparser
-import multiprocessing
-import queue
-import time
-import math
 import subprocess
 import sys
-from time_display import run_time_display
+from time_display import TimeDisplay
 from music_player import MusicPlayer
+from text_wrap import GlyphWidthCache, wrap_lines
+from bubble_images import BubbleImageCache
+from sprite_manager import SpriteManager
+from sprite_cache import SpriteDiskCache
+from sprite_catalog import SpriteCatalog
+from queue_bridge import QueueBridge
 
 class Bubble:
-    def __init__(self, canvas, config):
+    def __init__(self, canvas, config, images=None):
         self.canvas = canvas
         self.config = config
         self.text = ""
         self.visible = False
         self.bubble_id = None
         self.text_ids = []  # 存储所有文本ID的列表
+        self.text_tag = f"bubble_text_{id(self)}"  # 本气泡所有文本行共用的标签，便于整体平移
         self.position = (0, 0)
+
+        # 增量排版状态：已排好的行、行宽、对应的文本和当前背景尺寸
+        self.lines = []
+        self.line_widths = []
+        self.line_starts = []  # 每行在 self.text 中的起始位置
+        self.rendered_text = ""
+        self.bubble_size = None
+        self.text_origin = None  # 第一行文本的坐标
         self.font = tkFont.Font(
             family=self.config.get('UI', 'bubble_font', fallback='Microsoft YaHei'),
             size=self.config.getint('UI', 'bubble_font_size', fallback=12)
@@ -30,6 +40,13 @@ class Bubble:
         self.bg_color = self.config.get('UI', 'bubble_bg_color', fallback='rgba(255, 255, 255, 200)')
         self.corner_radius = self.config.getint('UI', 'bubble_corner_radius', fallback=10)
         self.max_width = 230  # 固定为230像素，超过换行
+        self.glyphs = GlyphWidthCache(self.font.measure)  # 字符宽度缓存，字体固定后每个字符只测量一次
+        # 背景和指示器图像缓存
+        self.images = images or BubbleImageCache(
+            max_entries=self.config.getint('UI', 'bubble_cache_size', fallback=16),
+            width_step=self.config.getint('UI', 'bubble_width_step', fallback=16),
+            max_width=self.max_width + 20  # 含两侧内边距
+        )
         self.line_height = self.font.metrics("linespace")  # 获取行高
         self.ascent = self.font.metrics("ascent")  # 获取字体基线以上的高度
 
@@ -89,6 +106,14 @@ class Bubble:
             self.canvas.delete(text_id)
         self.text_ids = []
 
+        # 清空排版状态，下次显示时重新排版
+        self.lines = []
+        self.line_widths = []
+        self.line_starts = []
+        self.rendered_text = ""
+        self.bubble_size = None
+        self.text_origin = None
+
         self.visible = False
 
     def update_text(self, new_text):
@@ -100,64 +125,112 @@ class Bubble:
         if self.visible:
             self.update_bubble()
 
-    def wrap_text(self):
+    def wrap_text(self, text=None):
         """将文本换行以适应最大宽度"""
-        if not self.text.strip():
+        if text is None:
+            text = self.text
+        if not text.strip():
             return []
+        return [line.text for line in self.layout_lines(text)]
 
-        lines = []
-        current_line = ""
+    def layout_lines(self, text=None, offset=0):
+        """排版文本，返回带行宽和起始位置的 WrappedLine 列表
 
-        # 按字符换行，确保精确控制
-        for char in self.text:
-            test_line = current_line + char
-            # 测量当前行宽度
-            line_width = self.font.measure(test_line)
-
-            # 如果超过最大宽度或者遇到换行符
-            if line_width > self.max_width or char == '\n':
-                lines.append(current_line)
-                current_line = char if char != '\n' else ""
-            else:
-                current_line = test_line
-
-        # 添加最后一行
-        if current_line:
-            lines.append(current_line)
+        字符宽度来自缓存，单次线性扫描完成，不再对每个前缀整行测量。
+        offset 为 text 在完整文本中的起始位置，用于增量排版时换算行起点。
+        """
+        if text is None:
+            text = self.text
 
+        lines = wrap_lines(text, self.max_width, self.glyphs)
+        if offset:
+            for line in lines:
+                line.start += offset
         return lines
 
     def update_bubble(self):
-        # 先删除旧的气泡和文本
-        if self.bubble_id:
-            self.canvas.delete(self.bubble_id)
-            self.bubble_id = None
-
-        # 删除所有文本项
-        for text_id in self.text_ids:
-            self.canvas.delete(text_id)
-        self.text_ids = []
+        """增量更新气泡：已排好的行保持不动，只重新排版最后一行及新增文本"""
+        text = self.text
+        if not text.strip():  # 没有可显示的文本，隐藏气泡
+            self.hide()
+            return
 
-        # 计算文本尺寸 - 确保文本不为空
-        text_lines = self.wrap_text()
-        if not text_lines:  # 如果没有文本行，则隐藏气泡
+        if self.lines and text.startswith(self.rendered_text):
+            # 流式追加：前面的行不会再变，从最后一行的起点开始重新排版
+            first_changed = len(self.lines) - 1
+            tail_start = self.line_starts[-1]
+            layout = self.layout_lines(text[tail_start:], tail_start)
+            lines = self.lines[:first_changed] + [line.text for line in layout]
+            widths = self.line_widths[:first_changed] + [line.width for line in layout]
+            starts = self.line_starts[:first_changed] + [line.start for line in layout]
+        else:
+            # 文本被替换：全部重新排版
+            first_changed = 0
+            layout = self.layout_lines(text)
+            lines = [line.text for line in layout]
+            widths = [line.width for line in layout]
+            starts = [line.start for line in layout]
+
+        if not lines:  # 如果没有文本行，则隐藏气泡
             self.hide()
             return
 
-        # 计算最大行宽和总高度
-        max_line_width = 0
-        for line in text_lines:
-            line_width = self.font.measure(line)
-            if line_width > max_line_width:
-                max_line_width = line_width
+        self.lines = lines
+        self.line_widths = widths
+        self.line_starts = starts
+        self.rendered_text = text
 
-        total_height = len(text_lines) * self.line_height
+        # 计算最大行宽和总高度
+        max_line_width = max(widths)
+        total_height = len(lines) * self.line_height
 
         # 计算气泡尺寸
         padding = 10
-        bubble_width = min(max_line_width + 2 * padding, self.max_width + 2 * padding)
+        # 宽度按档位取整，流式输出时逐字变宽也能复用同一张背景
+        bubble_width = self.images.quantize_width(min(max_line_width + 2 * padding, self.max_width + 2 * padding))
         bubble_height = total_height + 2 * padding
 
+        # 只有尺寸变化时才重新定位和重绘背景
+        if (bubble_width, bubble_height) != self.bubble_size:
+            self.bubble_size = (bubble_width, bubble_height)
+            self._place_background(bubble_width, bubble_height)
+
+        x, y = self.position
+        start_y = y - total_height / 2 + self.ascent
+
+        # 整体平移已有的文本行（气泡变高时垂直居中位置会变化）
+        origin = (x, start_y)
+        if self.text_origin and origin != self.text_origin and self.text_ids:
+            self.canvas.move(
+                self.text_tag,
+                origin[0] - self.text_origin[0],
+                origin[1] - self.text_origin[1]
+            )
+        self.text_origin = origin
+
+        # 删除多余的文本项
+        for text_id in self.text_ids[len(lines):]:
+            self.canvas.delete(text_id)
+        del self.text_ids[len(lines):]
+
+        # 只更新发生变化的行：已有的用itemconfig原地修改，新行才创建
+        for i in range(first_changed, len(lines)):
+            if i < len(self.text_ids):
+                self.canvas.itemconfig(self.text_ids[i], text=lines[i])
+            else:
+                text_id = self.canvas.create_text(
+                    x,
+                    start_y + i * self.line_height,
+                    text=lines[i],
+                    fill=self.text_color,
+                    font=self.font,
+                    anchor="center",
+                    tags=("bubble_text", self.text_tag)
+                )
+                self.text_ids.append(text_id)
+
+    def _place_background(self, bubble_width, bubble_height):
+        """根据气泡尺寸调整位置并重绘背景"""
         # 确保气泡不会超出立绘边界
         x, y = self.position
         win_width = self.canvas.winfo_width()
@@ -175,20 +248,15 @@ class Bubble:
 
         self.position = (x, y)
 
-        # 创建一个半透明的图像作为气泡背景
-        bubble_img = Image.new('RGBA', (int(bubble_width), int(bubble_height)),
-                               (self.bg_r, self.bg_g, self.bg_b, self.bg_alpha))
-        draw = ImageDraw.Draw(bubble_img)
-
-        # 绘制圆角矩形
-        draw.rounded_rectangle([(0, 0), (bubble_width, bubble_height)],
-                               radius=self.corner_radius,
-                               fill=(self.bg_r, self.bg_g, self.bg_b, self.bg_alpha))
-
-        # 转换为PhotoImage
-        bubble_photo = ImageTk.PhotoImage(bubble_img)
+        # 背景图来自缓存，相同尺寸不再重新绘制和上传
+        bubble_photo = self.images.get_background(
+            bubble_width, bubble_height,
+            (self.bg_r, self.bg_g, self.bg_b), self.corner_radius, self.bg_alpha
+        )
 
         # 在画布上创建气泡
+        if self.bubble_id:
+            self.canvas.delete(self.bubble_id)
         self.bubble_id = self.canvas.create_image(
             x, y,
             image=bubble_photo,
@@ -196,25 +264,8 @@ class Bubble:
         )
         self.canvas.bubble_photo = bubble_photo  # 保持引用
 
-        # 添加文本 - 精确计算位置
-        # 计算文本起始Y位置（垂直居中）
-        start_y = y - total_height / 2 + self.ascent
-
-        for i, line in enumerate(text_lines):
-            # 计算文本行宽度
-            line_width = self.font.measure(line)
-
-            # 创建文本（水平居中）
-            text_id = self.canvas.create_text(
-                x,
-                start_y + i * self.line_height,
-                text=line,
-                fill=self.text_color,
-                font=self.font,
-                anchor="center",
-                tags="bubble_text"
-            )
-            self.text_ids.append(text_id)
+        # 文本保持在背景之上
+        self.canvas.tag_raise(self.text_tag, self.bubble_id)
 
     def show_jump_indicator(self, position=None):
         """显示跳动指示器"""
@@ -230,13 +281,8 @@ class Bubble:
         # 在气泡上方显示
         indicator_y = y - 30
 
-        # 创建指示器图像
-        indicator_img = Image.new('RGBA', (size, size), (0, 0, 0, 0))
-        draw = ImageDraw.Draw(indicator_img)
-        draw.polygon([(0, size), (size, size), (size // 2, 0)], fill=(255, 100, 100, 200))
-
-        # 转换为PhotoImage
-        indicator_photo = ImageTk.PhotoImage(indicator_img)
+        # 指示器图像只创建一次
+        indicator_photo = self.images.get_indicator(size)
 
         # 在画布上创建指示器
         self.jump_indicator_id = self.canvas.create_image(
@@ -262,7 +308,7 @@ class Bubble:
 
 
 class CharacterWindow:
-    def __init__(self, emotion_queue, bubble_queue, config_path='config.ini'):
+    def __init__(self, emotion_queue, bubble_queue, config_path='config.ini', window_rect=None):
         # 加载配置
         self.parser = configparser.ConfigParser()
         self.parser.read(config_path, encoding='utf-8')
@@ -273,6 +319,7 @@ class CharacterWindow:
         # 存储队列
         self.emotion_queue = emotion_queue
         self.bubble_queue = bubble_queue
+        self.window_rect = window_rect  # 与主进程共享的窗口位置 [x, y, 宽, 高]
 
         # 初始化窗口
         self.window = tk.Tk()
@@ -305,16 +352,33 @@ class CharacterWindow:
         # 初始情感状态
         self.current_emotion = "平静"
         self.photo = None
-        self.images_cache = {}  # 图片缓存
+        self.character_id = None
+        self.character_size = None
+
+        # 立绘管理：后台预加载并缩放全部立绘
+        self.catalog = SpriteCatalog.from_config(self.parser)
+        self.animation_timer = None
+        self.sprites = SpriteManager(
+            self.window,
+            self.catalog,
+            self.scale,
+            disk_cache=SpriteDiskCache.from_config(self.parser),
+            resample=self.parser.get('UI', 'sprite_resample', fallback='LANCZOS').upper()
+        )
 
         # 加载初始立绘
         self.update_character_image("平静")
+        self.sprites.start_preload(first=self.catalog.variants.get(self.current_emotion))
 
         # 添加拖动功能
         self.canvas.bind('<Button-1>', self.start_move)
         self.canvas.bind('<ButtonRelease-1>', self.stop_move)
         self.canvas.bind('<B1-Motion>', self.do_move)
 
+        # 窗口移动或改变大小时更新共享的窗口位置
+        if self.window_rect is not None:
+            self.window.bind('<Configure>', self.publish_window_rect)
+
         # 绑定双击事件
         self.canvas.bind('<Double-Button-1>', self.on_double_click)
 
@@ -323,6 +387,7 @@ class CharacterWindow:
         self.context_menu = tk.Menu(self.window, tearoff=0)
         self.context_menu.add_command(label="显示/隐藏播放器", command=self.toggle_music_player)
         self.context_menu.add_command(label="刷新歌曲", command=self.refresh_music)
+        self.context_menu.add_command(label="刷新立绘", command=self.refresh_sprites)
         self.context_menu.add_command(label="打开音乐路径", command=self.open_music_dir)
         self.context_menu.add_separator()
         self.context_menu.add_checkbutton(label="置顶", command=self.toggle_topmost)
@@ -346,14 +411,23 @@ class CharacterWindow:
         # 初始化气泡
         self.bubble = Bubble(self.canvas, self.parser)
         self.bubble_timer = None
+        self.bubble_text = ""  # 由增量消息拼出的当前气泡文本
+
+        # 时间悬浮窗，双击立绘或收到显示请求时出现
+        self.time_display = None
 
         # 创建播放器（初始隐藏）
         self.music_player = MusicPlayer(self.window)
         self.music_player.place_forget()  # 初始隐藏
         self.player_visible = False
 
-        # 启动队列检查
-        self.check_queues()
+        # 队列消息由后台线程转交，收到时才唤醒界面（主循环启动后开始）
+        self.queue_bridge = QueueBridge(
+            self.window,
+            {'emotion': self.emotion_queue, 'bubble': self.bubble_queue},
+            self.handle_messages
+        )
+        self.window.after(0, self.queue_bridge.start)
 
         # 启动主循环
         self.window.mainloop()
@@ -376,6 +450,11 @@ class CharacterWindow:
         """刷新歌曲列表"""
         self.music_player.load_music()
 
+    def refresh_sprites(self):
+        """重新扫描立绘目录（新增或替换立绘后使用）"""
+        self.sprites.reload()
+        self.update_character_image(self.current_emotion)
+
     def open_music_dir(self):
         """打开音乐目录"""
         music_dir = "music"
@@ -410,86 +489,98 @@ class CharacterWindow:
             y = self.window.winfo_y() + deltay
             self.window.geometry(f"+{x}+{y}")
 
+    def publish_window_rect(self, event=None):
+        """把窗口的屏幕位置写入共享数组，供截图选择立绘所在的显示器"""
+        if event is not None and event.widget is not self.window:
+            return
+        self.window_rect[:] = [
+            self.window.winfo_rootx(),
+            self.window.winfo_rooty(),
+            self.window.winfo_width(),
+            self.window.winfo_height()
+        ]
+
     def on_double_click(self, event):
         """双击立绘时触发"""
-        # 通知主进程显示时间
+        self.show_time()
+
+    def show_time(self):
+        """显示时间悬浮窗（首次使用时创建，之后一直复用）"""
         try:
-            # 创建一个临时队列用于通信
-            time_queue = multiprocessing.Queue()
-            time_process = multiprocessing.Process(
-                target=run_time_display,
-                args=(time_queue,)
-            )
-            time_process.start()
-            time_queue.put("show")
-            time_process.join(timeout=0.1)
+            if self.time_display is None:
+                self.time_display = TimeDisplay.from_config(self.window, self.parser)
+            self.time_display.show_time()
         except Exception as e:
             print(f"显示时间失败: {str(e)}")
 
     def close_window(self):
+        self.queue_bridge.stop()
         self.window.destroy()
 
     def update_character_image(self, emotion):
         """更新角色立绘"""
         self.current_emotion = emotion
 
-        # 随机选择1或2
-        image_number = random.randint(1, 2)
+        # 切换表情时停止上一个情感的动画
+        if self.animation_timer:
+            self.window.after_cancel(self.animation_timer)
+            self.animation_timer = None
 
-        # 构建图片路径
-        image_path = os.path.join("images", f"{emotion}_{image_number}.png")
+        animation = self.catalog.animation(emotion)
+        if animation:
+            keys, interval = animation
+            print(f"更新立绘: {emotion} 动画 {len(keys)} 帧 (间隔 {interval} 毫秒, 缩放: {self.scale * 100}%)")
+            self.play_sprite_animation(keys, interval, 0)
+            return
 
-        # 检查文件是否存在
-        if not os.path.exists(image_path):
-            print(f"立绘文件不存在: {image_path}")
+        # 从该情感的所有变体中选择一张
+        key = self.catalog.choose(emotion)
+        if key is None:
+            print(f"没有情感 {emotion} 的立绘: {self.catalog.image_dir}")
             return
 
-        # 使用缓存或加载图片
-        cache_key = f"{emotion}_{image_number}"
-        if cache_key in self.images_cache:
-            pil_image = self.images_cache[cache_key]
-        else:
-            try:
-                # 使用PIL打开带透明通道的图片
-                pil_image = Image.open(image_path)
-
-                # 确保保留透明通道
-                if pil_image.mode != 'RGBA':
-                    pil_image = pil_image.convert('RGBA')
-
-                # 应用缩放
-                if self.scale != 1.0:
-                    new_width = int(pil_image.width * self.scale)
-                    new_height = int(pil_image.height * self.scale)
-                    pil_image = pil_image.resize((new_width, new_height), Image.LANCZOS)
-
-                # 缓存图片
-                self.images_cache[cache_key] = pil_image
-            except Exception as e:
-                print(f"加载立绘失败: {str(e)}")
-                return
-
-        # 更新显示
-        try:
-            self.photo = ImageTk.PhotoImage(pil_image)
-
-            # 更新画布
-            self.canvas.delete("character")
-            self.canvas.create_image(
-                0,
-                0,
-                image=self.photo,
-                anchor="nw",
-                tags="character"
-            )
+        if self.show_sprite(key):
+            print(f"更新立绘: {key}.png (缩放: {self.scale * 100}%)")
 
-            # 更新窗口尺寸以适应图片
-            self.window.geometry(f"{pil_image.width}x{pil_image.height}")
+    def play_sprite_animation(self, keys, interval, index):
+        """循环播放动画序列，直到表情再次切换"""
+        self.show_sprite(keys[index])
+        self.animation_timer = self.window.after(
+            interval, self.play_sprite_animation, keys, interval, (index + 1) % len(keys)
+        )
 
-            print(f"更新立绘: {emotion}_{image_number}.png (缩放: {self.scale * 100}%)")
+    def show_sprite(self, key):
+        """显示一张立绘，成功返回 True"""
+        # 预加载完成后直接取现成的 PhotoImage
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            return False
+        photo, size = sprite
+
+        # 更新显示：只替换画布上已有图像项的图片
+        try:
+            self.photo = photo
+            if self.character_id is None:
+                self.character_id = self.canvas.create_image(
+                    0,
+                    0,
+                    image=self.photo,
+                    anchor="nw",
+                    tags="character"
+                )
+                self.canvas.tag_lower(self.character_id)
+            else:
+                self.canvas.itemconfig(self.character_id, image=self.photo)
+
+            # 尺寸变化时才调整窗口
+            if size != self.character_size:
+                self.character_size = size
+                self.window.geometry(f"{size[0]}x{size[1]}")
+            return True
 
         except Exception as e:
             print(f"显示立绘失败: {str(e)}")
+            return False
 
     def play_jump_animation(self):
         """播放立绘跳动动画"""
@@ -561,39 +652,44 @@ class CharacterWindow:
         """隐藏气泡"""
         self.bubble.hide()
 
-    def check_queues(self):
-        """检查队列中的消息"""
-        try:
-            # 检查情感队列
-            while True:
-                emotion = self.emotion_queue.get_nowait()
-                print(f"收到情感更新: {emotion}")
-                self.update_character_image(emotion)
-        except queue.Empty:
-            pass
-
-        try:
-            # 检查气泡队列
-            while True:
-                bubble_data = self.bubble_queue.get_nowait()
-                # 处理跳动信号
-                if 'jump' in bubble_data and bubble_data['jump']:
-                    print("收到跳动信号")
-                    self.play_jump_animation()
-                    # 显示跳动指示器
-                    self.bubble.show_jump_indicator()
-                # 处理文本更新
-                elif 'text' in bubble_data:
-                    text = bubble_data.get('text', '')
-                    print(f"收到气泡消息: {text}")
-                    self.update_bubble(text)
-        except queue.Empty:
-            pass
-
-        # 每100毫秒检查一次
-        self.window.after(100, self.check_queues)
-
-
-def run_character_window(emotion_queue, bubble_queue):
+    def handle_messages(self, messages):
+        """处理队列桥转来的一批消息"""
+        # 一批中的气泡消息合并处理，文本只在最后重绘一次
+        text_changed = False
+        for source, data in messages:
+            # 情感更新
+            if source == 'emotion':
+                print(f"收到情感更新: {data}")
+                self.update_character_image(data)
+                continue
+
+            bubble_data = data
+            # 显示时间
+            if bubble_data.get('show_time'):
+                self.show_time()
+            # 处理跳动信号
+            elif 'jump' in bubble_data and bubble_data['jump']:
+                print("收到跳动信号")
+                self.play_jump_animation()
+                # 显示跳动指示器
+                self.bubble.show_jump_indicator()
+            # 处理增量文本
+            elif 'delta' in bubble_data:
+                if bubble_data.get('new'):
+                    self.bubble_text = ""
+                self.bubble_text += bubble_data['delta']
+                text_changed = True
+            # 处理完整文本
+            elif 'text' in bubble_data:
+                self.bubble_text = bubble_data.get('text', '')
+                text_changed = True
+                if bubble_data.get('final'):
+                    print(f"收到气泡消息: {self.bubble_text}")
+
+        if text_changed:
+            self.update_bubble(self.bubble_text)
+
+
+def run_character_window(emotion_queue, bubble_queue, window_rect=None):
     """启动立绘窗口"""
-    window = CharacterWindow(emotion_queue, bubble_queue)
\ No newline at end of file
+    window = CharacterWindow(emotion_queue, bubble_queue, window_rect=window_rect)
\ No newline at end of file
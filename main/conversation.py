@@ -0,0 +1,59 @@
+import threading
+from collections import deque
+
+from prompt_builder import estimate_tokens
+
+
+class ConversationBuffer:
+    """最近几轮对话的滑动窗口（按token计）
+
+    超出 max_tokens 时一次性丢弃最旧的若干轮，直到降到 max_tokens * trim_ratio 以下，
+    这样窗口在之后的多轮里保持不变，请求前缀可以持续命中服务端的提示词缓存。
+    """
+
+    def __init__(self, max_tokens=2000, trim_ratio=0.6):
+        self.max_tokens = max_tokens
+        self.trim_ratio = trim_ratio
+        self.turns = deque()  # 每轮为 (messages, tokens, memory)
+        self.total_tokens = 0
+        self.lock = threading.Lock()
+
+    def add_turn(self, user_input, ai_response, memory=None):
+        """记录一轮对话，memory 为这一轮对应的记忆（用于判断它是否还在窗口内）"""
+        messages = []
+        if user_input:
+            messages.append({"role": "user", "content": user_input})
+        if ai_response:
+            messages.append({"role": "assistant", "content": ai_response})
+        if not messages:
+            return
+
+        tokens = sum(estimate_tokens(m["content"]) for m in messages)
+        with self.lock:
+            self.turns.append((messages, tokens, memory))
+            self.total_tokens += tokens
+
+            if self.total_tokens > self.max_tokens:
+                target = self.max_tokens * self.trim_ratio
+                while self.turns and self.total_tokens > target:
+                    _, dropped, _ = self.turns.popleft()
+                    self.total_tokens -= dropped
+
+    def messages(self):
+        """按时间顺序返回窗口内的消息"""
+        with self.lock:
+            return [message for messages, _, _ in self.turns for message in messages]
+
+    def memories(self):
+        """窗口内各轮对应的记忆"""
+        with self.lock:
+            return [memory for _, _, memory in self.turns if memory is not None]
+
+    def tokens(self):
+        with self.lock:
+            return self.total_tokens
+
+    def clear(self):
+        with self.lock:
+            self.turns.clear()
+            self.total_tokens = 0
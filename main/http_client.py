@@ -0,0 +1,239 @@
+import configparser
+import socket
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# HTTP/2 需要可选依赖 httpx[http2]，未安装时退回 requests 的 HTTP/1.1 连接池
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+
+class _TrackingConnectionMixin:
+    """关闭时通知所属连接池，从“正在使用”中移除"""
+
+    tracking_pool = None
+
+    def close(self):
+        pool = self.tracking_pool
+        if pool is not None:
+            pool.release_active(self)
+        super().close()
+
+
+class _TrackingHTTPConnection(_TrackingConnectionMixin, HTTPConnection):
+    pass
+
+
+class _TrackingHTTPSConnection(_TrackingConnectionMixin, HTTPSConnection):
+    pass
+
+
+class _TrackingPoolMixin:
+    """记录已借出（正在使用）的连接，abort 时可以从其他线程关闭它们的套接字
+
+    请求出错时 urllib3 会先关闭连接再 _put_conn(None)，所以连接关闭时也要移除，
+    否则被中止的连接会一直留在 active 中。
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active = set()
+        self.active_lock = threading.Lock()
+
+    def _get_conn(self, timeout=None):
+        conn = super()._get_conn(timeout)
+        conn.tracking_pool = self
+        with self.active_lock:
+            self.active.add(conn)
+        return conn
+
+    def _put_conn(self, conn):
+        if conn is not None:
+            self.release_active(conn)
+        super()._put_conn(conn)
+
+    def release_active(self, conn):
+        with self.active_lock:
+            self.active.discard(conn)
+
+    def abort_active(self):
+        """关闭正在使用的连接的套接字，阻塞在读写上的请求会立即出错返回"""
+        with self.active_lock:
+            connections = list(self.active)
+        aborted = 0
+        for conn in connections:
+            sock = getattr(conn, "sock", None)
+            if sock is None:
+                continue
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+                aborted += 1
+            except OSError:
+                pass
+        return aborted
+
+
+class _TrackingHTTPConnectionPool(_TrackingPoolMixin, HTTPConnectionPool):
+    ConnectionCls = _TrackingHTTPConnection
+
+
+class _TrackingHTTPSConnectionPool(_TrackingPoolMixin, HTTPSConnectionPool):
+    ConnectionCls = _TrackingHTTPSConnection
+
+
+class AbortableHTTPAdapter(HTTPAdapter):
+    """可以中止进行中请求的连接池适配器"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super().init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _TrackingHTTPConnectionPool,
+            "https": _TrackingHTTPSConnectionPool,
+        }
+
+    def abort(self):
+        """中止所有进行中的请求，返回被关闭的连接数"""
+        pools = self.poolmanager.pools
+        aborted = 0
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is not None and hasattr(pool, "abort_active"):
+                aborted += pool.abort_active()
+        return aborted
+
+
+class HttpTransport:
+    """共享的HTTP传输层：所有API调用复用同一个带keep-alive的连接池"""
+
+    # 各类调用的默认读取超时（秒），可在config.ini的[Network]中用 <类型>_timeout 覆盖
+    DEFAULT_TIMEOUTS = {
+        'chat': 60,
+        'emotion': 30,
+        'vision': 120,
+        'context': 60,
+        'summary': 60,
+        'welcome': 30,
+    }
+
+    def __init__(self, base_url, headers=None, pool_size=10, http2=True, connect_timeout=10.0, timeouts=None):
+        self.base_url = base_url.rstrip('/')
+        self.headers = headers or {}
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.timeouts = dict(self.DEFAULT_TIMEOUTS)
+        if timeouts:
+            self.timeouts.update(timeouts)
+
+        self.http2 = http2
+        self.lock = threading.Lock()
+        self.client = None
+        self.adapter = None
+        self.backend = "requests"
+        self._create_client()
+
+    def _create_client(self):
+        self.client = None
+        if self.http2 and httpx is not None:
+            try:
+                self.client = httpx.Client(
+                    http2=True,
+                    headers=self.headers,
+                    limits=httpx.Limits(
+                        max_connections=self.pool_size,
+                        max_keepalive_connections=self.pool_size
+                    )
+                )
+                self.backend = "httpx"
+            except ImportError:
+                # 安装了httpx但缺少h2
+                self.client = None
+
+        if self.client is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            # 同一主机的连接池，pool_block=False 时超出上限的连接用完即关
+            self.adapter = AbortableHTTPAdapter(pool_connections=4, pool_maxsize=self.pool_size)
+            session.mount("https://", self.adapter)
+            session.mount("http://", self.adapter)
+            self.client = session
+            self.backend = "requests"
+
+    @classmethod
+    def from_config(cls, parser: configparser.ConfigParser, base_url, headers, pool_size=None):
+        """根据config.ini的[Network]部分创建传输层，pool_size 可覆盖配置的连接池大小"""
+        timeouts = {}
+        for kind, default in cls.DEFAULT_TIMEOUTS.items():
+            timeouts[kind] = parser.getfloat('Network', f'{kind}_timeout', fallback=default)
+
+        return cls(
+            base_url,
+            headers,
+            pool_size=pool_size or parser.getint('Network', 'pool_size', fallback=10),
+            http2=parser.getboolean('Network', 'http2', fallback=True),
+            connect_timeout=parser.getfloat('Network', 'connect_timeout', fallback=10.0),
+            timeouts=timeouts
+        )
+
+    def get_timeout(self, kind):
+        """获取某类调用的读取超时"""
+        return self.timeouts.get(kind, self.timeouts['chat'])
+
+    def post(self, endpoint, payload, kind='chat', stream=False):
+        """向 base_url/endpoint 发送JSON请求，返回响应对象"""
+        url = f"{self.base_url}/{endpoint.lstrip('/')}"
+        read_timeout = self.get_timeout(kind)
+
+        client = self.client
+        if self.backend == "httpx":
+            request = client.build_request(
+                "POST",
+                url,
+                json=payload,
+                timeout=httpx.Timeout(read_timeout, connect=self.connect_timeout)
+            )
+            response = client.send(request, stream=stream)
+            if stream and response.status_code != 200:
+                # 读取错误信息，保证 response.text 可用
+                response.read()
+            return response
+
+        return client.post(
+            url,
+            json=payload,
+            stream=stream,
+            timeout=(self.connect_timeout, read_timeout)
+        )
+
+    def iter_bytes(self, response):
+        """按到达顺序读取流式响应的原始字节块"""
+        if self.backend == "httpx":
+            return response.iter_bytes()
+        # chunk_size=None 时数据一到就返回，不等待凑满固定大小
+        return response.iter_content(chunk_size=None)
+
+    def abort(self):
+        """中止所有进行中的请求（可从其他线程调用），之后的请求照常使用"""
+        with self.lock:
+            if self.backend == "httpx":
+                # httpx 不能单独中止某个请求，关闭整个客户端并换一个新的
+                old_client = self.client
+                self._create_client()
+                try:
+                    old_client.close()
+                except Exception as e:
+                    print(f"中止请求失败: {str(e)}")
+                return
+            self.adapter.abort()
+
+    def close(self):
+        """关闭连接池"""
+        try:
+            self.client.close()
+        except Exception as e:
+            print(f"关闭连接池失败: {str(e)}")
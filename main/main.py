@@ -1,30 +1,30 @@
-import requests
-import json
 import configparser
 import os
 import time
 import threading
 import tkinter as tk
-import tkinter.font as tkFont
 import queue
 import sys
 import multiprocessing
 from typing import Generator, Dict, Any, Tuple
 import random
-import base64
-import mss
-from PIL import Image
-import numpy as np
 import pygame
 import atexit
-import datetime
-import re
 
 # 导入其他模块
 from character_window import run_character_window
-from time_display import run_time_display
-from music_player import MusicPlayer
 from memory_manager import MemoryManager  # 导入记忆管理器
+from memory_store import create_memory_store  # 记忆持久化
+from memory_index import create_memory_retriever  # 记忆向量召回
+from prompt_builder import PromptBuilder, PromptSection, estimate_tokens  # 按token预算拼装提示词
+from conversation import ConversationBuffer  # 多轮对话上下文
+from sse_parser import ChatStreamParser, StreamError  # 流式响应解析
+from bubble_channel import BubbleChannel  # 气泡增量更新
+from http_client import HttpTransport  # 共享HTTP连接池
+from screen_capture import ScreenCapture  # 内存截图管线
+from change_detector import ScreenChangeDetector  # 屏幕变化检测
+from ocr import create_text_extractor  # 本地OCR预处理
+from cancellation import CancellablePipeline, OperationCancelled  # 可取消的视觉分析流水线
 
 # 初始化pygame mixer
 pygame.mixer.init()
@@ -127,8 +127,23 @@ class SiliconFlowClient:
         self.base_url = self.parser.get('API', 'base_url')
         self.model = self.parser.get('API', 'model')
         self.stream = self.parser.getboolean('Settings', 'stream')
+        # 流水线模式：情感分析与主回复同时发出；关闭时先分析情感，回复提示词可看到新状态
+        self.pipeline_emotion = self.parser.getboolean('Settings', 'pipeline_emotion', fallback=True)
         self.ai_name = self.parser.get('UI', 'ai_name', fallback='AI')  # 可自定义的AI名称
 
+        # 提示词token预算
+        self.prompt_builder = PromptBuilder.from_config(self.parser)
+
+        # 共享HTTP传输层（连接池 + keep-alive），避免每次调用重新握手
+        self.transport = HttpTransport.from_config(self.parser, self.base_url, self.headers)
+        # 主动视觉分析使用独立的小连接池，被用户输入打断时可以整体中止，不占用户对话的连接
+        self.background_transport = HttpTransport.from_config(
+            self.parser,
+            self.base_url,
+            self.headers,
+            pool_size=self.parser.getint('Network', 'background_pool_size', fallback=2)
+        )
+
         # 情感分析配置
         self.emotion_model = self.parser.get('Emotion', 'emotion_model')
         self.ai_personality = self.parser.get('Personality', 'ai_personality', fallback='一个AI助手')
@@ -140,12 +155,26 @@ class SiliconFlowClient:
         # 记忆模型配置
         self.memory_model = self.parser.get('Memory', 'memory_model', fallback='deepseek-ai/DeepSeek-V3')
 
-        # 初始化记忆管理器
+        # 初始化记忆存储（SQLite 或 快照 + 追加式日志）
+        max_memories = self.parser.getint('Memory', 'max_memories', fallback=18)
+        memory_store = create_memory_store(self.parser, max_memories)
+
+        # 初始化记忆管理器（摘要使用单独的连接，有新记忆时可中止而不影响对话）
+        self.summary_transport = HttpTransport.from_config(self.parser, self.base_url, self.headers, pool_size=1)
         self.memory_manager = MemoryManager(
-            self.parser.getint('Memory', 'max_memories', fallback=18),
+            max_memories,
             self.memory_model,
             self.base_url,
-            self.headers
+            self.headers,
+            transport=self.summary_transport,
+            summary_debounce=self.parser.getfloat('Memory', 'summary_debounce', fallback=3.0),
+            incremental_summary=self.parser.getboolean('Memory', 'incremental_summary', fallback=True),
+            full_rebuild_every=self.parser.getint('Memory', 'summary_full_rebuild_every', fallback=10),
+            store=memory_store,
+            retriever=create_memory_retriever(self.parser, memory_store),
+            retry_delay=self.parser.getfloat('Memory', 'summary_retry_delay', fallback=5.0),
+            max_retry_delay=self.parser.getfloat('Memory', 'summary_max_retry_delay', fallback=300.0),
+            max_restarts=self.parser.getint('Memory', 'summary_max_restarts', fallback=3)
         )
 
         # 初始化情感状态管理器
@@ -164,6 +193,17 @@ class SiliconFlowClient:
         else:
             self.system_prompt = self.parser.get('Personality', 'system_prompt')
 
+        # 多轮对话上下文：最近几轮以原始消息发送，系统提示保持不变以命中前缀缓存
+        self.conversation = None
+        if self.parser.getboolean('Conversation', 'enabled', fallback=True):
+            self.conversation = ConversationBuffer(
+                max_tokens=self.parser.getint('Conversation', 'max_tokens', fallback=2000),
+                trim_ratio=self.parser.getfloat('Conversation', 'trim_ratio', fallback=0.6)
+            )
+        self.last_usage = None  # 最近一次回复的token用量
+        self.last_finish_reason = None  # 最近一次回复的结束原因
+        self.usage_totals = {"prompt": 0, "cached": 0, "completion": 0}
+
         # 设置情感变化回调
         self.emotion_state.emotion_change_callback = self.on_emotion_changed
 
@@ -176,8 +216,22 @@ class SiliconFlowClient:
         self.visual_analysis_active = True  # 视觉分析线程运行标志
         self.user_interrupted = False  # 用户是否中断视觉分析
         self.visual_thread = None  # 视觉分析线程
-        self.screenshot_dir = "screenshots"  # 截图保存目录
-        os.makedirs(self.screenshot_dir, exist_ok=True)  # 创建截图目录
+        self.screen_capture = ScreenCapture.from_config(self.parser)  # 内存截图管线
+        self.change_detector = ScreenChangeDetector.from_config(self.parser)  # 屏幕变化检测
+        self.last_image_description = None  # 上次视觉分析的结果（整屏描述 + 变化区域），画面没变化时复用
+        self.full_image_description = None  # 最近一次整屏分析的描述
+        self.full_description_time = 0.0  # 整屏分析的时间
+        self.region_descriptions = []  # 之后只分析变化区域得到的描述
+        # 变化区域的描述累积到 crop_max_regions 条，或整屏描述超过 crop_full_refresh 秒后，重新分析整屏
+        self.max_region_descriptions = max(1, self.parser.getint('Visual', 'crop_max_regions', fallback=3))
+        self.full_refresh_seconds = self.parser.getfloat('Visual', 'crop_full_refresh', fallback=600.0)
+        self.last_capture_monitor = None  # 上次分析时截取的屏幕区域
+        self.vision_calls = 0  # 实际调用视觉模型的次数
+        self.vision_skipped = 0  # 因画面未变化跳过的次数
+        self.text_extractor = create_text_extractor(self.parser)  # 本地OCR，可选
+        self.ocr_used = 0  # 用OCR文字代替视觉模型的次数
+        self.visual_pipeline = CancellablePipeline("视觉分析")  # 各阶段在工作线程执行，用户输入时取消
+        self.user_busy = threading.Event()  # 正在处理用户输入，期间不启动视觉分析
 
         # 启动视觉分析线程
         self.start_visual_analysis_thread()
@@ -196,7 +250,7 @@ class SiliconFlowClient:
             time.sleep(wait_time)
 
             # 检查是否有新输入
-            if time.time() - self.last_input_time < 5:
+            if self.user_busy.is_set() or time.time() - self.last_input_time < 5:
                 print("\033[33m用户有新输入，跳过本次视觉分析\033[0m")
                 continue
 
@@ -204,29 +258,30 @@ class SiliconFlowClient:
             self.perform_visual_analysis()
 
     def capture_screenshot(self):
-        """使用mss捕获屏幕截图"""
-        with mss.mss() as sct:
-            # 获取主显示器
-            monitor = sct.monitors[1]
-            # 截图
-            sct_img = sct.grab(monitor)
-            # 转换为PIL图像
-            img = Image.frombytes('RGB', sct_img.size, sct_img.rgb)
-            # 保存为临时文件
-            timestamp = int(time.time())
-            img_path = os.path.join(self.screenshot_dir, f"screenshot_{timestamp}.png")
-            img.save(img_path)
-            return img_path
-
-    def encode_image(self, image_path):
-        """将图像编码为base64"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-
-    def analyze_image(self, image_path):
-        """使用视觉模型分析图像"""
-        base64_image = self.encode_image(image_path)
+        """按配置的截取目标捕获屏幕截图并缩放"""
+        screenshot = self.screen_capture.capture()
+        timings = screenshot.timings
+        monitor = screenshot.monitor
+        print(
+            f"截图完成: 区域 {monitor['width']}x{monitor['height']}+{monitor['left']}+{monitor['top']} -> "
+            f"{screenshot.image.width}x{screenshot.image.height}, "
+            f"截屏 {timings['grab'] * 1000:.0f} ms / 缩放 {timings['scale'] * 1000:.0f} ms"
+        )
+        return screenshot
+
+    def encode_screenshot(self, screenshot):
+        """把截图编码到内存"""
+        self.screen_capture.encode_screenshot(screenshot)
+        print(
+            f"截图编码: {screenshot.image.width}x{screenshot.image.height} {screenshot.mime_type}, "
+            f"{screenshot.size / 1024:.0f} KB, 编码 {screenshot.timings['encode'] * 1000:.0f} ms"
+        )
+        if screenshot.path:
+            print(f"截图已保存: {screenshot.path}")
+        return screenshot
 
+    def analyze_image(self, screenshot, token=None):
+        """使用视觉模型分析图像"""
         # 改进的视觉分析提示词，关注与用户相关的上下文
         vision_prompt = (
             "请详细描述当前屏幕内容，特别注意以下方面：\n"
@@ -236,6 +291,8 @@ class SiliconFlowClient:
             "4. 可能暗示用户需求或兴趣的内容\n"
             "5. 时间相关的信息（如时钟、日历）"
         )
+        if screenshot.crop_box:
+            vision_prompt = "这是屏幕上最近发生变化的区域的截图。\n" + vision_prompt
 
         # 构造请求
         payload = {
@@ -251,7 +308,7 @@ class SiliconFlowClient:
                         {
                             "type": "image_url",
                             "image_url": {
-                                "url": f"data:image/png;base64,{base64_image}"
+                                "url": screenshot.data_url
                             }
                         }
                     ]
@@ -261,11 +318,10 @@ class SiliconFlowClient:
         }
 
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=120
+            response = self.background_transport.post(
+                "chat/completions",
+                payload,
+                kind='vision'
             )
             if response.status_code != 200:
                 print(f"视觉分析请求失败: {response.status_code} - {response.text}")
@@ -273,26 +329,101 @@ class SiliconFlowClient:
             data = response.json()
             return data['choices'][0]['message']['content']
         except Exception as e:
-            print(f"视觉分析异常: {str(e)}")
+            # 被取消时请求的连接已被中止，不再报错
+            if token is None or not token.cancelled:
+                print(f"视觉分析异常: {str(e)}")
+            return None
+
+    def analyze_screen_text(self, screen_text, cropped=False, token=None):
+        """根据OCR识别出的屏幕文字，用文本模型推断屏幕内容"""
+        system_prompt = self.prompt_builder.build(
+            [
+                PromptSection(
+                    "instruction",
+                    "以下是从用户屏幕截图中识别出的文字（可能有识别错误，顺序也可能打乱）。"
+                    + ("截图只包含屏幕上最近发生变化的区域。" if cropped else "")
+                    + "请根据这些文字详细描述当前屏幕内容，特别注意以下方面：\n"
+                    "1. 用户正在使用的应用程序或浏览的网页内容\n"
+                    "2. 屏幕上可见的文字信息\n"
+                    "3. 可能暗示用户需求或兴趣的内容\n"
+                    "4. 时间相关的信息（如时钟、日历）",
+                    priority=0,
+                    required=True
+                ),
+                PromptSection(
+                    "screen_text",
+                    f"{screen_text}\n",
+                    priority=1,
+                    header="### 屏幕文字\n",
+                    keep="head"
+                )
+            ],
+            self.analysis_model
+        )
+
+        payload = {
+            "model": self.analysis_model,
+            "messages": [
+                {
+                    "role": "system",
+                    "content": system_prompt
+                }
+            ],
+            "max_tokens": 1000
+        }
+
+        try:
+            response = self.background_transport.post(
+                "chat/completions",
+                payload,
+                kind='context'
+            )
+            if response.status_code != 200:
+                print(f"屏幕文字分析请求失败: {response.status_code} - {response.text}")
+                return None
+            data = response.json()
+            return data['choices'][0]['message']['content']
+        except Exception as e:
+            # 被取消时请求的连接已被中止，不再报错
+            if token is None or not token.cancelled:
+                print(f"屏幕文字分析异常: {str(e)}")
             return None
 
-    def generate_context_prompt(self, image_description):
+    def generate_context_prompt(self, image_description, token=None):
         """根据视觉分析结果生成上下文提示"""
         emotion_type, emotion_intensity = self.emotion_state.get_state()
 
-        # 改进的分析提示词，增强与屏幕内容的关联
-        system_prompt = (
-            f"你正在扮演{self.ai_name}（{self.ai_personality}）。当前情感状态: {emotion_type}，强度: {emotion_intensity:.1f}。\n"
-            "请根据以下屏幕内容分析，思考如何自然地与用户互动：\n\n"
-            "### 屏幕内容分析\n"
-            f"{image_description}\n\n"
-            "### 互动要求\n"
-            "1. 回复必须基于屏幕内容，但不要直接描述屏幕\n"
-            "2. 结合当前情感状态，使用符合人格的语气\n"
-            "3. 内容应简短（1-2句话），自然引发对话\n"
-            "4. 避免直接提问，而是分享观察或感受\n"
-            "5. 如果屏幕内容与用户工作相关，提供鼓励或帮助\n\n"
-            "请输出AI应该对用户说的话："
+        # 改进的分析提示词，增强与屏幕内容的关联（屏幕描述过长时截断）
+        system_prompt = self.prompt_builder.build(
+            [
+                PromptSection(
+                    "persona",
+                    f"你正在扮演{self.ai_name}（{self.ai_personality}）。当前情感状态: {emotion_type}，强度: {emotion_intensity:.1f}。\n"
+                    "请根据以下屏幕内容分析，思考如何自然地与用户互动：\n",
+                    priority=0,
+                    required=True
+                ),
+                PromptSection(
+                    "screen",
+                    f"{image_description}\n",
+                    priority=1,
+                    header="### 屏幕内容分析\n",
+                    keep="head"
+                ),
+                PromptSection(
+                    "instruction",
+                    "### 互动要求\n"
+                    "1. 回复必须基于屏幕内容，但不要直接描述屏幕\n"
+                    "2. 结合当前情感状态，使用符合人格的语气\n"
+                    "3. 内容应简短（1-2句话），自然引发对话\n"
+                    "4. 避免直接提问，而是分享观察或感受\n"
+                    "5. 如果屏幕内容与用户工作相关，提供鼓励或帮助\n\n"
+                    "请输出AI应该对用户说的话：",
+                    priority=0,
+                    required=True
+                )
+            ],
+            self.analysis_model
         )
 
         # 构造请求
@@ -308,11 +439,10 @@ class SiliconFlowClient:
         }
 
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=60
+            response = self.background_transport.post(
+                "chat/completions",
+                payload,
+                kind='context'
             )
             if response.status_code != 200:
                 print(f"上下文分析请求失败: {response.status_code} - {response.text}")
@@ -320,46 +450,180 @@ class SiliconFlowClient:
             data = response.json()
             return data['choices'][0]['message']['content']
         except Exception as e:
-            print(f"上下文分析异常: {str(e)}")
+            # 被取消时请求的连接已被中止，不再报错
+            if token is None or not token.cancelled:
+                print(f"上下文分析异常: {str(e)}")
             return None
 
+    def interrupt_visual_analysis(self):
+        """用户输入了新消息：取消进行中的视觉分析并中止其网络请求"""
+        self.last_input_time = time.time()
+        if self.visual_pipeline.cancel("用户输入"):
+            print("\033[33m用户有新输入，已中止视觉分析\033[0m")
+
     def perform_visual_analysis(self):
-        """执行视觉分析流程"""
+        """执行视觉分析流程：截图 -> 视觉/OCR分析 -> 上下文提示 -> 自动回复
+
+        每个阶段都在流水线的工作线程中执行，用户输入新消息时立即取消，
+        进行中的请求通过中止后台连接池结束，不会继续等待到超时。
+        """
         # 检查是否有新输入
-        if time.time() - self.last_input_time < 5:
+        if self.user_busy.is_set() or time.time() - self.last_input_time < 5:
             print("\033[33m用户有新输入，取消视觉分析\033[0m")
             return
 
         print("\033[33m检测到用户长时间未输入，开始视觉分析...\033[0m")
 
-        # 1. 截图
-        screenshot_path = self.capture_screenshot()
-        print(f"截图已保存: {screenshot_path}")
+        pipeline = self.visual_pipeline
+        token = pipeline.begin()
+        token.on_cancel(self.background_transport.abort)
+        # run_ai_client 先设置 user_busy 再取消流水线；如果取消发生在上面的检查和 begin() 之间，
+        # 那次取消找不到令牌，这里再检查一次，保证用户的回合中不会开始视觉分析
+        if self.user_busy.is_set():
+            pipeline.cancel("用户输入")
+        try:
+            # 1. 截图
+            try:
+                screenshot, change = pipeline.run_stage(token, "capture", self._capture_stage)
+            except OperationCancelled:
+                raise
+            except Exception as e:
+                print(f"截图失败: {str(e)}")
+                return
 
-        # 2. 视觉模型分析
-        image_description = self.analyze_image(screenshot_path)
-        if not image_description:
-            print("视觉分析失败，跳过后续步骤")
-            os.remove(screenshot_path)
-            return
-        print(f"视觉分析结果: {image_description}")
+            # 2. 视觉模型分析（画面与上次分析时相比没有明显变化则复用上次的结果）
+            if change is not None and not change.changed and self.last_image_description:
+                self.vision_skipped += 1
+                print(f"\033[33m屏幕无明显变化（{change.describe()}），复用上次的视觉分析结果"
+                      f"（已跳过 {self.vision_skipped} 次）\033[0m")
+                image_description = self.last_image_description
+            else:
+                image_description = pipeline.run_stage(token, "vision", self._vision_stage, screenshot, change)
+                if not image_description:
+                    print("视觉分析失败，跳过后续步骤")
+                    return
+            print(f"视觉分析结果: {image_description}")
+
+            # 3. 生成上下文提示
+            context_prompt = pipeline.run_stage(token, "context", self._context_stage, image_description)
+            if not context_prompt:
+                print("上下文提示生成失败")
+                return
+            print(f"生成的上下文提示: {context_prompt}")
 
-        # 3. 生成上下文提示
-        context_prompt = self.generate_context_prompt(image_description)
-        if not context_prompt:
-            print("上下文提示生成失败")
-            os.remove(screenshot_path)
-            return
-        print(f"生成的上下文提示: {context_prompt}")
+            # 4. 使用上下文提示调用主模型生成回复
+            ai_response = pipeline.run_stage(token, "reply", self._reply_stage, context_prompt)
+            if not ai_response:
+                return
+            token.raise_if_cancelled()
 
-        # 4. 检查用户是否在分析期间输入（打断）
-        if time.time() - self.last_input_time < 5:
-            print("用户已输入，取消自动回复")
-            os.remove(screenshot_path)
-            return
+            # 输出回复
+            print(f"\033[34m{self.ai_name}（自动回复）: {ai_response}\033[0m")
+
+            # 发送气泡更新
+            self.send_bubble_update(ai_response, is_final=True)
+
+            # 发送跳动信号给立绘窗口
+            if hasattr(self, 'bubble_queue'):
+                try:
+                    self.bubble_queue.put({'jump': True})
+                except Exception as e:
+                    print(f"发送跳动信号失败: {str(e)}")
+        except OperationCancelled as e:
+            print(f"\033[33m视觉分析已取消: {str(e)}\033[0m")
+        except Exception as e:
+            print(f"视觉分析异常: {str(e)}")
+        finally:
+            pipeline.finish(token)
+            print(f"\033[90m{pipeline.report()}\033[0m")
+
+    def _capture_stage(self, token):
+        """截图并与上次分析的画面比较，返回 (截图, 变化结果)"""
+        screenshot = self.capture_screenshot()
+        change = None
+        if self.change_detector is not None:
+            change = self.change_detector.compare(screenshot.image)
+            if screenshot.monitor != self.last_capture_monitor:
+                # 截取的屏幕换了（例如切到另一块显示器），与上次的画面没有可比性
+                change.changed = True
+                change.block_map = None
+        return screenshot, change
+
+    def _vision_stage(self, token, screenshot, change):
+        """分析画面内容：优先用本地OCR文字，文字不足时调用视觉模型"""
+        if change is not None:
+            print(f"屏幕变化: {change.describe()}")
+            # 已有较新的整屏分析结果时只发送变化的区域
+            if (self.can_crop_to_changes() and change.block_map is not None
+                    and self.screen_capture.crop_to_changes(screenshot, change.block_map)):
+                print(f"只分析变化区域: {screenshot.crop_box}")
+
+        image_description = None
+        # 先在本地识别文字，文字足够时用文本模型分析，不调用视觉模型
+        # （OCR使用原始分辨率的截图，缩小后的小字很难识别）
+        if self.text_extractor is not None:
+            ocr_result = self.text_extractor.extract(screenshot.full_image)
+            if ocr_result is not None:
+                print(f"OCR识别: {ocr_result.char_count} 字, {len(ocr_result.lines)} 行, "
+                      f"耗时 {ocr_result.elapsed * 1000:.0f} ms")
+            if self.text_extractor.is_sufficient(ocr_result) and not token.cancelled:
+                image_description = self.analyze_screen_text(ocr_result.text, bool(screenshot.crop_box), token)
+                if image_description:
+                    self.ocr_used += 1
+
+        if not image_description:
+            if token.cancelled:
+                return None
+            self.encode_screenshot(screenshot)
+            image_description = self.analyze_image(screenshot, token)
+            if not image_description:
+                return None
+            self.vision_calls += 1
 
-        # 5. 使用上下文提示调用主模型生成回复
-        # 构造请求（非流式）
+        # 被取消时不更新缓存，下次重新分析
+        if token.cancelled:
+            return None
+        if screenshot.crop_box:
+            # 裁剪图只描述了变化的区域，与整屏描述合并后才是当前画面的描述
+            self.region_descriptions.append(image_description)
+            image_description = self.merge_screen_description()
+        else:
+            self.full_image_description = image_description
+            self.full_description_time = time.time()
+            self.region_descriptions = []
+        self.last_image_description = image_description
+        self.last_capture_monitor = screenshot.monitor
+        if change is not None:
+            self.change_detector.commit(change.signature)
+        return image_description
+
+    def can_crop_to_changes(self):
+        """整屏描述存在、变化区域描述未满且整屏描述不太旧时，才能只分析变化区域
+
+        否则丢弃旧的区域描述会让合并结果中的这些区域停留在过时的内容，需重新分析整屏。
+        """
+        if not self.full_image_description:
+            return False
+        if len(self.region_descriptions) >= self.max_region_descriptions:
+            print("变化区域已累积较多，重新分析整个屏幕")
+            return False
+        if self.full_refresh_seconds > 0 and time.time() - self.full_description_time > self.full_refresh_seconds:
+            print("整屏分析结果已过时，重新分析整个屏幕")
+            return False
+        return True
+
+    def merge_screen_description(self):
+        """整屏描述 + 之后变化区域的描述（从旧到新）"""
+        parts = [self.full_image_description, "### 之后发生变化的区域（从旧到新）"]
+        parts.extend(self.region_descriptions)
+        return "\n\n".join(parts)
+
+    def _context_stage(self, token, image_description):
+        """根据视觉分析结果生成上下文提示"""
+        return self.generate_context_prompt(image_description, token)
+
+    def _reply_stage(self, token, context_prompt):
+        """用上下文提示调用主模型生成自动回复（非流式）"""
         payload = {
             "model": self.model,
             "messages": [
@@ -376,38 +640,21 @@ class SiliconFlowClient:
         }
 
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=60
+            response = self.background_transport.post(
+                "chat/completions",
+                payload,
+                kind='chat'
             )
             if response.status_code != 200:
                 print(f"自动回复请求失败: {response.status_code} - {response.text}")
-                os.remove(screenshot_path)
-                return
+                return None
 
             data = response.json()
-            ai_response = data['choices'][0]['message']['content']
-
-            # 输出回复
-            print(f"\033[34m{self.ai_name}（自动回复）: {ai_response}\033[0m")
-
-            # 发送气泡更新
-            self.send_bubble_update(ai_response, is_final=True)
-
-            # 发送跳动信号给立绘窗口
-            if hasattr(self, 'bubble_queue'):
-                try:
-                    self.bubble_queue.put({'jump': True})
-                except Exception as e:
-                    print(f"发送跳动信号失败: {str(e)}")
-
+            return data['choices'][0]['message']['content']
         except Exception as e:
-            print(f"自动回复异常: {str(e)}")
-        finally:
-            # 删除截图
-            os.remove(screenshot_path)
+            if not token.cancelled:
+                print(f"自动回复异常: {str(e)}")
+            return None
 
     def _load_config(self, config_path: str) -> configparser.ConfigParser:
         """加载配置文件"""
@@ -423,29 +670,53 @@ class SiliconFlowClient:
         # 获取当前情感状态
         current_emotion, current_intensity = self.emotion_state.get_state()
 
-        # 获取记忆摘要
-        memory_summary = self.memory_manager.get_summary()
-
-        # 构造情感分析请求
-        system_prompt = (
-            f"你是一个情感分析助手。请分析用户输入对AI助手的情感影响。\n"
-            f"AI助手的人设：{self.ai_personality}\n"
-            f"当前情感状态：{current_emotion}，强度：{current_intensity:.1f}\n"
-            f"以下是之前的互动记忆摘要：\n{memory_summary}\n\n"
-        )
-
         if current_emotion == "平静":
-            system_prompt += (
+            instruction = (
                 "请从以下情感中选择一个最合适的：平静, 开心, 生气, 悲伤, 厌恶, 尴尬, 期待, 恐惧, 惊讶\n"
                 "然后返回一个-100到100之间的数值表示情感强度变化（正值增强，负值减弱）。\n"
                 "输出格式：`情感类型 数值`（例如：`开心 50`）"
             )
         else:
-            system_prompt += (
+            instruction = (
                 "请返回一个-100到100之间的数值表示情感强度变化（正值增强当前情感，负值减弱当前情感）。\n"
                 "只返回一个数字，不要包含其他任何内容。"
             )
 
+        # 构造情感分析请求（记忆部分按token预算截断）
+        system_prompt = self.prompt_builder.build(
+            [
+                PromptSection(
+                    "persona",
+                    f"你是一个情感分析助手。请分析用户输入对AI助手的情感影响。\n"
+                    f"AI助手的人设：{self.ai_personality}\n"
+                    f"当前情感状态：{current_emotion}，强度：{current_intensity:.1f}\n",
+                    priority=0,
+                    required=True
+                ),
+                PromptSection(
+                    "summary",
+                    self.memory_manager.get_summary() + "\n",
+                    priority=3,
+                    header="以下是之前的互动记忆摘要：\n"
+                ),
+                PromptSection(
+                    "recent",
+                    self.memory_manager.get_pending_text() + "\n",
+                    priority=2,
+                    header="以下是摘要之后的最近互动：\n"
+                ),
+                PromptSection(
+                    "retrieved",
+                    self.memory_manager.get_relevant_text(user_input) + "\n",
+                    priority=4,
+                    header="以下是与当前输入相关的过往记忆：\n"
+                ),
+                PromptSection("instruction", instruction, priority=0, required=True)
+            ],
+            self.emotion_model,
+            reserved_tokens=estimate_tokens(user_input)
+        )
+
         payload = {
             "model": self.emotion_model,
             "messages": [
@@ -462,11 +733,10 @@ class SiliconFlowClient:
 
         try:
             # 发送情感分析请求
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=30
+            response = self.transport.post(
+                "chat/completions",
+                payload,
+                kind='emotion'
             )
 
             if response.status_code != 200:
@@ -505,38 +775,102 @@ class SiliconFlowClient:
             return current_emotion, 0
 
     def _generate_payload(self, prompt: str) -> Dict[str, Any]:
-        """构造请求负载，包含情感状态和记忆"""
+        """构造请求负载，包含情感状态和记忆
+
+        消息顺序：[人设（逐字节不变）, 最近几轮对话..., 本轮动态上下文, 用户输入]，
+        变化的内容都放在最后，前缀可以命中服务端的提示词缓存。
+        """
         emotion_type, emotion_intensity = self.emotion_state.get_state()
 
-        # 获取记忆摘要
-        memory_summary = self.memory_manager.get_summary()
+        history = self.conversation.messages() if self.conversation else []
+        reserved_tokens = (
+            estimate_tokens(self.system_prompt)
+            + sum(estimate_tokens(m["content"]) for m in history)
+            + estimate_tokens(prompt)
+        )
+
+        # 有对话上下文时，仍在窗口内的最近互动已作为原始消息发送，
+        # 只补上已被窗口裁掉、但摘要还没覆盖的部分
+        recent_text = self.memory_manager.get_pending_text(
+            exclude=self.conversation.memories() if self.conversation else None
+        )
 
-        # 在系统提示中加入情感状态和记忆
-        enhanced_prompt = (
-            f"{self.system_prompt}\n"
-            f"[当前情感状态: {emotion_type}，强度: {emotion_intensity:.1f}。"
-            f"请根据此情感状态调整回答的语气和风格。]\n"
-            f"以下是之前的互动记忆摘要：\n{memory_summary}"
+        # 动态上下文：情感状态和记忆，超出token预算时先截断不重要的部分
+        context_prompt = self.prompt_builder.build(
+            [
+                PromptSection(
+                    "emotion",
+                    f"[当前情感状态: {emotion_type}，强度: {emotion_intensity:.1f}。"
+                    f"请根据此情感状态调整回答的语气和风格。]",
+                    priority=1,
+                    required=True
+                ),
+                PromptSection(
+                    "summary",
+                    self.memory_manager.get_summary(),
+                    priority=3,
+                    header="以下是之前的互动记忆摘要：\n"
+                ),
+                PromptSection(
+                    "recent",
+                    recent_text,
+                    priority=2,
+                    header="以下是摘要之后的最近互动：\n"
+                ),
+                PromptSection(
+                    "retrieved",
+                    self.memory_manager.get_relevant_text(prompt),
+                    priority=4,
+                    header="以下是与当前话题相关的过往记忆：\n"
+                )
+            ],
+            self.model,
+            reserved_tokens=reserved_tokens
         )
 
-        return {
+        payload = {
             "model": self.model,
             "messages": [
-                {"role": "system", "content": enhanced_prompt},
+                {"role": "system", "content": self.system_prompt},
+                *history,
+                {"role": "system", "content": context_prompt},
                 {"role": "user", "content": prompt}
             ],
             "stream": self.stream
         }
+        if self.stream:
+            # 流式响应默认不含用量，要求在最后一个数据块中返回
+            payload["stream_options"] = {"include_usage": True}
+        return payload
+
+    def record_usage(self, usage):
+        """记录token用量，区分命中缓存与未命中的提示词token"""
+        if not usage:
+            return
+        prompt_tokens = usage.get("prompt_tokens", 0)
+        details = usage.get("prompt_tokens_details") or {}
+        # OpenAI格式为 prompt_tokens_details.cached_tokens，DeepSeek格式为 prompt_cache_hit_tokens
+        cached_tokens = details.get("cached_tokens", usage.get("prompt_cache_hit_tokens", 0)) or 0
+        completion_tokens = usage.get("completion_tokens", 0)
+
+        self.last_usage = {
+            "prompt": prompt_tokens,
+            "cached": cached_tokens,
+            "uncached": prompt_tokens - cached_tokens,
+            "completion": completion_tokens
+        }
+        self.usage_totals["prompt"] += prompt_tokens
+        self.usage_totals["cached"] += cached_tokens
+        self.usage_totals["completion"] += completion_tokens
 
     def get_response(self, prompt: str) -> Generator[str, None, None]:
         """获取API响应（流式/非流式）"""
         payload = self._generate_payload(prompt)
-        response = requests.post(
-            f"{self.base_url}/chat/completions",
-            headers=self.headers,
-            json=payload,
-            stream=self.stream,
-            timeout=60
+        response = self.transport.post(
+            "chat/completions",
+            payload,
+            kind='chat',
+            stream=self.stream
         )
 
         if response.status_code != 200:
@@ -544,36 +878,40 @@ class SiliconFlowClient:
 
         if self.stream:
             # 流式输出处理
+            parser = ChatStreamParser()
             is_first_chunk = True
-            for line in response.iter_lines():
-                if line:
-                    decoded_line = line.decode('utf-8')
-                    if decoded_line.startswith('data: '):
-                        json_data = decoded_line[6:]
-                        try:
-                            chunk = json.loads(json_data)
-                            if chunk.get("object") == "chat.completion.chunk":
-                                if 'content' in chunk['choices'][0]['delta']:
-                                    content = chunk['choices'][0]['delta']['content']
-
-                                    # 如果是第一个内容块，发送跳动信号
-                                    if is_first_chunk:
-                                        is_first_chunk = False
-                                        if not self.has_jumped:
-                                            self.has_jumped = True
-                                            try:
-                                                self.bubble_queue.put({'jump': True})
-                                            except Exception as e:
-                                                print(f"发送跳动信号失败: {str(e)}")
-
-                                    yield content
-                        except json.JSONDecodeError:
-                            # 忽略解析错误（如[DONE]）
-                            pass
+            try:
+                for raw in self.transport.iter_bytes(response):
+                    for content in parser.feed(raw):
+                        # 如果是第一个内容块，发送跳动信号
+                        if is_first_chunk:
+                            is_first_chunk = False
+                            if not self.has_jumped:
+                                self.has_jumped = True
+                                try:
+                                    self.bubble_queue.put({'jump': True})
+                                except Exception as e:
+                                    print(f"发送跳动信号失败: {str(e)}")
+
+                        yield content
+                    if parser.done:
+                        break
+                else:
+                    # 服务端没有发送[DONE]就结束了连接
+                    yield from parser.close()
+            finally:
+                response.close()
+
+            self.last_finish_reason = parser.finish_reason
+            self.record_usage(parser.usage)
+            if parser.finish_reason == "length":
+                print("\n\033[90m回复因长度限制被截断\033[0m")
         else:
             # 非流式输出处理
             data = response.json()
             content = data['choices'][0]['message']['content']
+            self.last_finish_reason = data['choices'][0].get('finish_reason')
+            self.record_usage(data.get("usage"))
 
             # 发送跳动信号
             if not self.has_jumped:
@@ -585,6 +923,18 @@ class SiliconFlowClient:
 
             yield content
 
+    def print_usage(self):
+        """显示本轮回复的token用量（深灰色）"""
+        if not self.last_usage:
+            return
+        usage = self.last_usage
+        totals = self.usage_totals
+        hit_rate = totals["cached"] / totals["prompt"] * 100 if totals["prompt"] else 0
+        print(
+            f"\033[90m[用量] 提示 {usage['prompt']} (缓存命中 {usage['cached']} / 未命中 {usage['uncached']})，"
+            f"生成 {usage['completion']}；累计缓存命中率 {hit_rate:.1f}%\033[0m"
+        )
+
     def process_user_input(self, user_input: str):
         """处理用户输入，包括情感分析并更新状态（应用影响系数）"""
         # 更新最后输入时间
@@ -596,6 +946,10 @@ class SiliconFlowClient:
         # 分析用户输入的情感影响
         new_emotion, emotion_delta = self.analyze_emotion(user_input)
 
+        return self.apply_emotion(new_emotion, emotion_delta)
+
+    def apply_emotion(self, new_emotion: str, emotion_delta: float):
+        """将情感分析结果应用到情感状态"""
         # 获取当前情感状态
         current_emotion, current_intensity = self.emotion_state.get_state()
 
@@ -609,6 +963,29 @@ class SiliconFlowClient:
 
         return emotion_changed
 
+    def start_emotion_analysis(self, user_input: str) -> threading.Thread:
+        """流水线模式：在后台线程分析情感，结果到达时更新状态并切换立绘"""
+        # 更新最后输入时间
+        self.last_input_time = time.time()
+
+        # 重置跳动标志
+        self.has_jumped = False
+
+        emotion_thread = threading.Thread(
+            target=self._emotion_analysis_worker,
+            args=(user_input,),
+            daemon=True
+        )
+        emotion_thread.start()
+        return emotion_thread
+
+    def _emotion_analysis_worker(self, user_input: str):
+        """后台情感分析线程"""
+        new_emotion, emotion_delta = self.analyze_emotion(user_input)
+        if self.apply_emotion(new_emotion, emotion_delta):
+            emotion_type, _ = self.emotion_state.get_state()
+            self.on_emotion_changed(emotion_type)
+
     def start_emotion_display(self):
         """开始持续显示情感状态（复写同一行）"""
         if self.emotion_display_active:
@@ -653,7 +1030,14 @@ class SiliconFlowClient:
 
     def send_bubble_update(self, text, is_final=False):
         """发送气泡更新"""
-        if hasattr(self, 'bubble_queue'):
+        if hasattr(self, 'bubble_channel'):
+            # 经过增量通道发送，最终文本会覆盖尚未发出的增量
+            if is_final:
+                self.bubble_channel.send_final(text)
+            else:
+                self.bubble_channel.begin()
+                self.bubble_channel.append(text)
+        elif hasattr(self, 'bubble_queue'):
             try:
                 self.bubble_queue.put({
                     'text': text,
@@ -666,7 +1050,12 @@ class SiliconFlowClient:
         """关闭客户端资源"""
         self.emotion_state.stop()
         self.visual_analysis_active = False
+        self.memory_manager.stop()  # 停止摘要线程
         self.memory_manager.save_memories()  # 保存记忆
+        self.visual_pipeline.shutdown()  # 取消进行中的视觉分析
+        self.transport.close()  # 关闭连接池
+        self.background_transport.close()
+        self.summary_transport.close()
         print("情感状态管理器和视觉分析线程已关闭")
 
     def generate_welcome_message(self):
@@ -696,11 +1085,10 @@ class SiliconFlowClient:
         }
 
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=30
+            response = self.transport.post(
+                "chat/completions",
+                payload,
+                kind='welcome'
             )
             if response.status_code != 200:
                 print(f"生成欢迎语失败: {response.status_code} - {response.text}")
@@ -716,10 +1104,10 @@ class SiliconFlowClient:
 class InputWindow(tk.Tk):
     """用户输入窗口（无边框）"""
 
-    def __init__(self, message_queue, *args, **kwargs):
+    def __init__(self, message_queue, bubble_queue=None, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.message_queue = message_queue
-        self.time_queue = multiprocessing.Queue()  # 时间显示队列
+        self.bubble_queue = bubble_queue  # 时间显示请求经气泡队列发给立绘进程
 
         # 设置无边框窗口
         self.overrideredirect(True)
@@ -793,13 +1181,20 @@ class InputWindow(tk.Tk):
 
     def show_time(self):
         """显示时间窗口"""
-        self.time_queue.put("show")
+        if self.bubble_queue is not None:
+            self.bubble_queue.put({'show_time': True})
 
 
-def run_ai_client(message_queue, emotion_queue, bubble_queue):
+def run_ai_client(message_queue, emotion_queue, bubble_queue, window_rect=None):
     client = SiliconFlowClient()
     client.emotion_queue = emotion_queue  # 设置情感队列
     client.bubble_queue = bubble_queue  # 设置气泡队列
+    client.screen_capture.window_rect = window_rect  # 立绘窗口位置，用于截取立绘所在的显示器
+    # 流式回复只发送增量，并按帧率合并
+    client.bubble_channel = BubbleChannel(
+        bubble_queue,
+        client.parser.getfloat('UI', 'bubble_fps', fallback=30.0)
+    )
 
     # 显示命令行标题
     print("\033[90m" + "=" * 50)  # 深灰色
@@ -810,6 +1205,8 @@ def run_ai_client(message_queue, emotion_queue, bubble_queue):
     print(f"分析模型: {client.analysis_model}")
     print(f"记忆模型: {client.memory_model}")
     print(f"当前模式: {'流式' if client.stream else '非流式'}")
+    print(f"情感分析: {'与回复并行' if client.pipeline_emotion else '先于回复'}")
+    print(f"HTTP传输: {client.transport.backend} (连接池: {client.transport.pool_size})")
     print(f"情感衰减率: {client.emotion_state.decay_rate}/秒")
     print(f"情感强度上限: {client.emotion_state.max_intensity}")
     print(f"情绪影响系数: {client.emotion_state.impact_factor}")
@@ -838,16 +1235,25 @@ def run_ai_client(message_queue, emotion_queue, bubble_queue):
             # 从队列获取用户输入（阻塞式等待）
             user_input = message_queue.get()
 
+            # 用户的回合优先：中止进行中的视觉分析，处理完之前不启动新的
+            client.user_busy.set()
+            client.interrupt_visual_analysis()
+
             if user_input.lower() in ['exit', 'quit']:
                 break
 
-            # 处理用户输入
-            emotion_changed = client.process_user_input(user_input)
+            emotion_thread = None
+            if client.pipeline_emotion:
+                # 情感分析与回复请求同时进行，立绘在回复过程中切换
+                emotion_thread = client.start_emotion_analysis(user_input)
+            else:
+                # 处理用户输入
+                emotion_changed = client.process_user_input(user_input)
 
-            # 如果情感变化，发送通知
-            if emotion_changed:
-                emotion_type, _ = client.emotion_state.get_state()
-                client.on_emotion_changed(emotion_type)
+                # 如果情感变化，发送通知
+                if emotion_changed:
+                    emotion_type, _ = client.emotion_state.get_state()
+                    client.on_emotion_changed(emotion_type)
 
             # 停止当前的情感状态显示（如果有）
             client.stop_emotion_display()
@@ -857,29 +1263,51 @@ def run_ai_client(message_queue, emotion_queue, bubble_queue):
 
             # 重置当前回复
             client.current_response = ""
+            client.last_usage = None
 
             if client.stream:
                 # 流式输出
                 full_response = []
-                for chunk in client.get_response(user_input):
-                    print(chunk, end="", flush=True)
-                    full_response.append(chunk)
-
-                    # 更新气泡
-                    client.current_response += chunk
-                    client.send_bubble_update(client.current_response)
+                client.bubble_channel.begin()
+                try:
+                    for chunk in client.get_response(user_input):
+                        print(chunk, end="", flush=True)
+                        full_response.append(chunk)
+
+                        # 更新气泡（只发送增量，按帧率合并）
+                        client.bubble_channel.append(chunk)
+                except StreamError as e:
+                    # 服务端在流中途返回错误：只结束本轮，不退出对话
+                    print(f"\n\033[90m{str(e)}\033[0m")
+                    partial = "".join(full_response)
+                    client.current_response = partial
+                    client.send_bubble_update(partial + "（回复中断）", is_final=True)
+                    if emotion_thread:
+                        emotion_thread.join()
+                    client.start_emotion_display()
+                    client.user_busy.clear()
+                    continue
 
                 print()  # 换行
                 ai_response = "".join(full_response)
+                client.current_response = ai_response
+
+                # 等待情感分析完成，使记忆记录到本轮的情感
+                if emotion_thread:
+                    emotion_thread.join()
 
                 # 添加记忆
-                client.memory_manager.add_memory(
+                memory = client.memory_manager.add_memory(
                     user_input=user_input,
                     ai_response=ai_response,
                     emotion_type=client.emotion_state.emotion_type,
                     emotion_delta=client.emotion_state.emotion_intensity
                 )
 
+                # 加入多轮对话上下文
+                if client.conversation:
+                    client.conversation.add_turn(user_input, ai_response, memory)
+
                 # 发送最终气泡更新
                 client.send_bubble_update(client.current_response, is_final=True)
             else:
@@ -887,19 +1315,30 @@ def run_ai_client(message_queue, emotion_queue, bubble_queue):
                 ai_response = next(client.get_response(user_input))
                 print(ai_response)
 
+                # 等待情感分析完成，使记忆记录到本轮的情感
+                if emotion_thread:
+                    emotion_thread.join()
+
                 # 添加记忆
-                client.memory_manager.add_memory(
+                memory = client.memory_manager.add_memory(
                     user_input=user_input,
                     ai_response=ai_response,
                     emotion_type=client.emotion_state.emotion_type,
                     emotion_delta=client.emotion_state.emotion_intensity
                 )
 
+                # 加入多轮对话上下文
+                if client.conversation:
+                    client.conversation.add_turn(user_input, ai_response, memory)
+
                 # 发送气泡更新
                 client.send_bubble_update(ai_response, is_final=True)
 
+            client.print_usage()
+
             # 在AI回复后新起一行显示情感状态
             client.start_emotion_display()
+            client.user_busy.clear()
 
     except Exception as e:
         # 深灰色显示错误信息
@@ -919,34 +1358,29 @@ if __name__ == "__main__":
     # 创建气泡更新队列 (进程间通信)
     bubble_queue = multiprocessing.Queue()
 
+    # 立绘窗口位置 [x, y, 宽, 高] (进程间共享)
+    window_rect = multiprocessing.Array('i', 4)
+
     # 启动立绘窗口进程
     character_process = multiprocessing.Process(
         target=run_character_window,
-        args=(emotion_queue, bubble_queue),
+        args=(emotion_queue, bubble_queue, window_rect),
         daemon=True
     )
     character_process.start()
 
-    # 启动时间显示进程
-    time_process = multiprocessing.Process(
-        target=run_time_display,
-        daemon=True
-    )
-    time_process.start()
-
     # 启动AI处理线程
     ai_thread = threading.Thread(
         target=run_ai_client,
-        args=(message_queue, emotion_queue, bubble_queue),
+        args=(message_queue, emotion_queue, bubble_queue, window_rect),
         daemon=True
     )
     ai_thread.start()
 
     # 在主线程运行输入窗口
-    input_window = InputWindow(message_queue)
+    input_window = InputWindow(message_queue, bubble_queue)
     input_window.mainloop()
 
     # 确保所有线程退出
     character_process.terminate()
-    time_process.terminate()
     sys.exit(0)
\ No newline at end of file
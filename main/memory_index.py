@@ -0,0 +1,328 @@
+import configparser
+import json
+import os
+import threading
+import zlib
+
+import numpy as np
+
+# 可选依赖：本地句向量模型（仅CPU），未安装时使用哈希n-gram向量
+try:
+    from sentence_transformers import SentenceTransformer
+except ImportError:
+    SentenceTransformer = None
+
+
+class HashingEmbedder:
+    """哈希字符n-gram向量化：无需模型，中日文按字切分也能工作"""
+
+    def __init__(self, dim=256, ngram_range=(1, 3)):
+        self.dim = dim
+        self.ngram_range = ngram_range
+
+    def embed(self, text):
+        """把文本映射为L2归一化的向量"""
+        vector = np.zeros(self.dim, dtype=np.float32)
+        text = "".join(text.lower().split())
+        min_n, max_n = self.ngram_range
+        for n in range(min_n, max_n + 1):
+            for i in range(len(text) - n + 1):
+                # crc32 在不同进程间稳定（内置hash带随机盐）
+                h = zlib.crc32(text[i:i + n].encode('utf-8'))
+                sign = 1.0 if h & 0x80000000 else -1.0
+                vector[h % self.dim] += sign
+
+        norm = np.linalg.norm(vector)
+        if norm > 0:
+            vector /= norm
+        return vector
+
+
+class SentenceEmbedder:
+    """sentence-transformers 本地模型（CPU）"""
+
+    def __init__(self, model_name):
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dim = self.model.get_sentence_embedding_dimension()
+
+    def embed(self, text):
+        return self.model.encode(text, normalize_embeddings=True).astype(np.float32)
+
+
+class VectorIndex:
+    """内存映射的向量索引，默认暴力余弦检索，可选IVF粗聚类加速
+
+    向量和对应的记忆id分别保存在两个 .npy 文件中，容量不足时按倍数扩展。
+    .meta.json 记录索引对应的记忆存储，存储更换（迁移、重建）后id会重新编号，需要重建索引。
+    """
+
+    def __init__(self, path="memory_vectors", dim=256, kind="flat", nlist=0, nprobe=8, ivf_min_size=5000):
+        self.vector_file = path + ".npy"
+        self.id_file = path + ".ids.npy"
+        self.meta_file = path + ".meta.json"
+        self.dim = dim
+        self.kind = kind
+        self.nlist = nlist  # 0 表示按 sqrt(n) 自动选择
+        self.nprobe = nprobe
+        self.ivf_min_size = ivf_min_size  # 数据量较小时暴力检索更快
+        self.lock = threading.Lock()
+
+        self.count = 0
+        self.vectors = None
+        self.ids = None
+        self.owner = self._load_owner()  # 建立索引时的记忆存储标识
+        self._open()
+
+        # IVF 状态（只在内存中，按需训练）
+        self.centroids = None
+        self.lists = None
+        self.trained_count = 0
+
+    def _open(self):
+        """打开已有的索引文件，维度不匹配时重建"""
+        if os.path.exists(self.vector_file) and os.path.exists(self.id_file):
+            vectors = np.load(self.vector_file, mmap_mode='r+')
+            ids = np.load(self.id_file, mmap_mode='r+')
+            if vectors.shape[1] == self.dim and len(ids) == len(vectors):
+                self.vectors = vectors
+                self.ids = ids
+                # id按顺序写入，第一个-1的位置就是条数
+                empty = np.flatnonzero(ids < 0)
+                self.count = int(empty[0]) if len(empty) else len(ids)
+                return
+            print("记忆索引维度不匹配，重新建立索引")
+            # 先释放映射，否则 Windows 上无法替换文件
+            del vectors, ids
+            self.owner = None
+        self._allocate(1024)
+
+    def _load_owner(self):
+        try:
+            with open(self.meta_file, 'r', encoding='utf-8') as f:
+                return json.load(f).get("store")
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def set_owner(self, store_id):
+        """记录索引对应的记忆存储"""
+        self.owner = store_id
+        try:
+            with open(self.meta_file, 'w', encoding='utf-8') as f:
+                json.dump({"store": store_id}, f)
+        except OSError as e:
+            print(f"保存记忆索引信息失败: {str(e)}")
+
+    def reset(self):
+        """清空索引（保留已分配的文件）"""
+        with self.lock:
+            self.ids[:] = -1
+            self.count = 0
+            self.centroids = None
+            self.lists = None
+            self.trained_count = 0
+
+    def _allocate(self, capacity):
+        """分配（或扩展）内存映射文件"""
+        vectors = np.lib.format.open_memmap(
+            self.vector_file + ".tmp", mode='w+', dtype=np.float32, shape=(capacity, self.dim)
+        )
+        ids = np.lib.format.open_memmap(
+            self.id_file + ".tmp", mode='w+', dtype=np.int64, shape=(capacity,)
+        )
+        ids[:] = -1
+        if self.count:
+            vectors[:self.count] = self.vectors[:self.count]
+            ids[:self.count] = self.ids[:self.count]
+        vectors.flush()
+        ids.flush()
+
+        # 释放旧映射后才能替换文件（Windows）
+        self.vectors = None
+        self.ids = None
+        del vectors, ids
+        os.replace(self.vector_file + ".tmp", self.vector_file)
+        os.replace(self.id_file + ".tmp", self.id_file)
+        self.vectors = np.load(self.vector_file, mmap_mode='r+')
+        self.ids = np.load(self.id_file, mmap_mode='r+')
+
+    def __len__(self):
+        return self.count
+
+    def last_id(self):
+        """已索引的最大记忆id"""
+        return int(self.ids[self.count - 1]) if self.count else 0
+
+    def add(self, memory_id, vector):
+        """添加一条向量"""
+        with self.lock:
+            if self.count >= len(self.ids):
+                self._allocate(len(self.ids) * 2)
+            self.vectors[self.count] = vector
+            self.ids[self.count] = memory_id
+            self.count += 1
+
+            # IVF：新向量直接归入最近的簇，数据量翻倍后重新训练
+            if self.centroids is not None:
+                cluster = int(np.argmax(self.centroids @ vector))
+                self.lists[cluster] = np.append(self.lists[cluster], self.count - 1)
+
+    def flush(self):
+        with self.lock:
+            self.vectors.flush()
+            self.ids.flush()
+
+    def _train_ivf(self, iterations=8):
+        """在当前数据上训练k-means粗聚类（调用时需持有锁）"""
+        data = self.vectors[:self.count]
+        nlist = min(self.nlist or max(1, int(np.sqrt(self.count))), self.count)
+        rng = np.random.default_rng(0)
+        centroids = np.array(data[rng.choice(self.count, nlist, replace=False)])
+
+        # 在采样上训练，再对全部数据分配
+        sample = data[rng.choice(self.count, min(self.count, nlist * 64), replace=False)]
+        for _ in range(iterations):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    norm = np.linalg.norm(centroid)
+                    if norm > 0:
+                        centroids[c] = centroid / norm
+
+        assign = np.empty(self.count, dtype=np.int64)
+        for start in range(0, self.count, 65536):
+            block = data[start:start + 65536]
+            assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+
+        order = np.argsort(assign, kind='stable')
+        bounds = np.searchsorted(assign[order], np.arange(nlist + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(nlist)]
+        self.centroids = centroids
+        self.trained_count = self.count
+
+    def search(self, vector, k=5, min_id=0):
+        """返回 [(记忆id, 相似度)]，按相似度降序；只检索 id >= min_id 的向量"""
+        with self.lock:
+            # id按顺序写入，min_id 之前的行整体跳过
+            first = int(np.searchsorted(self.ids[:self.count], min_id)) if min_id > 0 else 0
+            if self.count - first <= 0:
+                return []
+
+            if self.kind == "ivf" and self.count >= self.ivf_min_size:
+                if self.centroids is None or self.count >= self.trained_count * 2:
+                    self._train_ivf()
+                probes = np.argsort(self.centroids @ vector)[::-1][:self.nprobe]
+                candidates = np.concatenate([self.lists[c] for c in probes])
+                if first:
+                    candidates = candidates[candidates >= first]
+            else:
+                candidates = None
+
+            if candidates is None:
+                scores = self.vectors[first:self.count] @ vector
+                rows = np.arange(first, self.count)
+            else:
+                if len(candidates) == 0:
+                    return []
+                scores = self.vectors[candidates] @ vector
+                rows = candidates
+
+            k = min(k, len(scores))
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(self.ids[rows[i]]), float(scores[i])) for i in top]
+
+
+class MemoryRetriever:
+    """为记忆建立向量索引，按当前输入召回最相关的历史记忆"""
+
+    def __init__(self, store, embedder=None, index=None, top_k=3, min_score=0.2):
+        self.store = store
+        self.embedder = embedder or HashingEmbedder()
+        self.index = index or VectorIndex(dim=self.embedder.dim)
+        self.top_k = top_k
+        self.min_score = min_score
+
+    @staticmethod
+    def memory_text(memory):
+        """用于向量化的记忆文本"""
+        return " ".join(filter(None, (memory.get("user_input"), memory.get("ai_response"))))
+
+    def backfill(self):
+        """为索引中尚未包含的记忆补建向量（如迁移后的旧记忆）
+
+        索引属于其他存储，或包含存储中不存在的id（存储被重建）时，先清空再全部重建。
+        """
+        store_id = self.store.store_id()
+        if self.index.owner != store_id or self.index.last_id() > self.store.max_id():
+            if len(self.index):
+                print("记忆索引与记忆存储不一致，重新建立索引")
+            self.index.reset()
+            self.index.set_owner(store_id)
+
+        added = 0
+        for memory in self.store.iter_since(self.index.last_id()):
+            self.add(memory)
+            added += 1
+        if added:
+            self.index.flush()
+            print(f"已为 {added} 条记忆建立向量索引")
+
+    def add(self, memory):
+        """索引一条记忆（需要存储后端分配的id）"""
+        if "id" not in memory:
+            return
+        text = self.memory_text(memory)
+        if text:
+            self.index.add(memory["id"], self.embedder.embed(text))
+
+    def recall(self, query, k=None, exclude_ids=()):
+        """召回与查询最相关的记忆"""
+        if not query or len(self.index) == 0:
+            return []
+        k = k or self.top_k
+        exclude_ids = set(exclude_ids)
+        # 只保存记忆窗口的后端读不到更早的记忆，不召回它们
+        hits = self.index.search(self.embedder.embed(query), k + len(exclude_ids), min_id=self.store.oldest_id())
+        ids = [memory_id for memory_id, score in hits
+               if score >= self.min_score and memory_id not in exclude_ids][:k]
+        return self.store.get_by_ids(ids)
+
+    def close(self):
+        self.index.flush()
+
+
+def create_memory_retriever(parser: configparser.ConfigParser, store):
+    """根据config.ini的[Retrieval]部分创建记忆召回器，未启用时返回None"""
+    if not parser.getboolean('Retrieval', 'enabled', fallback=True):
+        return None
+
+    embedder_name = parser.get('Retrieval', 'embedder', fallback='hashing').strip()
+    embedder = None
+    if embedder_name != 'hashing':
+        if SentenceTransformer is None:
+            print("未安装sentence-transformers，使用哈希向量")
+        else:
+            try:
+                embedder = SentenceEmbedder(embedder_name)
+            except Exception as e:
+                print(f"加载向量模型失败，使用哈希向量: {str(e)}")
+    if embedder is None:
+        embedder = HashingEmbedder(dim=parser.getint('Retrieval', 'dim', fallback=256))
+
+    index = VectorIndex(
+        parser.get('Retrieval', 'index_path', fallback='memory_vectors'),
+        dim=embedder.dim,
+        kind=parser.get('Retrieval', 'index', fallback='flat').strip().lower(),
+        nlist=parser.getint('Retrieval', 'nlist', fallback=0),
+        nprobe=parser.getint('Retrieval', 'nprobe', fallback=8)
+    )
+
+    return MemoryRetriever(
+        store,
+        embedder,
+        index,
+        top_k=parser.getint('Retrieval', 'top_k', fallback=3),
+        min_score=parser.getfloat('Retrieval', 'min_score', fallback=0.2)
+    )
@@ -1,64 +1,98 @@
-import json
-import os
-import re
-import requests
 import datetime
+import threading
+import time
+
+from cancellation import CancelToken
+from http_client import HttpTransport
+from memory_store import JournalMemoryStore
 
 
 class MemoryManager:
-    def __init__(self, max_memories=18, memory_model="deepseek-ai/DeepSeek-V3", base_url="", headers=None):
+    def __init__(self, max_memories=18, memory_model="deepseek-ai/DeepSeek-V3", base_url="", headers=None,
+                 transport=None, summary_debounce=3.0, incremental_summary=True, full_rebuild_every=10,
+                 store=None, retriever=None, max_pending=None, retry_delay=5.0, max_retry_delay=300.0,
+                 max_restarts=3):
         self.max_memories = max_memories
         self.memory_model = memory_model
         self.base_url = base_url
         self.headers = headers or {}
+        # 摘要专用的传输层：有新记忆时会整体中止进行中的请求，不能与用户对话共用
+        self.transport = transport or HttpTransport(base_url, self.headers)
         self.memories = []
         self.memory_file = "memories.json"
         self.summary_file = "memory_summary.txt"
+        # 持久化：快照 + 追加式日志，每轮只追加一条记录
+        self.store = store or JournalMemoryStore(
+            max_memories,
+            snapshot_file=self.memory_file,
+            summary_file=self.summary_file
+        )
+
+        # 向量召回（可选）：按当前输入找出相关的历史记忆
+        self.retriever = retriever
+
+        # 后台摘要状态：pending_memories 为尚未被摘要覆盖的记忆
+        self.summary_debounce = summary_debounce  # 合并连续多轮对话的等待时间（秒）
+        self.pending_memories = []
+        # 摘要长时间失败或跟不上时，待摘要的记忆最多保留这么多条（它们会整段放进提示词）
+        self.max_pending = max_pending or max_memories
+        self.evicted_memories = []  # 已被摘要覆盖、但刚移出记忆窗口的记忆，最多保留 max_pending 条
+        self.generation = 0  # 每次添加记忆时递增，用于判断进行中的摘要是否过期
+        self.summarized_generation = 0
+        self.last_add_time = 0.0
+        self.summary_cond = threading.Condition()
+        self.running = True
+
+        # 进行中的摘要请求：有新记忆时取消并合并重来，连续取消 max_restarts 次后让它完成，避免一直拿不到摘要
+        self.summary_token = None
+        self.max_restarts = max(0, max_restarts)
+        self.restarts = 0
+
+        # 失败重试：等待时间从 retry_delay 开始翻倍，最多 max_retry_delay 秒
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max(retry_delay, max_retry_delay)
+        self.failures = 0
+        self.retry_time = 0.0
+
+        # 增量摘要：只发送上次摘要 + 新增/移出的记忆，每 full_rebuild_every 次完整重建一次防止漂移
+        self.incremental_summary = incremental_summary
+        self.full_rebuild_every = max(1, full_rebuild_every)
+        self.incremental_count = 0
 
         # 加载记忆
         self.load_memories()
+        if self.retriever:
+            self.retriever.backfill()
+
+        # 启动摘要线程
+        self.summary_thread = threading.Thread(target=self.summary_loop, daemon=True)
+        self.summary_thread.start()
 
     def load_memories(self):
-        """从文件加载记忆"""
-        if os.path.exists(self.memory_file):
-            try:
-                with open(self.memory_file, 'r', encoding='utf-8') as f:
-                    self.memories = json.load(f)
-                print(f"已加载 {len(self.memories)} 条记忆")
-            except Exception as e:
-                print(f"加载记忆失败: {str(e)}")
-                self.memories = []
+        """从快照和日志加载记忆"""
+        try:
+            self.memories = self.store.load()
+            print(f"已加载 {len(self.memories)} 条记忆")
+        except Exception as e:
+            print(f"加载记忆失败: {str(e)}")
+            self.memories = []
 
         # 加载记忆摘要
-        if os.path.exists(self.summary_file):
-            try:
-                with open(self.summary_file, 'r', encoding='utf-8') as f:
-                    self.summary = f.read().strip()
-                print(f"已加载记忆摘要")
-            except Exception as e:
-                print(f"加载记忆摘要失败: {str(e)}")
-                self.summary = ""
-        else:
-            self.summary = ""
+        self.summary = self.store.load_summary()
+        self.summary_ready = bool(self.summary)  # 是否有模型生成的摘要（而不是“暂无记忆”等占位文字）
 
     def save_memories(self):
-        """保存记忆到文件"""
-        try:
-            with open(self.memory_file, 'w', encoding='utf-8') as f:
-                json.dump(self.memories, f, ensure_ascii=False, indent=2)
-            print(f"已保存 {len(self.memories)} 条记忆")
-
-            # 保存记忆摘要
-            with open(self.summary_file, 'w', encoding='utf-8') as f:
-                f.write(self.summary)
-            print("已保存记忆摘要")
-        except Exception as e:
-            print(f"保存记忆失败: {str(e)}")
+        """关闭时将日志合并为快照并保存摘要"""
+        if self.summary_ready:
+            self.store.save_summary(self.summary)
+        if self.retriever:
+            self.retriever.close()
+        self.store.close()
 
     def add_memory(self, user_input, ai_response, emotion_type, emotion_delta):
-        """添加新的记忆"""
+        """添加新的记忆，返回记忆对象"""
         if not user_input and not ai_response:
-            return
+            return None
 
         timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
@@ -74,25 +108,132 @@ class MemoryManager:
         if ai_response:
             memory["ai_response"] = ai_response
 
-        # 添加到记忆列表
-        self.memories.append(memory)
+        with self.summary_cond:
+            # 添加到记忆列表
+            self.memories.append(memory)
 
-        # 确保不超过最大记忆数
-        if len(self.memories) > self.max_memories:
-            self.memories = self.memories[-self.max_memories:]
+            # 确保不超过最大记忆数
+            if len(self.memories) > self.max_memories:
+                evicted = self.memories[:-self.max_memories]
+                self.memories = self.memories[-self.max_memories:]
+                # 未摘要的记忆仍在pending中，这里只记录已摘要过的
+                pending_ids = {id(p) for p in self.pending_memories}
+                self.evicted_memories.extend(m for m in evicted if id(m) not in pending_ids)
+                if len(self.evicted_memories) > self.max_pending:
+                    # 摘要一直失败时不再无限累积，最早的只保留在已有摘要中
+                    self.evicted_memories = self.evicted_memories[-self.max_pending:]
 
-        # 生成新的摘要
-        self.generate_summary()
+            # 追加到日志，立即持久化
+            try:
+                self.store.append(memory)
+            except Exception as e:
+                print(f"写入记忆日志失败: {str(e)}")
 
-    def generate_summary(self):
-        """使用AI模型生成记忆摘要"""
-        if not self.memories:
-            self.summary = "暂无记忆"
-            return
+            if self.retriever:
+                self.retriever.add(memory)
 
-        # 准备记忆文本
+            # 交给后台线程生成摘要，不阻塞对话
+            self.pending_memories.append(memory)
+            if len(self.pending_memories) > self.max_pending:
+                dropped = len(self.pending_memories) - self.max_pending
+                self.pending_memories = self.pending_memories[dropped:]
+                print(f"待摘要的记忆过多，最早的 {dropped} 条不再计入摘要（仍保存在记忆存储中）")
+            self.generation += 1
+            self.last_add_time = time.time()
+            if self.summary_token and self.restarts < self.max_restarts:
+                # 进行中的摘要已过期，中止后与这条新记忆一起重新摘要
+                if self.summary_token.cancel("新增记忆"):
+                    self.restarts += 1
+            self.summary_cond.notify()
+
+        return memory
+
+    def summary_loop(self):
+        """后台摘要循环：合并连续添加的记忆，摘要完成后移除它覆盖到的记忆"""
+        while True:
+            with self.summary_cond:
+                # 等待新的记忆
+                while self.running and self.generation == self.summarized_generation:
+                    self.summary_cond.wait()
+                if not self.running:
+                    return
+
+                # 防抖：最后一次添加后安静 summary_debounce 秒再请求；失败后等到重试时间
+                remaining = max(self.last_add_time + self.summary_debounce, self.retry_time) - time.time()
+                if remaining > 0:
+                    self.summary_cond.wait(remaining)
+                    continue
+
+                generation = self.generation
+                incremental = (
+                    self.incremental_summary
+                    and self.has_summary()
+                    and self.incremental_count < self.full_rebuild_every
+                )
+                evicted_memories = list(self.evicted_memories)
+                if incremental:
+                    previous_summary = self.summary
+                    new_memories = list(self.pending_memories)
+                    covered = new_memories
+                else:
+                    memories = list(self.memories)
+                    covered = memories
+                token = self.summary_token = CancelToken()
+
+            # 取消时中止本线程阻塞中的请求
+            remove = token.on_cancel(self.transport.abort)
+            try:
+                if incremental:
+                    summary = self.request_incremental_summary(previous_summary, new_memories, evicted_memories)
+                else:
+                    summary = self.request_summary(memories)
+            finally:
+                remove()
+
+            with self.summary_cond:
+                self.summary_token = None
+                if token.cancelled:
+                    # 结果作废，等新记忆防抖结束后重新请求
+                    if self.running:
+                        print("新增了记忆，已取消进行中的摘要，稍后重新生成")
+                    continue
+                if summary is None:
+                    # 保留待摘要的记忆，退避后重试
+                    self.failures += 1
+                    delay = min(self.retry_delay * 2 ** (self.failures - 1), self.max_retry_delay)
+                    self.retry_time = time.time() + delay
+                    print(f"记忆摘要失败，{delay:.1f} 秒后重试")
+                    continue
+
+                self.summarized_generation = generation
+                self.failures = 0
+                self.retry_time = 0.0
+                self.restarts = 0
+                self.summary = summary
+                self.summary_ready = True
+                self.store.save_summary(summary)
+                # 只移除这次摘要覆盖到的记忆，请求期间新增的记忆留给下一次
+                covered_ids = {id(m) for m in covered}
+                covered_ids.update(id(m) for m in evicted_memories)
+                self.pending_memories = [m for m in self.pending_memories if id(m) not in covered_ids]
+                self.evicted_memories = [m for m in self.evicted_memories if id(m) not in covered_ids]
+                if incremental:
+                    self.incremental_count += 1
+                    print("已增量更新记忆摘要")
+                else:
+                    self.incremental_count = 0
+                    print("已生成新的记忆摘要")
+                if generation != self.generation:
+                    print(f"摘要期间新增了记忆，稍后继续摘要剩余的 {len(self.pending_memories)} 条")
+
+    def has_summary(self):
+        """是否已有可用于增量更新的摘要"""
+        return self.summary_ready
+
+    def format_memories(self, memories):
+        """将记忆列表格式化为文本"""
         memory_text = ""
-        for i, memory in enumerate(self.memories, 1):
+        for i, memory in enumerate(memories, 1):
             entry = f"记忆 #{i} ({memory['timestamp']}):\n"
             if 'user_input' in memory:
                 entry += f"用户: {memory['user_input']}\n"
@@ -100,6 +241,12 @@ class MemoryManager:
                 entry += f"AI: {memory['ai_response']}\n"
             entry += f"情感变化: {memory['emotion_type']} ({memory['emotion_delta']})\n\n"
             memory_text += entry
+        return memory_text
+
+    def request_summary(self, memories):
+        """请求AI模型为给定记忆生成摘要，失败时返回None"""
+        # 准备记忆文本
+        memory_text = self.format_memories(memories)
 
         # 构造提示词
         prompt = (
@@ -114,6 +261,31 @@ class MemoryManager:
             f"互动记录：\n{memory_text}"
         )
 
+        return self.post_summary_prompt(prompt)
+
+    def request_incremental_summary(self, previous_summary, new_memories, evicted_memories):
+        """在上次摘要的基础上，只用新增和移出窗口的记忆更新摘要，失败时返回None"""
+        prompt = (
+            "你是一个记忆摘要生成器。下面是已有的记忆摘要和之后新增的AI与用户互动记录，请输出更新后的完整记忆摘要。\n"
+            "要求：\n"
+            "1. 保留已有摘要中的重要事件，把新增互动按时间顺序补充在后面\n"
+            "2. 每段记忆用1-2句话描述，突出重要事件和情感变化\n"
+            "3. 结合情感变化描述（例如：用户夸奖了AI，AI感到开心）\n"
+            "4. 不要包含时间戳\n"
+            "5. 总长度不超过500字，超出时优先压缩较早的内容\n\n"
+            f"已有摘要：\n{previous_summary}\n\n"
+            f"新增互动记录：\n{self.format_memories(new_memories)}"
+        )
+        if evicted_memories:
+            prompt += (
+                "\n以下较早的互动已移出近期记忆，请在摘要中将其压缩为更简短的描述：\n"
+                f"{self.format_memories(evicted_memories)}"
+            )
+
+        return self.post_summary_prompt(prompt)
+
+    def post_summary_prompt(self, prompt):
+        """发送摘要请求，失败时返回None"""
         # 构造请求
         payload = {
             "model": self.memory_model,
@@ -131,28 +303,67 @@ class MemoryManager:
         }
 
         try:
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=self.headers,
-                json=payload,
-                timeout=60
+            response = self.transport.post(
+                "chat/completions",
+                payload,
+                kind='summary'
             )
             if response.status_code != 200:
                 print(f"生成记忆摘要失败: {response.status_code} - {response.text}")
-                self.summary = "无法生成记忆摘要"
-                return
+                return None
 
             data = response.json()
-            self.summary = data['choices'][0]['message']['content'].strip()
-            print("已生成新的记忆摘要")
+            return data['choices'][0]['message']['content'].strip()
         except Exception as e:
             print(f"生成记忆摘要异常: {str(e)}")
-            self.summary = "无法生成记忆摘要"
+            return None
 
     def get_summary(self):
-        """获取记忆摘要"""
+        """获取最近一次完成的记忆摘要（不阻塞）"""
         return self.summary
 
+    def pending_count(self):
+        """尚未被摘要覆盖的记忆条数"""
+        with self.summary_cond:
+            return len(self.pending_memories)
+
+    def get_pending_text(self, exclude=None):
+        """尚未被摘要覆盖的原始记忆文本，摘要赶上之前可直接放进提示词
+
+        exclude 为已经以其他形式（如多轮对话消息）发送的记忆，不再重复
+        """
+        excluded_ids = {id(m) for m in exclude or ()}
+        with self.summary_cond:
+            pending = [m for m in self.pending_memories if id(m) not in excluded_ids]
+        if not pending:
+            return ""
+        return self.format_memories(pending).strip()
+
+    def stop(self):
+        """停止摘要线程"""
+        with self.summary_cond:
+            self.running = False
+            if self.summary_token:
+                self.summary_token.cancel("关闭")
+            self.summary_cond.notify()
+        if self.summary_thread.is_alive():
+            self.summary_thread.join(timeout=0.5)
+
+    def get_relevant_text(self, query):
+        """与当前输入最相关的历史记忆文本（不含尚未摘要的记忆，它们已单独给出）"""
+        if not self.retriever:
+            return ""
+        with self.summary_cond:
+            pending_ids = [m["id"] for m in self.pending_memories if "id" in m]
+        try:
+            memories = self.retriever.recall(query, exclude_ids=pending_ids)
+        except Exception as e:
+            print(f"记忆召回失败: {str(e)}")
+            return ""
+        if not memories:
+            return ""
+        return self.format_memories(memories).strip()
+
     def has_memories(self):
         """检查是否有记忆"""
         return len(self.memories) > 0
\ No newline at end of file
@@ -0,0 +1,587 @@
+import configparser
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from abc import ABC, abstractmethod
+from collections import deque
+
+
+class MemoryStore(ABC):
+    """记忆存储后端接口"""
+
+    @abstractmethod
+    def load(self):
+        """加载并返回最近的记忆窗口"""
+
+    @abstractmethod
+    def append(self, memory):
+        """持久化一条新记忆"""
+
+    @abstractmethod
+    def load_summary(self):
+        """加载记忆摘要"""
+
+    @abstractmethod
+    def save_summary(self, summary):
+        """保存记忆摘要"""
+
+    @abstractmethod
+    def query_by_time(self, start, end, limit=None):
+        """按时间范围查询记忆（时间格式 %Y-%m-%d %H:%M:%S）"""
+
+    @abstractmethod
+    def query_by_emotion(self, emotion_type, limit=50):
+        """按情感类型查询最近的记忆"""
+
+    @abstractmethod
+    def search(self, text, limit=20):
+        """全文搜索记忆"""
+
+    @abstractmethod
+    def get_by_ids(self, ids):
+        """按id批量读取记忆，保持传入顺序"""
+
+    @abstractmethod
+    def iter_since(self, last_id):
+        """按id顺序遍历 id > last_id 的记忆"""
+
+    @abstractmethod
+    def close(self):
+        """关闭存储"""
+
+    @abstractmethod
+    def store_id(self):
+        """存储的标识：更换或重建存储后不同，用于判断向量索引是否仍然对应"""
+
+    @abstractmethod
+    def max_id(self):
+        """已分配的最大记忆id"""
+
+    def oldest_id(self):
+        """get_by_ids 能返回的最小id，保留全部历史的后端返回0"""
+        return 0
+
+
+class JournalMemoryStore(MemoryStore):
+    """记忆持久化：快照文件 + 追加式日志（JSON Lines）
+
+    每条新记忆只追加一行到日志，写入成本与历史长度无关；
+    日志达到一定条数后在后台线程合并为快照。
+    启动时读取快照，再重放快照之后的日志记录。
+    """
+
+    def __init__(self, max_memories=18, snapshot_file="memories.json", journal_file="memories.jsonl",
+                 summary_file="memory_summary.txt", fsync_policy="always", fsync_interval=1.0,
+                 compact_every=200):
+        self.max_memories = max_memories
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.rotated_file = journal_file + ".compacting"  # 正在合并的旧日志
+        self.summary_file = summary_file
+        self.fsync_policy = fsync_policy  # always: 每条fsync; interval: 按间隔fsync; never: 交给系统
+        self.fsync_interval = fsync_interval
+        self.compact_every = compact_every
+
+        self.lock = threading.Lock()
+        self.window = deque(maxlen=max_memories)  # 与快照对应的记忆窗口
+        self.seq = 0  # 最新一条记录的序号
+        self.journal_records = 0  # 当前日志中的记录条数
+        self.last_fsync = 0.0
+        self.journal = None
+        self.compact_thread = None
+
+    def load(self):
+        """读取快照并重放日志，返回记忆窗口"""
+        memories = self.replay()
+        self._open_journal()
+        return memories
+
+    def _open_journal(self):
+        """打开日志用于追加，失败时保留内存中的窗口，下次追加时重试"""
+        try:
+            self.journal = open(self.journal_file, 'a', encoding='utf-8')
+        except OSError as e:
+            print(f"打开记忆日志失败: {str(e)}")
+            self.journal = None
+
+    def replay(self):
+        """只读地恢复记忆窗口（不打开日志写入）"""
+        snapshot_seq = 0
+        if os.path.exists(self.snapshot_file):
+            try:
+                with open(self.snapshot_file, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                # 兼容旧版的纯列表格式
+                if isinstance(data, list):
+                    memories = data
+                else:
+                    memories = data.get("memories", [])
+                    snapshot_seq = data.get("seq", 0)
+                self.window.extend(memories)
+            except Exception as e:
+                print(f"加载记忆快照失败: {str(e)}")
+
+        self.seq = snapshot_seq
+        replayed = 0
+        # 先重放上次未合并完成的旧日志，再重放当前日志
+        for path in (self.rotated_file, self.journal_file):
+            try:
+                for record in self._read_journal(path):
+                    if record["seq"] <= self.seq:
+                        continue
+                    self.window.append(record["memory"])
+                    self.seq = record["seq"]
+                    replayed += 1
+                    if path == self.journal_file:
+                        self.journal_records += 1
+            except (OSError, KeyError, TypeError) as e:
+                print(f"重放记忆日志失败 ({path}): {str(e)}")
+
+        if replayed:
+            print(f"已从日志恢复 {replayed} 条记忆")
+
+        # 有遗留的旧日志时立即合并
+        # 失败时保留旧日志，下次启动会再次重放
+        if os.path.exists(self.rotated_file):
+            try:
+                self._write_snapshot(list(self.window), self.seq)
+                os.remove(self.rotated_file)
+            except OSError as e:
+                print(f"合并遗留的记忆日志失败: {str(e)}")
+
+        return list(self.window)
+
+    def _read_journal(self, path):
+        """逐行读取日志，跳过崩溃时写了一半的行"""
+        if not os.path.exists(path):
+            return
+        with open(path, 'r', encoding='utf-8') as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    print(f"跳过损坏的日志记录: {line[:50]}")
+                    continue
+                yield record
+
+    def append(self, memory):
+        """追加一条记忆到日志"""
+        with self.lock:
+            if self.journal is None:
+                self._open_journal()
+                if self.journal is None:
+                    raise OSError("记忆日志未打开")
+            self.seq += 1
+            memory["id"] = self.seq
+            self.window.append(memory)
+            self.journal.write(json.dumps({"seq": self.seq, "memory": memory}, ensure_ascii=False) + "\n")
+            self.journal.flush()
+            self._maybe_fsync()
+            self.journal_records += 1
+
+            # 上次遗留的旧日志还没合并成功时不能再轮换，否则会覆盖它
+            if (self.journal_records >= self.compact_every and not self._compacting()
+                    and not os.path.exists(self.rotated_file)):
+                self._start_compaction()
+
+    def _maybe_fsync(self):
+        """按配置的策略fsync日志"""
+        if self.fsync_policy == "never":
+            return
+        now = time.time()
+        if self.fsync_policy == "always" or now - self.last_fsync >= self.fsync_interval:
+            os.fsync(self.journal.fileno())
+            self.last_fsync = now
+
+    def _compacting(self):
+        return self.compact_thread is not None and self.compact_thread.is_alive()
+
+    def _start_compaction(self):
+        """轮换日志并在后台写快照（调用时需持有锁）"""
+        self.journal.close()
+        try:
+            os.replace(self.journal_file, self.rotated_file)
+        except OSError as e:
+            # 轮换失败时继续追加到原日志，下次追加时再尝试合并
+            print(f"轮换记忆日志失败: {str(e)}")
+            return
+        finally:
+            # 无论是否轮换成功都重新打开日志，打开失败时由 append 下次重试
+            self._open_journal()
+        self.journal_records = 0
+
+        self.compact_thread = threading.Thread(
+            target=self._compact,
+            args=(list(self.window), self.seq),
+            daemon=True
+        )
+        self.compact_thread.start()
+
+    def _compact(self, memories, seq):
+        """后台合并：写入快照后删除旧日志"""
+        try:
+            self._write_snapshot(memories, seq)
+            os.remove(self.rotated_file)
+            print(f"记忆日志已合并到快照 ({len(memories)} 条)")
+        except Exception as e:
+            print(f"合并记忆日志失败: {str(e)}")
+
+    def _write_snapshot(self, memories, seq):
+        """原子地写入快照文件"""
+        tmp_file = self.snapshot_file + ".tmp"
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump({"seq": seq, "memories": memories}, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.snapshot_file)
+
+    def load_summary(self):
+        """加载记忆摘要"""
+        if not os.path.exists(self.summary_file):
+            return ""
+        try:
+            with open(self.summary_file, 'r', encoding='utf-8') as f:
+                summary = f.read().strip()
+            print(f"已加载记忆摘要")
+            return summary
+        except Exception as e:
+            print(f"加载记忆摘要失败: {str(e)}")
+            return ""
+
+    def save_summary(self, summary):
+        """原子地保存记忆摘要"""
+        try:
+            tmp_file = self.summary_file + ".tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write(summary)
+            os.replace(tmp_file, self.summary_file)
+        except Exception as e:
+            print(f"保存记忆摘要失败: {str(e)}")
+
+    def query_by_time(self, start, end, limit=None):
+        """按时间范围查询（仅限记忆窗口内）"""
+        with self.lock:
+            result = [m for m in self.window if start <= m.get("timestamp", "") <= end]
+        return result[:limit] if limit else result
+
+    def query_by_emotion(self, emotion_type, limit=50):
+        """按情感类型查询（仅限记忆窗口内）"""
+        with self.lock:
+            result = [m for m in self.window if m.get("emotion_type") == emotion_type]
+        return result[-limit:]
+
+    def search(self, text, limit=20):
+        """子串搜索（仅限记忆窗口内）"""
+        with self.lock:
+            result = [
+                m for m in self.window
+                if text in m.get("user_input", "") or text in m.get("ai_response", "")
+            ]
+        return result[-limit:]
+
+    def get_by_ids(self, ids):
+        """按id读取（仅限记忆窗口内）"""
+        with self.lock:
+            by_id = {m["id"]: m for m in self.window if "id" in m}
+        return [by_id[i] for i in ids if i in by_id]
+
+    def store_id(self):
+        return f"journal:{os.path.abspath(self.journal_file)}"
+
+    def max_id(self):
+        return self.seq
+
+    def oldest_id(self):
+        """快照只保存记忆窗口，更早的记忆已无法读取"""
+        with self.lock:
+            ids = [m["id"] for m in self.window if "id" in m]
+        return min(ids) if ids else self.seq + 1
+
+    def iter_since(self, last_id):
+        """遍历窗口内 id > last_id 的记忆"""
+        with self.lock:
+            memories = [m for m in self.window if m.get("id", 0) > last_id]
+        return iter(memories)
+
+    def close(self):
+        """关闭时把日志合并进快照"""
+        if self._compacting():
+            self.compact_thread.join()
+        with self.lock:
+            if self.journal is None:
+                return
+            try:
+                self._write_snapshot(list(self.window), self.seq)
+                self.journal.close()
+                # 快照已包含全部记录，清空日志
+                open(self.journal_file, 'w', encoding='utf-8').close()
+                self.journal_records = 0
+                print(f"已保存 {len(self.window)} 条记忆")
+            except Exception as e:
+                print(f"保存记忆失败: {str(e)}")
+            self.journal = None
+
+
+class SQLiteMemoryStore(MemoryStore):
+    """SQLite记忆存储：保留全部历史，启动时只把最近的记忆窗口读入内存
+
+    timestamp 和 emotion_type 建有索引，支持FTS5时额外建立全文索引。
+    首次启动时自动迁移旧的 memories.json / memories.jsonl。
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS memories (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp TEXT NOT NULL,
+            emotion_type TEXT,
+            emotion_delta REAL,
+            user_input TEXT,
+            ai_response TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_memories_timestamp ON memories(timestamp);
+        CREATE INDEX IF NOT EXISTS idx_memories_emotion ON memories(emotion_type, timestamp);
+        CREATE TABLE IF NOT EXISTS meta (
+            key TEXT PRIMARY KEY,
+            value TEXT
+        );
+    """
+
+    COLUMNS = ("timestamp", "emotion_type", "emotion_delta", "user_input", "ai_response")
+
+    def __init__(self, max_memories=18, db_file="memories.db", legacy_snapshot_file="memories.json",
+                 legacy_journal_file="memories.jsonl", legacy_summary_file="memory_summary.txt"):
+        self.max_memories = max_memories
+        self.db_file = db_file
+        self.legacy_snapshot_file = legacy_snapshot_file
+        self.legacy_journal_file = legacy_journal_file
+        self.legacy_summary_file = legacy_summary_file
+
+        self.lock = threading.Lock()
+        # 记忆由对话线程写入、摘要线程读取，由锁保证串行
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(self.SCHEMA)
+        self.fts_enabled = self._create_fts()
+        # 新建的数据库生成一个随机标识，重建数据库后向量索引据此重建
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'store_id'").fetchone()
+        if row:
+            self.uuid = row["value"]
+        else:
+            self.uuid = uuid.uuid4().hex
+            self.conn.execute("INSERT INTO meta (key, value) VALUES ('store_id', ?)", (self.uuid,))
+        self.conn.commit()
+
+    def _create_fts(self):
+        """创建全文索引，中文使用trigram分词，不支持FTS5时退回LIKE查询"""
+        for tokenizer in ("trigram", "unicode61"):
+            try:
+                self.conn.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS memories_fts USING fts5("
+                    "user_input, ai_response, content='memories', content_rowid='id', "
+                    f"tokenize='{tokenizer}')"
+                )
+                self.conn.execute(
+                    "CREATE TRIGGER IF NOT EXISTS memories_fts_insert AFTER INSERT ON memories BEGIN "
+                    "INSERT INTO memories_fts(rowid, user_input, ai_response) "
+                    "VALUES (new.id, new.user_input, new.ai_response); END"
+                )
+                return True
+            except sqlite3.OperationalError:
+                continue
+        print("SQLite不支持FTS5，全文搜索将使用LIKE查询")
+        return False
+
+    def _row_to_memory(self, row):
+        """数据库行转换为记忆字典（与JSON格式一致）"""
+        memory = {
+            "id": row["id"],
+            "timestamp": row["timestamp"],
+            "emotion_type": row["emotion_type"],
+            "emotion_delta": row["emotion_delta"]
+        }
+        if row["user_input"]:
+            memory["user_input"] = row["user_input"]
+        if row["ai_response"]:
+            memory["ai_response"] = row["ai_response"]
+        return memory
+
+    def _insert(self, memory):
+        cursor = self.conn.execute(
+            f"INSERT INTO memories ({', '.join(self.COLUMNS)}) VALUES (?, ?, ?, ?, ?)",
+            tuple(memory.get(column) for column in self.COLUMNS)
+        )
+        return cursor.lastrowid
+
+    def _migrate_legacy(self):
+        """从旧的JSON快照和日志迁移记忆"""
+        if not (os.path.exists(self.legacy_snapshot_file) or os.path.exists(self.legacy_journal_file)):
+            return
+
+        legacy = JournalMemoryStore(
+            max_memories=None,
+            snapshot_file=self.legacy_snapshot_file,
+            journal_file=self.legacy_journal_file,
+            summary_file=self.legacy_summary_file
+        )
+        memories = legacy.replay()
+        summary = legacy.load_summary()
+
+        with self.conn:
+            for memory in memories:
+                self._insert(memory)
+            if summary:
+                self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('summary', ?)", (summary,))
+
+        # 迁移完成后保留旧文件作为备份
+        for path in (self.legacy_snapshot_file, self.legacy_journal_file):
+            if os.path.exists(path):
+                os.replace(path, path + ".migrated")
+        print(f"已将 {len(memories)} 条旧记忆迁移到 {self.db_file}")
+
+    def load(self):
+        """返回最近 max_memories 条记忆"""
+        with self.lock:
+            if self.count_locked() == 0:
+                self._migrate_legacy()
+            rows = self.conn.execute(
+                "SELECT * FROM memories ORDER BY id DESC LIMIT ?",
+                (self.max_memories,)
+            ).fetchall()
+        return [self._row_to_memory(row) for row in reversed(rows)]
+
+    def append(self, memory):
+        """插入一条记忆，并把数据库id写回记忆字典"""
+        with self.lock:
+            with self.conn:
+                memory["id"] = self._insert(memory)
+
+    def count_locked(self):
+        return self.conn.execute("SELECT COUNT(*) FROM memories").fetchone()[0]
+
+    def store_id(self):
+        return f"sqlite:{self.uuid}"
+
+    def max_id(self):
+        with self.lock:
+            return self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM memories").fetchone()[0]
+
+    def count(self):
+        """记忆总条数"""
+        with self.lock:
+            return self.count_locked()
+
+    def get_by_ids(self, ids):
+        """按id批量读取记忆，保持传入顺序"""
+        if not ids:
+            return []
+        placeholders = ", ".join("?" for _ in ids)
+        with self.lock:
+            rows = self.conn.execute(
+                f"SELECT * FROM memories WHERE id IN ({placeholders})",
+                tuple(ids)
+            ).fetchall()
+        by_id = {row["id"]: self._row_to_memory(row) for row in rows}
+        return [by_id[i] for i in ids if i in by_id]
+
+    def iter_since(self, last_id, batch_size=500):
+        """分批遍历 id > last_id 的记忆，避免一次读入全部历史"""
+        while True:
+            with self.lock:
+                rows = self.conn.execute(
+                    "SELECT * FROM memories WHERE id > ? ORDER BY id LIMIT ?",
+                    (last_id, batch_size)
+                ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield self._row_to_memory(row)
+            last_id = rows[-1]["id"]
+
+    def query_by_time(self, start, end, limit=None):
+        sql = "SELECT * FROM memories WHERE timestamp BETWEEN ? AND ? ORDER BY timestamp"
+        params = [start, end]
+        if limit:
+            sql += " LIMIT ?"
+            params.append(limit)
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [self._row_to_memory(row) for row in rows]
+
+    def query_by_emotion(self, emotion_type, limit=50):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT * FROM memories WHERE emotion_type = ? ORDER BY timestamp DESC LIMIT ?",
+                (emotion_type, limit)
+            ).fetchall()
+        return [self._row_to_memory(row) for row in reversed(rows)]
+
+    def search(self, text, limit=20):
+        # trigram分词要求至少3个字符，更短的关键词用LIKE
+        if self.fts_enabled and len(text) >= 3:
+            # 按短语匹配，避免用户输入被当作FTS语法
+            phrase = '"' + text.replace('"', '""') + '"'
+            sql = (
+                "SELECT m.* FROM memories_fts f JOIN memories m ON m.id = f.rowid "
+                "WHERE memories_fts MATCH ? ORDER BY m.id DESC LIMIT ?"
+            )
+            params = (phrase, limit)
+        else:
+            pattern = f"%{text}%"
+            sql = (
+                "SELECT * FROM memories WHERE user_input LIKE ? OR ai_response LIKE ? "
+                "ORDER BY id DESC LIMIT ?"
+            )
+            params = (pattern, pattern, limit)
+        with self.lock:
+            rows = self.conn.execute(sql, params).fetchall()
+        return [self._row_to_memory(row) for row in reversed(rows)]
+
+    def load_summary(self):
+        with self.lock:
+            row = self.conn.execute("SELECT value FROM meta WHERE key = 'summary'").fetchone()
+        if row:
+            print("已加载记忆摘要")
+            return row["value"]
+        return ""
+
+    def save_summary(self, summary):
+        try:
+            with self.lock:
+                with self.conn:
+                    self.conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('summary', ?)", (summary,))
+        except Exception as e:
+            print(f"保存记忆摘要失败: {str(e)}")
+
+    def close(self):
+        with self.lock:
+            if self.conn is None:
+                return
+            total = self.count_locked()
+            self.conn.close()
+            self.conn = None
+        print(f"记忆数据库已关闭，共 {total} 条记忆")
+
+
+def create_memory_store(parser: configparser.ConfigParser, max_memories):
+    """根据config.ini的[Memory]部分创建记忆存储后端"""
+    storage = parser.get('Memory', 'storage', fallback='journal').strip().lower()
+    if storage == 'sqlite':
+        return SQLiteMemoryStore(
+            max_memories,
+            db_file=parser.get('Memory', 'memory_db', fallback='memories.db')
+        )
+
+    return JournalMemoryStore(
+        max_memories,
+        fsync_policy=parser.get('Memory', 'journal_fsync', fallback='always').strip().lower(),
+        fsync_interval=parser.getfloat('Memory', 'journal_fsync_interval', fallback=1.0),
+        compact_every=parser.getint('Memory', 'journal_compact_every', fallback=200)
+    )
@@ -0,0 +1,185 @@
+import configparser
+import time
+from abc import ABC, abstractmethod
+
+import numpy as np
+
+# 本地OCR引擎都是可选依赖，未安装时对应引擎不可用
+try:
+    import pytesseract
+except ImportError:
+    pytesseract = None
+
+try:
+    from rapidocr_onnxruntime import RapidOCR
+except ImportError:
+    RapidOCR = None
+
+
+class OcrLine:
+    """识别出的一行文字"""
+
+    __slots__ = ("text", "confidence", "box")
+
+    def __init__(self, text, confidence, box=None):
+        self.text = text
+        self.confidence = confidence  # 0~1
+        self.box = box                # (左, 上, 右, 下)，引擎不提供时为 None
+
+
+class OcrResult:
+    """一次识别的结果"""
+
+    def __init__(self, lines, elapsed, min_confidence=0.0):
+        # 只保留置信度足够的行
+        self.lines = [line for line in lines if line.text.strip() and line.confidence >= min_confidence]
+        self.elapsed = elapsed
+
+    @property
+    def text(self):
+        return "\n".join(line.text.strip() for line in self.lines)
+
+    @property
+    def char_count(self):
+        """有效字符数（不计空白）"""
+        return sum(len("".join(line.text.split())) for line in self.lines)
+
+
+class OcrEngine(ABC):
+    """OCR引擎接口"""
+
+    name = "base"
+
+    @abstractmethod
+    def recognize(self, image):
+        """识别图像中的文字，返回 [OcrLine]"""
+
+
+class StubOcrEngine(OcrEngine):
+    """固定返回配置文本的引擎，用于测试和调试流程"""
+
+    name = "stub"
+
+    def __init__(self, text=""):
+        self.text = text
+
+    def recognize(self, image):
+        return [OcrLine(line, 1.0) for line in self.text.splitlines() if line.strip()]
+
+
+class TesseractEngine(OcrEngine):
+    """pytesseract（需要本机安装 tesseract 及对应语言包）"""
+
+    name = "tesseract"
+
+    def __init__(self, lang="chi_sim+eng"):
+        if pytesseract is None:
+            raise RuntimeError("未安装 pytesseract")
+        self.lang = lang
+
+    def recognize(self, image):
+        data = pytesseract.image_to_data(image, lang=self.lang, output_type=pytesseract.Output.DICT)
+
+        # 按 (块, 段, 行) 把单词合并成行，置信度取平均
+        lines = {}
+        for i, word in enumerate(data["text"]):
+            confidence = float(data["conf"][i])
+            if not word.strip() or confidence < 0:
+                continue
+            key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+            left, top = data["left"][i], data["top"][i]
+            right, bottom = left + data["width"][i], top + data["height"][i]
+            entry = lines.get(key)
+            if entry is None:
+                lines[key] = [[word], [confidence], [left, top, right, bottom]]
+            else:
+                entry[0].append(word)
+                entry[1].append(confidence)
+                box = entry[2]
+                box[0], box[1] = min(box[0], left), min(box[1], top)
+                box[2], box[3] = max(box[2], right), max(box[3], bottom)
+
+        result = []
+        for words, confidences, box in lines.values():
+            # 中文单字之间不加空格
+            text = "".join(words) if self.lang.startswith("chi") else " ".join(words)
+            result.append(OcrLine(text, sum(confidences) / len(confidences) / 100.0, tuple(box)))
+        return result
+
+
+class RapidOcrEngine(OcrEngine):
+    """rapidocr-onnxruntime（纯CPU，中文识别效果较好）"""
+
+    name = "rapidocr"
+
+    def __init__(self):
+        if RapidOCR is None:
+            raise RuntimeError("未安装 rapidocr_onnxruntime")
+        self.engine = RapidOCR()
+
+    def recognize(self, image):
+        output, _ = self.engine(np.asarray(image.convert("RGB")))
+        result = []
+        for points, text, score in output or ():
+            xs = [point[0] for point in points]
+            ys = [point[1] for point in points]
+            result.append(OcrLine(text, float(score), (min(xs), min(ys), max(xs), max(ys))))
+        return result
+
+
+class ScreenTextExtractor:
+    """截图的本地文字识别：识别出足够多的文字时，可以用文本模型代替视觉模型"""
+
+    def __init__(self, engine, min_chars=40, min_confidence=0.6):
+        self.engine = engine
+        self.min_chars = min_chars
+        self.min_confidence = min_confidence
+
+    def extract(self, image):
+        """识别图像中的文字，引擎出错时返回 None"""
+        start = time.perf_counter()
+        try:
+            lines = self.engine.recognize(image)
+        except Exception as e:
+            print(f"OCR识别失败 ({self.engine.name}): {str(e)}")
+            return None
+        return OcrResult(lines, time.perf_counter() - start, self.min_confidence)
+
+    def is_sufficient(self, result):
+        return result is not None and result.char_count >= self.min_chars
+
+
+def create_text_extractor(parser: configparser.ConfigParser):
+    """根据config.ini的[OCR]部分创建文字识别，未启用或没有可用引擎时返回 None"""
+    if not parser.getboolean('OCR', 'enabled', fallback=False):
+        return None
+
+    name = parser.get('OCR', 'engine', fallback='auto').strip().lower()
+    candidates = ['rapidocr', 'tesseract'] if name == 'auto' else [name]
+
+    engine = None
+    for candidate in candidates:
+        try:
+            if candidate == 'rapidocr':
+                engine = RapidOcrEngine()
+            elif candidate == 'tesseract':
+                engine = TesseractEngine(parser.get('OCR', 'lang', fallback='chi_sim+eng'))
+            elif candidate == 'stub':
+                engine = StubOcrEngine(parser.get('OCR', 'stub_text', fallback='').replace('\\n', '\n'))
+            else:
+                print(f"未知的OCR引擎: {candidate}")
+                continue
+            break
+        except Exception as e:
+            print(f"OCR引擎 {candidate} 不可用: {str(e)}")
+
+    if engine is None:
+        print("没有可用的OCR引擎，截图将直接交给视觉模型")
+        return None
+
+    print(f"OCR引擎: {engine.name}")
+    return ScreenTextExtractor(
+        engine,
+        min_chars=parser.getint('OCR', 'min_chars', fallback=40),
+        min_confidence=parser.getfloat('OCR', 'min_confidence', fallback=0.6)
+    )
@@ -0,0 +1,98 @@
+import configparser
+
+
+def estimate_tokens(text):
+    """快速估算token数：中日文等非ASCII字符约每字1个token，ASCII约每4字符1个token"""
+    if not text:
+        return 0
+    ascii_chars = len(text.encode('ascii', 'ignore'))
+    return (len(text) - ascii_chars) + (ascii_chars + 3) // 4
+
+
+class PromptSection:
+    """提示词片段
+
+    priority 越小越重要；超出预算时从优先级最低的片段开始截断或丢弃。
+    required 的片段（人设、输出格式等）永远保留。
+    keep 指定截断时保留正文的开头（head）还是结尾（tail，较新的内容）。
+    """
+
+    def __init__(self, name, body, priority=0, header="", required=False, keep="tail", min_tokens=20):
+        self.name = name
+        self.header = header
+        self.body = body or ""
+        self.priority = priority
+        self.required = required
+        self.keep = keep
+        self.min_tokens = min_tokens  # 截断后少于该值时直接丢弃
+
+    @property
+    def empty(self):
+        """正文只有空白（例如没有摘要时的 "\n"）视为空片段"""
+        return not self.body.strip()
+
+    def render(self):
+        return f"{self.header}{self.body}"
+
+    def tokens(self):
+        return estimate_tokens(self.render())
+
+
+class PromptBuilder:
+    """按token预算拼装提示词，超出预算时按优先级截断或丢弃片段"""
+
+    def __init__(self, default_budget=3000, model_budgets=None):
+        self.default_budget = default_budget
+        self.model_budgets = model_budgets or {}
+
+    @classmethod
+    def from_config(cls, parser: configparser.ConfigParser):
+        """[Prompt] token_budget 为默认预算，[PromptBudget] 中可按模型名单独设置"""
+        model_budgets = {}
+        if parser.has_section('PromptBudget'):
+            for model, budget in parser.items('PromptBudget'):
+                model_budgets[model.lower()] = int(budget)
+        return cls(parser.getint('Prompt', 'token_budget', fallback=3000), model_budgets)
+
+    def budget_for(self, model):
+        return self.model_budgets.get(model.lower(), self.default_budget)
+
+    def build(self, sections, model, reserved_tokens=0, separator="\n"):
+        """按原顺序拼装非空片段；reserved_tokens 为同一请求中其他消息占用的token"""
+        sections = [s for s in sections if not s.empty or s.required]
+        budget = self.budget_for(model) - reserved_tokens
+        costs = {id(s): s.tokens() for s in sections}
+        total = sum(costs.values())
+
+        # 从最不重要的片段开始处理
+        for section in sorted(sections, key=lambda s: s.priority, reverse=True):
+            if total <= budget:
+                break
+            if section.required:
+                continue
+
+            available = section.tokens() - (total - budget) - estimate_tokens(section.header)
+            if available >= section.min_tokens:
+                section.body = self._truncate(section.body, available, section.keep)
+                print(f"提示词片段已截断: {section.name}")
+            else:
+                section.body = ""
+                print(f"提示词片段已丢弃: {section.name}")
+            total -= costs[id(section)] - (section.tokens() if section.body else 0)
+
+        return separator.join(s.render() for s in sections if not s.empty or s.required)
+
+    @staticmethod
+    def _truncate(text, max_tokens, keep="tail"):
+        """二分查找能放进 max_tokens 的最长前缀/后缀"""
+        low, high = 0, len(text)
+        while low < high:
+            mid = (low + high + 1) // 2
+            part = text[-mid:] if keep == "tail" else text[:mid]
+            if estimate_tokens(part) + 1 <= max_tokens:
+                low = mid
+            else:
+                high = mid - 1
+        if low == 0:
+            return ""
+        return "…" + text[-low:] if keep == "tail" else text[:low] + "…"
@@ -0,0 +1,112 @@
+import queue
+import threading
+import tkinter as tk
+
+
+class QueueBridge:
+    """把进程间队列的消息转交给 Tk 主循环，替代 after() 定时轮询
+
+    每个队列由一个后台线程阻塞读取，收到消息后放入内部队列，
+    再用 event_generate(..., when='tail') 唤醒 Tk 线程一次性处理。
+    同一批消息只产生一个事件，空闲时不会唤醒 Tk。
+    Tcl 未启用线程支持时无法跨线程发送事件，退回定时轮询。
+    """
+
+    EVENT = "<<QueueBridgeMessage>>"
+
+    def __init__(self, root, sources, handler, poll_interval=100):
+        """sources: {名称: 队列}；handler(messages) 在 Tk 线程中调用，messages 为 [(名称, 消息)]"""
+        self.root = root
+        self.sources = sources
+        self.handler = handler
+        self.poll_interval = poll_interval
+
+        self.inbox = queue.Queue()
+        self.pending = threading.Event()  # 已发送唤醒事件、Tk 线程尚未处理
+        self.running = False
+        self.threads = []
+        self.event_driven = self._tcl_threaded()
+
+        # 统计：唤醒次数和处理的消息数
+        self.wakeups = 0
+        self.messages = 0
+
+    def _tcl_threaded(self):
+        try:
+            return self.root.tk.eval("set tcl_platform(threaded)") == "1"
+        except tk.TclError:
+            return False
+
+    def start(self):
+        """开始转发消息，需在 mainloop 运行后调用（可用 root.after(0, bridge.start)）"""
+        if self.running:
+            return
+        self.running = True
+
+        if not self.event_driven:
+            print("Tcl 不支持多线程，队列消息改用定时轮询")
+            self.root.after(self.poll_interval, self._poll)
+            return
+
+        self.root.bind(self.EVENT, self._on_event)
+        for name, source in self.sources.items():
+            thread = threading.Thread(target=self._reader, args=(name, source), daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.running = False
+
+    def _reader(self, name, source):
+        """后台线程：阻塞等待消息并唤醒 Tk"""
+        while self.running:
+            try:
+                message = source.get()
+            except (EOFError, OSError):
+                # 对端进程退出，队列已关闭
+                break
+
+            self.inbox.put((name, message))
+            if self.pending.is_set():
+                continue
+            self.pending.set()
+            try:
+                self.root.event_generate(self.EVENT, when="tail")
+            except (tk.TclError, RuntimeError):
+                # 窗口已关闭
+                break
+
+    def _on_event(self, event=None):
+        # 先清除标记再取消息，处理期间到达的消息会触发新的事件
+        self.pending.clear()
+        self._drain()
+
+    def _drain(self):
+        messages = []
+        try:
+            while True:
+                messages.append(self.inbox.get_nowait())
+        except queue.Empty:
+            pass
+
+        if messages:
+            self.wakeups += 1
+            self.messages += len(messages)
+            self.handler(messages)
+
+    def _poll(self):
+        """退回方案：定时从各个队列取消息"""
+        if not self.running:
+            return
+        messages = []
+        for name, source in self.sources.items():
+            try:
+                while True:
+                    messages.append((name, source.get_nowait()))
+            except queue.Empty:
+                pass
+        if messages:
+            self.wakeups += 1
+            self.messages += len(messages)
+            self.handler(messages)
+        self.root.after(self.poll_interval, self._poll)
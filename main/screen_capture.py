@@ -0,0 +1,284 @@
+import base64
+import configparser
+import ctypes
+import io
+import os
+import sys
+import threading
+import time
+
+import mss
+import numpy as np
+from PIL import Image, features
+
+# 编码格式 -> (PIL格式名, MIME类型)
+FORMATS = {
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp'),
+    'png': ('PNG', 'image/png'),
+}
+
+# 截取目标
+CAPTURE_TARGETS = ('primary', 'cursor', 'character', 'region', 'all')
+
+
+def cursor_position():
+    """获取鼠标的屏幕坐标，不支持的平台返回 None"""
+    if sys.platform != "win32":
+        return None
+
+    class POINT(ctypes.Structure):
+        _fields_ = [("x", ctypes.c_long), ("y", ctypes.c_long)]
+
+    point = POINT()
+    if not ctypes.windll.user32.GetCursorPos(ctypes.byref(point)):
+        return None
+    return point.x, point.y
+
+
+class Screenshot:
+    """一次截图的结果：原始分辨率和缩放后的图像（可裁剪），编码后填入base64数据"""
+
+    def __init__(self, image, monitor, timings, full_image=None):
+        self.image = image          # 缩放后的 PIL 图像（裁剪后为裁剪区域），发送给视觉模型
+        self.full_image = full_image if full_image is not None else image  # 原始分辨率（裁剪后为对应区域），用于OCR
+        self.monitor = monitor      # 截取的屏幕区域 {"left", "top", "width", "height"}
+        self.timings = timings      # 各阶段耗时（秒）
+        self.crop_box = None        # 裁剪到变化区域时，在缩放后整幅图像中的 (左, 上, 右, 下)
+        self.data = None            # 编码后的 base64 字符串
+        self.mime_type = None
+        self.size = 0               # 编码后的字节数
+        self.path = None            # 调试保存的文件路径
+
+    @property
+    def data_url(self):
+        return f"data:{self.mime_type};base64,{self.data}"
+
+
+class ScreenCapture:
+    """内存截图管线：选择截取区域 -> 截屏 -> 缩放 -> (裁剪到变化区域) -> 编码到内存 -> base64，不经过磁盘
+
+    截取目标：
+        primary    主显示器
+        cursor     鼠标所在的显示器（目前仅 Windows，其他平台退回主显示器）
+        character  立绘窗口所在的显示器（窗口位置由立绘进程写入共享数组 window_rect）
+        region     配置的固定区域 left,top,width,height
+        all        所有显示器拼成的整幅画面
+
+    mss 实例在截图线程中创建后一直复用（Windows 上 mss 的句柄不能跨线程使用），
+    编码使用同一个 BytesIO 缓冲。只有开启 save_dir 时才把编码结果写入文件，用于调试。
+    """
+
+    def __init__(self, max_side=1280, image_format='jpeg', quality=80, save_dir=None,
+                 target='primary', region=None, crop_max_fraction=0.6):
+        self.max_side = max_side
+        self.quality = max(1, min(100, quality))
+        if target not in CAPTURE_TARGETS or (target == 'region' and not region):
+            print(f"无效的截图目标 {target}，使用主显示器")
+            target = 'primary'
+        self.target = target
+        self.region = region
+        self.crop_max_fraction = crop_max_fraction
+        self.window_rect = None  # 立绘窗口位置的共享数组 [x, y, 宽, 高]，由 run_ai_client 设置
+
+        image_format = image_format.lower()
+        if image_format == 'jpg':
+            image_format = 'jpeg'
+        if image_format not in FORMATS or (image_format == 'webp' and not features.check('webp')):
+            print(f"不支持的截图编码格式 {image_format}，使用 JPEG")
+            image_format = 'jpeg'
+        self.pil_format, self.mime_type = FORMATS[image_format]
+        self.extension = image_format
+
+        self.save_dir = save_dir
+        if self.save_dir:
+            os.makedirs(self.save_dir, exist_ok=True)
+
+        # mss 实例和编码缓冲不能跨线程共用，每个工作线程各保留一份，close() 时统一关闭
+        self.local = threading.local()
+        self.instances_lock = threading.Lock()
+        self.instances = []
+
+    @classmethod
+    def from_config(cls, parser: configparser.ConfigParser):
+        """根据config.ini的[Visual]部分创建"""
+        save_dir = None
+        if parser.getboolean('Visual', 'save_screenshots', fallback=False):
+            save_dir = parser.get('Visual', 'screenshot_dir', fallback='screenshots')
+        region = None
+        region_text = parser.get('Visual', 'capture_region', fallback='').strip()
+        if region_text:
+            try:
+                left, top, width, height = (int(part) for part in region_text.split(','))
+                region = {"left": left, "top": top, "width": width, "height": height}
+            except ValueError:
+                print(f"无效的截图区域: {region_text}，格式应为 left,top,width,height")
+
+        crop_max_fraction = 0.0
+        if parser.getboolean('Visual', 'crop_to_changes', fallback=True):
+            crop_max_fraction = parser.getfloat('Visual', 'crop_max_fraction', fallback=0.6)
+
+        return cls(
+            max_side=parser.getint('Visual', 'capture_max_side', fallback=1280),
+            image_format=parser.get('Visual', 'capture_format', fallback='jpeg'),
+            quality=parser.getint('Visual', 'capture_quality', fallback=80),
+            save_dir=save_dir,
+            target=parser.get('Visual', 'capture_target', fallback='primary').strip().lower(),
+            region=region,
+            crop_max_fraction=crop_max_fraction
+        )
+
+    def _get_sct(self):
+        """获取当前线程的 mss 实例，首次使用时创建"""
+        sct = getattr(self.local, 'sct', None)
+        if sct is None:
+            sct = self.local.sct = mss.mss()
+            with self.instances_lock:
+                self.instances.append(sct)
+        return sct
+
+    def _get_buffer(self):
+        """获取当前线程的编码缓冲"""
+        buffer = getattr(self.local, 'buffer', None)
+        if buffer is None:
+            buffer = self.local.buffer = io.BytesIO()
+        return buffer
+
+    def select_monitor(self):
+        """按截取目标计算要截取的屏幕区域"""
+        monitors = self._get_sct().monitors
+        if self.target == 'all':
+            return monitors[0]
+        if self.target == 'region':
+            return self.region
+
+        point = None
+        if self.target == 'cursor':
+            point = cursor_position()
+        elif self.target == 'character' and self.window_rect is not None:
+            x, y, width, height = self.window_rect[:]
+            if width > 0 and height > 0:
+                point = (x + width // 2, y + height // 2)
+
+        if point is not None:
+            for monitor in monitors[1:]:
+                if (monitor["left"] <= point[0] < monitor["left"] + monitor["width"]
+                        and monitor["top"] <= point[1] < monitor["top"] + monitor["height"]):
+                    return monitor
+        # 找不到时使用主显示器
+        return monitors[1] if len(monitors) > 1 else monitors[0]
+
+    def grab(self, monitor):
+        """截取屏幕区域，返回 RGB 的 PIL 图像"""
+        sct_img = self._get_sct().grab(monitor)
+        # 直接按 BGRX 解释原始像素，省去 mss 生成 RGB 字节串的复制
+        return Image.frombuffer('RGB', sct_img.size, sct_img.bgra, 'raw', 'BGRX', 0, 1)
+
+    def downscale(self, image):
+        """按最长边缩放到 max_side，返回新图像（原图保留给OCR），小图不放大"""
+        width, height = image.size
+        if not self.max_side or max(width, height) <= self.max_side:
+            return image
+        ratio = self.max_side / max(width, height)
+        size = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+        # reducing_gap 先用整数倍快速缩小，再做一次高质量重采样
+        return image.resize(size, Image.BICUBIC, reducing_gap=2.0)
+
+    def encode(self, image):
+        """编码到内存缓冲，返回 (base64字符串, 字节数)"""
+        buffer = self._get_buffer()
+        buffer.seek(0)
+        buffer.truncate()
+        if self.pil_format == 'PNG':
+            image.save(buffer, self.pil_format)
+        else:
+            image.save(buffer, self.pil_format, quality=self.quality)
+        view = buffer.getbuffer()
+        try:
+            return base64.b64encode(view).decode('ascii'), len(view)
+        finally:
+            view.release()
+
+    def capture(self):
+        """截图并缩放，返回尚未编码的 Screenshot"""
+        timings = {}
+        start = time.perf_counter()
+        monitor = self.select_monitor()
+        image = self.grab(monitor)
+        timings['grab'] = time.perf_counter() - start
+
+        step = time.perf_counter()
+        scaled = self.downscale(image)
+        timings['scale'] = time.perf_counter() - step
+        return Screenshot(scaled, monitor, timings, full_image=image)
+
+    def crop_to_changes(self, screenshot, block_map):
+        """只保留发生变化的块的外接矩形（外扩一块），裁剪后面积仍超过上限时不裁剪
+
+        block_map 为 (行, 列) 布尔数组，覆盖整幅图像。返回是否进行了裁剪。
+        """
+        if self.crop_max_fraction <= 0 or block_map is None or not block_map.any():
+            return False
+
+        rows, cols = block_map.shape
+        changed_rows = np.flatnonzero(block_map.any(axis=1))
+        changed_cols = np.flatnonzero(block_map.any(axis=0))
+        top_block = max(0, int(changed_rows[0]) - 1)
+        bottom_block = min(rows, int(changed_rows[-1]) + 2)
+        left_block = max(0, int(changed_cols[0]) - 1)
+        right_block = min(cols, int(changed_cols[-1]) + 2)
+
+        fraction = (bottom_block - top_block) * (right_block - left_block) / (rows * cols)
+        if fraction > self.crop_max_fraction:
+            return False
+
+        width, height = screenshot.image.size
+        box = (
+            left_block * width // cols,
+            top_block * height // rows,
+            right_block * width // cols,
+            bottom_block * height // rows
+        )
+        screenshot.image = screenshot.image.crop(box)
+        screenshot.crop_box = box
+
+        # 原始分辨率的图像按比例裁剪同一区域
+        full_width, full_height = screenshot.full_image.size
+        if (full_width, full_height) == (width, height):
+            screenshot.full_image = screenshot.image
+        else:
+            screenshot.full_image = screenshot.full_image.crop((
+                box[0] * full_width // width,
+                box[1] * full_height // height,
+                box[2] * full_width // width,
+                box[3] * full_height // height
+            ))
+        return True
+
+    def encode_screenshot(self, screenshot):
+        """把截图编码为base64，可选保存到调试目录"""
+        step = time.perf_counter()
+        screenshot.data, screenshot.size = self.encode(screenshot.image)
+        screenshot.mime_type = self.mime_type
+        screenshot.timings['encode'] = time.perf_counter() - step
+
+        if self.save_dir:
+            path = os.path.join(self.save_dir, f"screenshot_{int(time.time())}.{self.extension}")
+            try:
+                with open(path, 'wb') as f:
+                    f.write(self._get_buffer().getvalue())
+                screenshot.path = path
+            except OSError as e:
+                print(f"保存截图失败: {str(e)}")
+        return screenshot
+
+    def close(self):
+        with self.instances_lock:
+            instances, self.instances = self.instances, []
+            # 之后再截图的线程重新创建实例
+            self.local = threading.local()
+        for sct in instances:
+            try:
+                sct.close()
+            except Exception as e:
+                print(f"关闭截图实例失败: {str(e)}")
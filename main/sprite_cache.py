@@ -0,0 +1,203 @@
+import argparse
+import configparser
+import hashlib
+import os
+import threading
+import time
+
+import numpy as np
+from PIL import Image
+
+RESAMPLE_FILTERS = {
+    "LANCZOS": Image.LANCZOS,
+    "BICUBIC": Image.BICUBIC,
+    "BILINEAR": Image.BILINEAR,
+    "NEAREST": Image.NEAREST,
+}
+
+
+class SpriteDiskCache:
+    """缩放后立绘的磁盘缓存
+
+    以未压缩的 RGBA 数组（.npy）保存，读取时用内存映射，跳过PNG解码和缩放。
+    缓存键由源文件路径、大小、修改时间、缩放比例和重采样滤镜组成，任一项变化都会重新生成。
+    总大小超过 max_bytes 时按最近使用时间淘汰最旧的条目。
+    """
+
+    def __init__(self, cache_dir="cache/sprites", max_bytes=512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+        # 统计
+        self.hits = 0
+        self.misses = 0
+
+    def entry_path(self, source_path, scale, resample_name):
+        """根据源文件状态和缩放参数计算缓存文件路径"""
+        stat = os.stat(source_path)
+        raw = f"{os.path.abspath(source_path)}|{stat.st_size}|{stat.st_mtime_ns}|{scale:.6f}|{resample_name}"
+        digest = hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+        stem = os.path.splitext(os.path.basename(source_path))[0]
+        return os.path.join(self.cache_dir, f"{stem}-{digest}.npy")
+
+    def load(self, source_path, scale, resample_name):
+        """读取缓存的缩放结果，未命中时返回 None"""
+        path = self.entry_path(source_path, scale, resample_name)
+        try:
+            pixels = np.load(path, mmap_mode="r")
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+
+        if pixels.ndim != 3 or pixels.shape[2] != 4 or pixels.dtype != np.uint8:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        try:
+            # 更新访问时间，作为淘汰依据
+            os.utime(path, None)
+        except OSError:
+            pass
+        # 复制到内存中，不持有映射（Windows上映射中的文件无法被淘汰删除）
+        return Image.fromarray(np.array(pixels), "RGBA")
+
+    def store(self, source_path, scale, resample_name, image):
+        """保存缩放结果，写入临时文件后原子替换"""
+        path = self.entry_path(source_path, scale, resample_name)
+        # 预加载线程和 Tk 线程可能同时写同一个条目，临时文件按进程和线程区分
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "wb") as f:
+                np.save(f, np.asarray(image.convert("RGBA"), dtype=np.uint8))
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"写入立绘缓存失败: {str(e)}")
+            try:
+                os.remove(temp_path)
+            except OSError:
+                pass
+            return
+        self.evict()
+
+    def entries(self):
+        """返回 [(路径, 大小, 最近使用时间)]"""
+        result = []
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return result
+        for name in names:
+            if not name.endswith(".npy"):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            result.append((path, stat.st_size, stat.st_mtime))
+        return result
+
+    def total_bytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """超过上限时删除最久未使用的条目"""
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return
+        for path, size, _ in sorted(entries, key=lambda entry: entry[2]):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        for path, _, _ in self.entries():
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    @classmethod
+    def from_config(cls, parser: configparser.ConfigParser):
+        """根据config.ini的[UI]部分创建磁盘缓存，未启用时返回 None"""
+        if not parser.getboolean('UI', 'sprite_cache', fallback=True):
+            return None
+        try:
+            return cls(
+                cache_dir=parser.get('UI', 'sprite_cache_dir', fallback='cache/sprites'),
+                max_bytes=int(parser.getfloat('UI', 'sprite_cache_max_mb', fallback=512) * 1024 * 1024)
+            )
+        except OSError as e:
+            print(f"无法创建立绘缓存目录: {str(e)}")
+            return None
+
+
+def prewarm(parser):
+    """按当前配置生成所有立绘的缓存"""
+    from sprite_catalog import SpriteCatalog
+    from sprite_manager import SpriteManager
+
+    disk_cache = SpriteDiskCache.from_config(parser)
+    if disk_cache is None:
+        print("立绘缓存未启用（[UI] sprite_cache = false）")
+        return
+
+    scale = parser.getfloat('UI', 'scale', fallback=50.0) / 100.0
+    sprites = SpriteManager(
+        None,
+        SpriteCatalog.from_config(parser),
+        scale,
+        disk_cache=disk_cache,
+        resample=parser.get('UI', 'sprite_resample', fallback='LANCZOS').upper()
+    )
+    start = time.perf_counter()
+    for key, path in sprites.paths.items():
+        try:
+            sprites.load_image(path)
+        except Exception as e:
+            print(f"生成缓存失败 {key}: {str(e)}")
+    disk_cache.evict()
+    elapsed = time.perf_counter() - start
+    print(
+        f"立绘缓存预热完成: {len(sprites.paths)} 张 (命中 {disk_cache.hits}, 新生成 {disk_cache.misses}), "
+        f"耗时 {elapsed:.2f} 秒, 缓存占用 {disk_cache.total_bytes() / 1024 / 1024:.1f} MB"
+    )
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(description="立绘磁盘缓存管理")
+    arg_parser.add_argument("command", choices=["prewarm", "clear", "stats"], help="预热 / 清空 / 查看缓存")
+    arg_parser.add_argument("--config", default="config.ini", help="配置文件路径")
+    args = arg_parser.parse_args()
+
+    parser = configparser.ConfigParser()
+    parser.read(args.config, encoding='utf-8')
+
+    if args.command == "prewarm":
+        prewarm(parser)
+        return
+
+    disk_cache = SpriteDiskCache.from_config(parser)
+    if disk_cache is None:
+        print("立绘缓存未启用（[UI] sprite_cache = false）")
+        return
+    if args.command == "clear":
+        disk_cache.clear()
+        print("立绘缓存已清空")
+    else:
+        entries = disk_cache.entries()
+        print(
+            f"立绘缓存: {len(entries)} 个条目, {disk_cache.total_bytes() / 1024 / 1024:.1f} MB "
+            f"/ 上限 {disk_cache.max_bytes / 1024 / 1024:.0f} MB ({disk_cache.cache_dir})"
+        )
+
+
+if __name__ == "__main__":
+    main()
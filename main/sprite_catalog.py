@@ -0,0 +1,127 @@
+import configparser
+import os
+import random
+
+
+class SpriteCatalog:
+    """立绘目录索引：扫描一次 image_dir，按情感索引所有 <情感>_<编号>.png 变体
+
+    切换表情时只做字典查找，不再访问文件系统。支持按权重随机选择、
+    不连续重复同一张，以及为某个情感配置循环播放的动画序列。
+    """
+
+    def __init__(self, image_dir="images", weights=None, no_repeat=False, animations=None):
+        self.image_dir = image_dir
+        self.weights = weights or {}        # key -> 权重，默认 1
+        self.no_repeat = no_repeat
+        self.animations = animations or {}  # 情感 -> ([key, ...], 帧间隔毫秒)
+
+        self.paths = {}     # key -> 路径
+        self.variants = {}  # 情感 -> [key, ...]（按编号排序）
+        self.last_choice = {}
+        self.rng = random.Random()
+        self.scan()
+
+    def scan(self):
+        """重新扫描立绘目录"""
+        found = []
+        try:
+            names = os.listdir(self.image_dir)
+        except OSError as e:
+            print(f"读取立绘目录失败: {str(e)}")
+            names = []
+
+        for name in names:
+            stem, ext = os.path.splitext(name)
+            if ext.lower() != ".png":
+                continue
+            emotion, _, number = stem.rpartition("_")
+            if not emotion or not number.isdigit():
+                continue
+            found.append((emotion, int(number), stem, os.path.join(self.image_dir, name)))
+
+        paths = {}
+        variants = {}
+        for emotion, _, key, path in sorted(found):
+            paths[key] = path
+            variants.setdefault(emotion, []).append(key)
+        self.paths = paths
+        self.variants = variants
+        self.last_choice = {}
+
+        total = len(paths)
+        print(f"立绘目录 {self.image_dir}: {len(variants)} 种情感, {total} 张立绘")
+        return total
+
+    def has(self, key):
+        return key in self.paths
+
+    def choose(self, emotion):
+        """为情感随机选择一张立绘，返回 key；没有该情感的立绘时返回 None"""
+        keys = self.variants.get(emotion)
+        if not keys:
+            return None
+
+        candidates = keys
+        last = self.last_choice.get(emotion)
+        if self.no_repeat and last is not None and len(keys) > 1:
+            candidates = [key for key in keys if key != last]
+
+        if self.weights:
+            weights = [self.weights.get(key, 1.0) for key in candidates]
+            if sum(weights) > 0:
+                key = self.rng.choices(candidates, weights)[0]
+            else:
+                key = self.rng.choice(candidates)
+        else:
+            key = self.rng.choice(candidates)
+
+        self.last_choice[emotion] = key
+        return key
+
+    def animation(self, emotion):
+        """情感的动画序列 ([key, ...], 帧间隔毫秒)，未配置或帧不存在时返回 None"""
+        sequence = self.animations.get(emotion)
+        if not sequence:
+            return None
+        keys, interval = sequence
+        keys = [key for key in keys if key in self.paths]
+        if len(keys) < 2:
+            return None
+        return keys, interval
+
+    @classmethod
+    def from_config(cls, parser: configparser.ConfigParser):
+        """根据config.ini创建立绘目录
+
+        [UI] image_dir、sprite_no_repeat
+        [SpriteWeights] <情感>_<编号> = 权重
+        [SpriteAnimation] <情感> = 编号序列（如 1,2,3,2），<情感>_interval = 帧间隔毫秒，interval 为默认间隔
+        """
+        weights = {}
+        if parser.has_section('SpriteWeights'):
+            for key, value in parser.items('SpriteWeights'):
+                try:
+                    weights[key] = max(0.0, float(value))
+                except ValueError:
+                    print(f"无效的立绘权重: {key} = {value}")
+
+        animations = {}
+        if parser.has_section('SpriteAnimation'):
+            default_interval = parser.getint('SpriteAnimation', 'interval', fallback=200)
+            for emotion, value in parser.items('SpriteAnimation'):
+                if emotion == 'interval' or emotion.endswith('_interval'):
+                    continue
+                numbers = [part.strip() for part in value.split(',') if part.strip()]
+                if not all(number.isdigit() for number in numbers):
+                    print(f"无效的动画序列: {emotion} = {value}")
+                    continue
+                interval = parser.getint('SpriteAnimation', f'{emotion}_interval', fallback=default_interval)
+                animations[emotion] = ([f"{emotion}_{number}" for number in numbers], max(16, interval))
+
+        return cls(
+            image_dir=parser.get('UI', 'image_dir', fallback='images'),
+            weights=weights,
+            no_repeat=parser.getboolean('UI', 'sprite_no_repeat', fallback=False),
+            animations=animations
+        )
@@ -0,0 +1,168 @@
+import queue
+import threading
+import time
+
+from PIL import Image, ImageTk
+
+from sprite_cache import RESAMPLE_FILTERS
+
+
+class SpriteManager:
+    """立绘管理：启动时在后台线程解码并缩放所有立绘，切换表情时直接使用现成的 PhotoImage
+
+    立绘列表来自 SpriteCatalog。解码和缩放在工作线程中完成，
+    PhotoImage 只能在 Tk 线程中创建，由 Tk 线程的 after() 定时从队列中取出并转换。
+    预加载尚未完成时请求的立绘会在 Tk 线程中同步加载（与原来的首次加载相同）。
+    """
+
+    # 每次 after 回调最多转换的张数，避免一次上传太多图片卡住界面
+    CONVERT_PER_TICK = 2
+    CONVERT_INTERVAL = 15  # 毫秒
+
+    def __init__(self, root, catalog, scale=1.0, disk_cache=None, resample="LANCZOS"):
+        self.root = root
+        self.catalog = catalog  # SpriteCatalog，提供 key -> 路径
+        self.scale = scale
+        self.disk_cache = disk_cache  # SpriteDiskCache，缩放结果的磁盘缓存
+        self.resample_name = resample if resample in RESAMPLE_FILTERS else "LANCZOS"
+        self.resample = RESAMPLE_FILTERS[self.resample_name]
+
+        self.photos = {}  # key -> PhotoImage，只在 Tk 线程访问
+        self.sizes = {}   # key -> (宽, 高)
+        self.ready = queue.Queue()  # 工作线程解码完成的 (key, PIL图片)，每次预加载换一个新队列
+        self.worker = None
+        self.stop_event = None  # 当前预加载的停止标记
+        self.loading = False
+
+        # 统计
+        self.load_seconds = 0.0
+        self.bytes_total = 0
+
+    @property
+    def paths(self):
+        return self.catalog.paths
+
+    def load_image(self, path):
+        """解码并缩放一张立绘，返回 RGBA 的 PIL 图片；有磁盘缓存时优先读取缓存"""
+        if self.disk_cache is not None:
+            pil_image = self.disk_cache.load(path, self.scale, self.resample_name)
+            if pil_image is not None:
+                return pil_image
+
+        pil_image = Image.open(path)
+
+        # 确保保留透明通道
+        if pil_image.mode != 'RGBA':
+            pil_image = pil_image.convert('RGBA')
+
+        # 应用缩放
+        if self.scale != 1.0:
+            new_width = int(pil_image.width * self.scale)
+            new_height = int(pil_image.height * self.scale)
+            pil_image = pil_image.resize((new_width, new_height), self.resample)
+        else:
+            pil_image.load()
+
+        if self.disk_cache is not None:
+            self.disk_cache.store(path, self.scale, self.resample_name, pil_image)
+        return pil_image
+
+    def start_preload(self, first=None):
+        """启动后台预加载，first 中的立绘优先处理；已在预加载时不重复启动"""
+        if self.worker is not None and self.worker.is_alive() and not self.stop_event.is_set():
+            return
+        keys = [key for key in (first or ()) if key in self.paths]
+        keys += [key for key in self.paths if key not in keys]
+
+        self.loading = True
+        self.ready = queue.Queue()
+        self.stop_event = threading.Event()
+        self.worker = threading.Thread(
+            target=self._preload_worker,
+            args=(keys, self.ready, self.stop_event),
+            daemon=True
+        )
+        self.worker.start()
+        self.root.after(self.CONVERT_INTERVAL, self._convert_ready, self.ready)
+
+    def cancel_preload(self):
+        """停止当前的预加载，工作线程处理完手上这张后退出，结果不再使用"""
+        if self.stop_event is not None:
+            self.stop_event.set()
+        self.loading = False
+
+    def _preload_worker(self, keys, ready, stop_event):
+        start = time.perf_counter()
+        for key in keys:
+            if stop_event.is_set():
+                return
+            try:
+                ready.put((key, self.load_image(self.paths[key])))
+            except Exception as e:
+                print(f"预加载立绘失败 {key}: {str(e)}")
+        self.load_seconds = time.perf_counter() - start
+        ready.put(None)  # 结束标记
+
+    def _convert_ready(self, ready):
+        """在 Tk 线程中把解码好的图片转换为 PhotoImage"""
+        if ready is not self.ready:
+            # 已被 reload 取代的预加载
+            return
+        for _ in range(self.CONVERT_PER_TICK):
+            try:
+                item = ready.get_nowait()
+            except queue.Empty:
+                break
+
+            if item is None:
+                self.loading = False
+                self.report()
+                return
+            key, pil_image = item
+            if key not in self.photos:
+                self._store(key, pil_image)
+
+        self.root.after(self.CONVERT_INTERVAL, self._convert_ready, ready)
+
+    def _store(self, key, pil_image):
+        self.photos[key] = ImageTk.PhotoImage(pil_image)
+        self.sizes[key] = pil_image.size
+        self.bytes_total += pil_image.width * pil_image.height * 4
+
+    def get(self, key):
+        """获取立绘的 (PhotoImage, (宽, 高))，必须在 Tk 线程调用；不存在或加载失败时返回 None"""
+        photo = self.photos.get(key)
+        if photo is not None:
+            return photo, self.sizes[key]
+
+        path = self.paths.get(key)
+        if path is None:
+            return None
+        # 预加载还没轮到这张：同步加载
+        try:
+            self._store(key, self.load_image(path))
+        except Exception as e:
+            print(f"加载立绘失败: {str(e)}")
+            return None
+        return self.photos[key], self.sizes[key]
+
+    def reload(self):
+        """重新扫描立绘目录并重新预加载（文件未变化的立绘会命中磁盘缓存）
+
+        正在预加载时先停止旧的预加载，它尚未转换的结果直接丢弃。
+        """
+        self.cancel_preload()
+        self.catalog.scan()
+        self.photos = {}
+        self.sizes = {}
+        self.bytes_total = 0
+        self.start_preload()
+
+    def report(self):
+        """打印预加载耗时和内存占用"""
+        if self.disk_cache is not None:
+            print(f"立绘磁盘缓存: 命中 {self.disk_cache.hits}, 新生成 {self.disk_cache.misses}")
+        print(
+            f"立绘预加载完成: {len(self.photos)} 张, 解码缩放耗时 {self.load_seconds:.2f} 秒, "
+            f"像素数据约 {self.bytes_total / 1024 / 1024:.1f} MB"
+        )
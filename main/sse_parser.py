@@ -0,0 +1,195 @@
+import json
+
+
+class StreamError(Exception):
+    """流式响应中途返回的错误事件"""
+
+
+class SSEEvent:
+    """一个Server-Sent Events事件"""
+
+    __slots__ = ("event", "data", "id")
+
+    def __init__(self, event="message", data="", id=None):
+        self.event = event
+        self.data = data
+        self.id = id
+
+
+class SSEParser:
+    """增量SSE解析器：输入任意切分的原始字节，输出完整的事件
+
+    支持 \\n、\\r\\n、\\r 三种换行，多行 data 字段按 \\n 拼接，忽略注释行（以 : 开头）。
+    内部使用同一个 bytearray 作为缓冲，每次 feed 只在末尾整体删除已消费部分。
+    """
+
+    def __init__(self):
+        self.buffer = bytearray()
+        self.event_type = ""
+        self.data_lines = []
+        self.last_event_id = None
+
+    def feed(self, chunk):
+        """输入一段字节，返回其中完整的事件列表"""
+        buffer = self.buffer
+        buffer += chunk
+
+        if b"\r" in buffer:
+            lines = self._split_lines_cr()
+        else:
+            # 常见情况：只有 \n 换行，一次切分所有完整的行
+            last = buffer.rfind(b"\n")
+            if last < 0:
+                return []
+            lines = bytes(buffer[:last]).split(b"\n")
+            del buffer[:last + 1]
+
+        events = []
+        process_line = self._process_line
+        for line in lines:
+            event = process_line(line)
+            if event is not None:
+                events.append(event)
+        return events
+
+    def _split_lines_cr(self):
+        """按 \r\n / \r / \n 切分缓冲中的完整行"""
+        buffer = self.buffer
+        lines = []
+        pos = 0
+        size = len(buffer)
+        while pos < size:
+            lf = buffer.find(b"\n", pos)
+            cr = buffer.find(b"\r", pos, lf if lf >= 0 else size)
+            if cr >= 0:
+                # \r 在缓冲末尾时无法判断是否为 \r\n，等待更多数据
+                if cr == size - 1:
+                    break
+                lines.append(bytes(buffer[pos:cr]))
+                pos = cr + 2 if buffer[cr + 1] == 0x0A else cr + 1
+            elif lf >= 0:
+                lines.append(bytes(buffer[pos:lf]))
+                pos = lf + 1
+            else:
+                break
+        if pos:
+            del buffer[:pos]
+        return lines
+
+    def _process_line(self, line):
+        """处理一行，遇到空行时返回分发的事件"""
+        # 快速路径：绝大多数行是 "data: ..."
+        if line[:6] == b"data: ":
+            self.data_lines.append(line[6:].decode("utf-8"))
+            return None
+
+        if not line:
+            if not self.data_lines:
+                self.event_type = ""
+                return None
+            event = SSEEvent(self.event_type or "message", "\n".join(self.data_lines), self.last_event_id)
+            self.event_type = ""
+            self.data_lines = []
+            return event
+
+        if line[0] == 0x3A:  # ':' 注释
+            return None
+
+        colon = line.find(b":")
+        if colon < 0:
+            field, value = line, b""
+        else:
+            field = line[:colon]
+            value = line[colon + 1:]
+            if value[:1] == b" ":
+                value = value[1:]
+
+        if field == b"data":
+            self.data_lines.append(value.decode("utf-8"))
+        elif field == b"event":
+            self.event_type = value.decode("utf-8")
+        elif field == b"id":
+            self.last_event_id = value.decode("utf-8")
+        # retry 等其他字段对本客户端无意义，忽略
+        return None
+
+    def flush(self):
+        """流结束时分发未以空行结尾的最后一个事件"""
+        events = []
+        if self.buffer:
+            line = bytes(self.buffer)
+            # 末尾的 \r 是行结束符（feed 中因无法判断是否为 \r\n 而留下）
+            if line.endswith(b"\r"):
+                line = line[:-1]
+            event = self._process_line(line)
+            self.buffer.clear()
+            if event is not None:
+                events.append(event)
+        event = self._process_line(b"")
+        if event is not None:
+            events.append(event)
+        return events
+
+
+class ChatStreamParser:
+    """解析 OpenAI 兼容的 chat/completions 流
+
+    feed 返回新增的文本片段；同时记录 finish_reason、usage，
+    收到 [DONE] 后 done 为 True，收到错误事件时抛出 StreamError。
+    不依赖 object 字段，兼容省略该字段的服务商。
+    """
+
+    def __init__(self):
+        self.sse = SSEParser()
+        self.done = False
+        self.finish_reason = None
+        self.usage = None
+        self.chunks = 0
+
+    def feed(self, raw):
+        return self._handle(self.sse.feed(raw))
+
+    def close(self):
+        """流结束时处理缓冲中剩余的数据"""
+        return self._handle(self.sse.flush())
+
+    def _handle(self, events):
+        contents = []
+        for event in events:
+            if self.done:
+                break
+            data = event.data
+            if data == "[DONE]":
+                self.done = True
+                break
+
+            try:
+                chunk = json.loads(data)
+            except json.JSONDecodeError:
+                chunk = None
+            if not isinstance(chunk, dict):
+                # 无法解析，或是合法JSON但不是对象（列表、字符串等）
+                if event.event == "error":
+                    raise StreamError(data)
+                print(f"无法解析的流式数据: {data[:100]}")
+                continue
+
+            if event.event == "error" or "error" in chunk:
+                error = chunk.get("error", chunk)
+                message = error.get("message", error) if isinstance(error, dict) else error
+                raise StreamError(f"流式响应错误: {message}")
+
+            self.chunks += 1
+            if chunk.get("usage"):
+                self.usage = chunk["usage"]
+
+            for choice in chunk.get("choices") or ():
+                if not isinstance(choice, dict):
+                    continue
+                delta = choice.get("delta") or {}
+                content = delta.get("content")
+                if content:
+                    contents.append(content)
+                if choice.get("finish_reason"):
+                    self.finish_reason = choice["finish_reason"]
+        return contents
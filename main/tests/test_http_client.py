@@ -0,0 +1,81 @@
+"""HttpTransport.abort 的回归测试
+
+用法（在 main 目录下）：python -m pytest tests
+"""
+import json
+import os
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from http_client import HttpTransport  # noqa: E402
+
+
+class HangingHandler(BaseHTTPRequestHandler):
+    """按请求中的 delay 秒数延迟响应，模拟迟迟不返回的模型服务"""
+
+    def do_POST(self):
+        length = int(self.headers['Content-Length'])
+        body = json.loads(self.rfile.read(length))
+        time.sleep(body.get("delay", 0))
+        data = json.dumps({"ok": True}).encode()
+        try:
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+        except OSError:
+            pass
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def transport():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), HangingHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    transport = HttpTransport(f"http://127.0.0.1:{server.server_address[1]}", pool_size=2, http2=False)
+    yield transport
+    transport.close()
+    server.shutdown()
+    server.server_close()
+
+
+def active_connections(transport):
+    pools = transport.adapter.poolmanager.pools
+    return sum(len(pools[key].active) for key in list(pools.keys()))
+
+
+def test_abort_releases_hanging_connections(transport):
+    for _ in range(5):
+        errors = []
+
+        def worker():
+            try:
+                transport.post("chat/completions", {"delay": 5})
+            except Exception as e:
+                errors.append(e)
+
+        thread = threading.Thread(target=worker)
+        start = time.perf_counter()
+        thread.start()
+        time.sleep(0.2)
+        transport.abort()
+        thread.join(timeout=2)
+
+        assert not thread.is_alive()
+        assert errors
+        assert time.perf_counter() - start < 2
+
+    assert active_connections(transport) == 0
+
+    # 中止后连接池仍可正常使用
+    assert transport.post("chat/completions", {"delay": 0}).json() == {"ok": True}
+    assert active_connections(transport) == 0
@@ -0,0 +1,171 @@
+import unicodedata
+
+# 不能出现在行首的标点（避头）
+NO_LINE_START = set("，。、．・！？：；）」』】〕》〉〗｝］…‥ー～ゝゞ々ぁぃぅぇぉっゃゅょァィゥェォッャュョ"
+                    ",.!?:;)]}%”’")
+# 不能出现在行尾的标点（避尾）
+NO_LINE_END = set("（「『【〔《〈〖｛［“‘([{")
+
+
+def is_wide(char):
+    """中日韩等宽字符，任意两个之间都可以换行"""
+    return unicodedata.east_asian_width(char) in ("W", "F")
+
+
+class GlyphWidthCache:
+    """缓存单个字符的宽度，每个字符只调用一次 measure（Tk字体测量需要跨进程往返）"""
+
+    def __init__(self, measure):
+        self.measure = measure
+        self.widths = {}
+
+    def width(self, char):
+        width = self.widths.get(char)
+        if width is None:
+            width = self.measure(char)
+            self.widths[char] = width
+        return width
+
+    def text_width(self, text):
+        widths = self.widths
+        total = 0
+        for char in text:
+            width = widths.get(char)
+            if width is None:
+                width = self.width(char)
+            total += width
+        return total
+
+
+class WrappedLine:
+    """换行结果中的一行：文本、像素宽度、在原文中的起始位置"""
+
+    __slots__ = ("text", "width", "start")
+
+    def __init__(self, text, width, start):
+        self.text = text
+        self.width = width
+        self.start = start
+
+
+def _units(text):
+    """把文本切分为不可拆分的排版单元，返回 (单元文本, 起始位置)
+
+    西文单词整体为一个单元；中日文每个字为一个单元；空格和换行单独成单元。
+    避头标点并入前一个单元，全角的避头标点之后允许换行；避尾标点与后一个单元合并。
+    """
+    units = []
+    word_start = -1  # 正在累积的西文单词起点
+    glue_start = -1  # 等待与下一个单元合并的避尾标点起点
+
+    for i, char in enumerate(text):
+        if char == "\n" or char == " ":
+            if word_start >= 0:
+                units.append((text[word_start:i], word_start))
+                word_start = -1
+            if glue_start >= 0:
+                units.append((text[glue_start:i], glue_start))
+                glue_start = -1
+            units.append((char, i))
+            continue
+
+        wide = is_wide(char)
+        if char in NO_LINE_START:
+            # 避头：跟在前一个单元后面
+            if word_start < 0:
+                if glue_start >= 0:
+                    word_start, glue_start = glue_start, -1
+                elif units and units[-1][0] not in ("\n", " "):
+                    word_start = units.pop()[1]
+                else:
+                    word_start = i
+            if wide:
+                units.append((text[word_start:i + 1], word_start))
+                word_start = -1
+        elif char in NO_LINE_END:
+            if word_start >= 0:
+                units.append((text[word_start:i], word_start))
+                word_start = -1
+            if glue_start < 0:
+                glue_start = i
+        elif wide:
+            if word_start >= 0:
+                units.append((text[word_start:i], word_start))
+                word_start = -1
+            start = glue_start if glue_start >= 0 else i
+            glue_start = -1
+            units.append((text[start:i + 1], start))
+        elif word_start < 0:
+            # 西文字符：开始一个新单词
+            word_start = glue_start if glue_start >= 0 else i
+            glue_start = -1
+
+    if glue_start >= 0 and word_start < 0:
+        word_start = glue_start
+    if word_start >= 0:
+        units.append((text[word_start:], word_start))
+    return units
+
+
+def wrap_lines(text, max_width, glyphs: GlyphWidthCache):
+    """单次线性扫描换行，返回 WrappedLine 列表
+
+    与逐字测量整行相比，每个字符的宽度只测量一次并缓存，行宽由字符宽度累加得到。
+    """
+    lines = []
+    line_units = []
+    line_width = 0
+    line_start = 0
+
+    def flush(next_start):
+        nonlocal line_units, line_width, line_start
+        line_text = "".join(line_units)
+        # 行尾空格不计入宽度
+        stripped = line_text.rstrip(" ")
+        if len(stripped) != len(line_text):
+            line_width -= (len(line_text) - len(stripped)) * glyphs.width(" ")
+        lines.append(WrappedLine(stripped, line_width, line_start))
+        line_units = []
+        line_width = 0
+        line_start = next_start
+
+    for unit, start in _units(text):
+        if unit == "\n":
+            flush(start + 1)
+            continue
+
+        unit_width = glyphs.text_width(unit)
+        if line_width + unit_width <= max_width:
+            if not line_units:
+                if unit == " " and lines:
+                    # 自动换行后的行首空格丢弃
+                    line_start = start + 1
+                    continue
+                line_start = start
+            line_units.append(unit)
+            line_width += unit_width
+        elif unit == " ":
+            # 空格放不下：在此处换行
+            flush(start + 1)
+        elif unit_width > max_width:
+            # 单元比整行还宽（超长单词）：从新行开始按字符拆分
+            # （拆分位置只取决于单词本身，从任意行起点重新排版结果一致）
+            if line_units:
+                flush(start)
+            line_start = start
+            for offset, char in enumerate(unit):
+                char_width = glyphs.width(char)
+                if line_units and line_width + char_width > max_width:
+                    flush(start + offset)
+                line_units.append(char)
+                line_width += char_width
+        else:
+            if line_units:
+                flush(start)
+            line_start = start
+            line_units.append(unit)
+            line_width = unit_width
+
+    if line_units:
+        flush(len(text))
+    return lines
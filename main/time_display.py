@@ -1,19 +1,37 @@
 import tkinter as tk
 import time
-import multiprocessing
-import os
 
 
-def run_time_display(time_queue=None):
-    """显示时间窗口"""
-    window = TimeDisplay(time_queue)
+def run_time_display():
+    """单独运行时间窗口（调试用）"""
+    root = tk.Tk()
+    root.withdraw()
+    display = TimeDisplay(root)
+    display.show_time()
+    root.mainloop()
+
+
+# 渐隐缓动函数：输入进度 0~1，输出完成度 0~1
+EASINGS = {
+    'linear': lambda t: t,
+    'ease_in': lambda t: t * t,
+    'ease_out': lambda t: 1 - (1 - t) * (1 - t),
+    'ease_in_out': lambda t: t * t * (3 - 2 * t),
+}
 
 
 class TimeDisplay:
-    def __init__(self, time_queue=None):
+    """时间悬浮窗：常驻在立绘进程中的 Toplevel，需要时显示并渐隐
+
+    只有窗口可见时才更新时间，更新对齐到整秒；隐藏后不再有任何定时器。
+    渐隐的透明度序列在创建时预先计算好，播放时按帧设置，不再从窗口读回当前透明度。
+    """
+
+    def __init__(self, master, hold_seconds=5.0, fade_seconds=1.0, easing='linear', fade_fps=30):
         # 创建窗口
-        self.window = tk.Tk()
+        self.window = tk.Toplevel(master)
         self.window.title("Time Display")
+        self.window.withdraw()  # 初始隐藏
 
         # 设置无边框窗口
         self.window.overrideredirect(True)
@@ -36,57 +54,79 @@ class TimeDisplay:
         )
         self.time_label.pack(fill=tk.BOTH, expand=True)
 
-        # 启动时间更新
-        self.update_time()
-
-        # 如果有队列，监听显示请求
-        if time_queue:
-            self.time_queue = time_queue
-            self.window.after(100, self.check_queue)
-        else:
-            # 直接显示
-            self.show_time()
-
-        self.window.mainloop()
-
-    def check_queue(self):
-        """检查队列中的显示请求"""
-        try:
-            if not self.time_queue.empty():
-                message = self.time_queue.get_nowait()
-                if message == "show":
-                    self.show_time()
-        except:
-            pass
-        self.window.after(100, self.check_queue)
+        # 显示时长和渐隐时间线
+        self.hold_ms = max(0, int(hold_seconds * 1000))
+        frames = max(1, int(fade_seconds * fade_fps))
+        self.fade_interval = max(1, int(fade_seconds * 1000 / frames))
+        ease = EASINGS.get(easing, EASINGS['linear'])
+        self.fade_timeline = [1.0 - ease(i / frames) for i in range(1, frames + 1)]
+
+        self.visible = False
+        self.tick_timer = None
+        self.hold_timer = None
+        self.fade_timer = None
+
+    @classmethod
+    def from_config(cls, master, parser):
+        """根据config.ini的[TimeDisplay]部分创建"""
+        return cls(
+            master,
+            hold_seconds=parser.getfloat('TimeDisplay', 'hold_seconds', fallback=5.0),
+            fade_seconds=parser.getfloat('TimeDisplay', 'fade_seconds', fallback=1.0),
+            easing=parser.get('TimeDisplay', 'fade_easing', fallback='linear'),
+            fade_fps=parser.getint('TimeDisplay', 'fade_fps', fallback=30)
+        )
 
     def show_time(self):
-        """显示时间窗口"""
+        """显示时间窗口，停留 hold_seconds 后渐隐"""
+        self._cancel_timers()
+
         # 更新位置（屏幕顶部中央）
         screen_width = self.window.winfo_screenwidth()
         self.window.geometry(f"200x40+{screen_width // 2 - 100}+10")
 
-        # 设置透明度
+        # 先更新时间再显示，避免闪现旧内容
+        self.visible = True
+        self.update_time()
         self.window.attributes("-alpha", 1.0)
+        self.window.deiconify()
+        self.window.lift()
 
-        # 5秒后渐隐
-        self.fade_out()
+        self.hold_timer = self.window.after(self.hold_ms, self.fade_out)
 
-    def fade_out(self):
-        """渐隐效果"""
-        alpha = self.window.attributes("-alpha")
-        if alpha > 0.1:
-            alpha -= 0.05
-            self.window.attributes("-alpha", alpha)
-            self.window.after(50, self.fade_out)
+    def fade_out(self, frame=0):
+        """渐隐效果：按预先计算的时间线逐帧设置透明度"""
+        self.hold_timer = None
+        if frame < len(self.fade_timeline):
+            self.window.attributes("-alpha", self.fade_timeline[frame])
+            self.fade_timer = self.window.after(self.fade_interval, self.fade_out, frame + 1)
         else:
-            self.window.attributes("-alpha", 0.0)
+            self.hide()
+
+    def hide(self):
+        """隐藏窗口并停止所有定时器"""
+        self._cancel_timers()
+        self.visible = False
+        self.window.attributes("-alpha", 0.0)
+        self.window.withdraw()
+
+    def _cancel_timers(self):
+        for name in ('tick_timer', 'hold_timer', 'fade_timer'):
+            timer = getattr(self, name)
+            if timer:
+                self.window.after_cancel(timer)
+                setattr(self, name, None)
 
     def update_time(self):
-        """更新时间显示"""
-        current_time = time.strftime("%Y-%m-%d %H:%M:%S")
-        self.time_label.config(text=current_time)
-        self.window.after(1000, self.update_time)
+        """更新时间显示，只在可见时运行，下一次更新对齐到下一个整秒"""
+        self.tick_timer = None
+        if not self.visible:
+            return
+        now = time.time()
+        self.time_label.config(text=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(now)))
+        # 多等几毫秒，保证回调时已经跨过整秒
+        delay = int((1.0 - now % 1.0) * 1000) + 5
+        self.tick_timer = self.window.after(delay, self.update_time)
 
 
 if __name__ == "__main__":